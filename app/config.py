@@ -11,6 +11,95 @@ class Settings(BaseSettings):
     jwt_secret_key: str
     jwt_algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    # Upstream (OpenAI) client: HTTP pool, rate limits (0 = unlimited) and
+    # retries with jittered exponential backoff
+    upstream_max_connections: int = 100
+    upstream_max_keepalive: int = 20
+    upstream_keepalive_seconds: float = 30.0
+    upstream_timeout_seconds: float = 600.0
+    upstream_requests_per_minute: int = 500
+    upstream_tokens_per_minute: int = 200000
+    upstream_max_retries: int = 4
+    upstream_backoff_base_seconds: float = 0.5
+    upstream_backoff_max_seconds: float = 30.0
+    # Metrics of each worker process at /metrics (see app.metrics) and trace
+    # spans (exported through OpenTelemetry)
+    metrics_enabled: bool = True
+    tracing_enabled: bool = False
+    # Authentication: resolved‑user cache and bcrypt worker threads
+    auth_cache_size: int = 10000
+    auth_cache_ttl_seconds: int = 60
+    auth_hash_workers: int = 4
+    # Chat completion and prompt assembly
+    chat_model: str = "gpt-4.1"
+    chat_summary_model: str = "gpt-4.1-mini"
+    chat_context_budget_tokens: int = 8000
+    chat_reply_reserve_tokens: int = 4096
+    chat_context_max_messages: int = 400
+    # Streamed replies: deltas are merged into frames of up to this many
+    # bytes or milliseconds
+    stream_coalesce_bytes: int = 64
+    stream_coalesce_ms: int = 20
+    # Streamed replies are checkpointed to history every N deltas / seconds
+    stream_checkpoint_tokens: int = 50
+    stream_checkpoint_seconds: float = 2.0
+    # Optional cache of chat replies: exact prompt matches, plus questions
+    # whose embedding is at least this similar in the same context
+    response_cache_enabled: bool = False
+    response_cache_size: int = 5000
+    response_cache_ttl_seconds: int = 3600
+    response_cache_similarity: float = 0.95
+    # Per‑process write‑through cache of active sessions. Each use first
+    # reads the session's revision so writes from other workers are seen;
+    # skip that check only when running a single worker
+    history_cache_sessions: int = 10000
+    history_cache_ttl_seconds: int = 300
+    history_cache_validate: bool = True
+    # Write‑behind batching of message inserts: flushed once this many are
+    # waiting or the oldest has waited this long
+    history_write_behind: bool = False
+    history_write_batch_size: int = 200
+    history_write_interval_ms: int = 50
+    # Cold tier: a background task compacts messages older than this many
+    # days into compressed per‑session buckets of up to N messages. Reads
+    # only consult the buckets while this is on – keep it on once they exist
+    history_cold_tier: bool = False
+    history_cold_after_days: int = 30
+    history_cold_bucket_size: int = 200
+    history_compaction_interval_seconds: int = 3600
+    # Memory budget for the in‑process cache of KB embedding matrices
+    kb_index_cache_mb: int = 256
+    # Publish loaded KB indexes under kb_index_dir once per host and
+    # memory‑map them in every worker instead of loading a copy per worker
+    kb_shared_index: bool = True
+    # Storage format of embeddings in Mongo: float32, float16 or int8
+    kb_embedding_format: str = "float32"
+    # Approximate nearest‑neighbour search for large knowledge bases
+    kb_index_dir: str = "data/kb_indexes"
+    kb_ann_backend: str = "ivf_flat"
+    kb_ann_threshold: int = 5000
+    kb_ann_nprobe: int = 8
+    # Query embeddings: micro‑batched across concurrent requests and cached
+    kb_query_batch_ms: int = 5
+    kb_query_batch_size: int = 64
+    kb_query_cache_size: int = 10000
+    kb_query_cache_ttl_seconds: int = 3600
+    # Lexical (BM25) index: retrieval mode of chat turns (vector, lexical or
+    # hybrid), KB size from which hybrid queries prefilter by term, and the
+    # depth of each ranking fused by hybrid search
+    kb_retrieval_mode: str = "vector"
+    kb_lexical_prefilter_threshold: int = 2000
+    kb_lexical_candidates: int = 256
+    kb_hybrid_rrf_k: int = 60
+    # Background PDF ingestion
+    kb_upload_dir: str = "data/uploads"
+    kb_embed_batch_size: int = 100
+    kb_embed_concurrency: int = 4
+    # PDF text extraction (0 workers = one per CPU core)
+    pdf_extract_workers: int = 0
+    pdf_pages_per_task: int = 16
+    pdf_max_pages: int = 5000
+    pdf_max_text_mb: int = 64
 
     class Config:
         env_file = ".env"
@@ -1,5 +1,20 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+"""MongoDB client and database, created on first use (see :mod:`app.registry`)."""
+
 from app.config import settings
+from app.registry import lazy, registry
+
+
+@registry.provider("mongo", close=lambda client: client.close())
+def get_client():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    return AsyncIOMotorClient(settings.mongodb_uri)
+
+
+@registry.provider("mongo_db")
+def get_db():
+    return get_client()[settings.mongodb_db_name]
+
 
-client = AsyncIOMotorClient(settings.mongodb_uri)
-db = client[settings.mongodb_db_name]
+client = lazy(get_client)
+db = lazy(get_db)
@@ -0,0 +1,94 @@
+"""Declarative MongoDB index registry.
+
+Services declare the indexes their queries need (and the canonical shape of
+those queries) at import time with :func:`declare_index` and
+:func:`declare_query`. The app lifespan calls :func:`ensure_indexes` on
+startup, and ``python -m app.tools.check_indexes`` uses the declared queries
+to verify with ``explain()`` that none of them scans a collection or sorts
+in memory.
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from pymongo.errors import OperationFailure
+
+from app.db import db
+
+Keys = Sequence[Tuple[str, int]]
+
+
+class IndexSpec:
+    def __init__(self, collection: str, keys: Keys, **options: Any):
+        self.collection = collection
+        self.keys = list(keys)
+        self.options = options
+
+    @property
+    def name(self) -> str:
+        return self.options.get("name") or "_".join(f"{field}_{direction}" for field, direction in self.keys)
+
+
+class QuerySpec:
+    """A representative query used to check that some index serves it."""
+
+    def __init__(self, collection: str, name: str, filter: Dict[str, Any], sort: Optional[Keys] = None):
+        self.collection = collection
+        self.name = name
+        self.filter = filter
+        self.sort = list(sort) if sort else None
+
+
+INDEXES: List[IndexSpec] = []
+QUERIES: List[QuerySpec] = []
+
+
+def declare_index(collection: str, keys: Keys, **options: Any) -> None:
+    spec = IndexSpec(collection, keys, **options)
+    if all((s.collection, s.name) != (spec.collection, spec.name) for s in INDEXES):
+        INDEXES.append(spec)
+
+
+def declare_query(collection: str, name: str, filter: Dict[str, Any], sort: Optional[Keys] = None) -> None:
+    QUERIES.append(QuerySpec(collection, name, filter, sort))
+
+
+async def ensure_indexes() -> List[str]:
+    """Create every declared index that doesn't exist yet.
+
+    Returns the names of indexes that could not be built (e.g. a unique index
+    over existing duplicates) – those are reported, not fatal, so the API can
+    still start.
+    """
+    failed = []
+    for spec in INDEXES:
+        try:
+            await db[spec.collection].create_index(spec.keys, name=spec.name, **spec.options)
+        except OperationFailure as e:
+            print(f"Could not create index {spec.collection}.{spec.name}: {e}")
+            failed.append(f"{spec.collection}.{spec.name}")
+    return failed
+
+
+def _plan_stages(plan: Dict[str, Any]) -> List[str]:
+    stages = [plan.get("stage", "")]
+    for child in ("inputStage", "queryPlan"):
+        if child in plan:
+            stages += _plan_stages(plan[child])
+    for sub in plan.get("inputStages", []):
+        stages += _plan_stages(sub)
+    return stages
+
+
+async def explain_query(spec: QuerySpec) -> Tuple[List[str], List[str]]:
+    """Return ``(stages, problems)`` of the winning plan for *spec*."""
+    cursor = db[spec.collection].find(spec.filter)
+    if spec.sort:
+        cursor = cursor.sort(spec.sort)
+    explanation = await cursor.explain()
+    stages = _plan_stages(explanation["queryPlanner"]["winningPlan"])
+    problems = []
+    if "COLLSCAN" in stages:
+        problems.append("collection scan")
+    if "SORT" in stages:
+        problems.append("in-memory sort")
+    return stages, problems
@@ -1,15 +1,35 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.routers.auth import router as auth_router
 from app.routers.chat import router as chat_router
 from app.routers.history import router as history_router
 from app.routers.kb import router as kb_router
+from app.routers.metrics import router as metrics_router
+from app.config import settings
+from app.metrics import TimingMiddleware, enable_opentelemetry
+from app.indexes import ensure_indexes
+from app.registry import registry
+from app.services.cold_history import get_history_compactor
 from fastapi.middleware.cors import CORSMiddleware
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # every service has registered its indexes by now (imported via routers)
+    await ensure_indexes()
+    if settings.tracing_enabled:
+        enable_opentelemetry()
+    if settings.history_cold_tier:
+        get_history_compactor().start()
+    yield
+    # services, buffers, pools and clients created since startup
+    await registry.aclose()
+
+
 #CORS CONTROL
 
 
-app = FastAPI(title="ChatGPT Clone API")
+app = FastAPI(title="ChatGPT Clone API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,9 +38,12 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if settings.metrics_enabled:
+    app.add_middleware(TimingMiddleware)
 
 
 app.include_router(auth_router)
 app.include_router(chat_router)
 app.include_router(history_router)
 app.include_router(kb_router)
+app.include_router(metrics_router)
@@ -0,0 +1,323 @@
+"""Process‑local metrics in the Prometheus text format, plus trace hooks.
+
+Counters, gauges and histograms are declared at import time next to the
+code they measure and rendered by ``GET /metrics``. Existing ``stats``
+dicts (caches, scheduler…) are exposed as they are through
+:func:`register_stats`.
+
+Nothing is shared between worker processes: ``GET /metrics`` reports only
+the worker that happens to serve it. Every sample therefore carries a
+``worker="<host>:<pid>"`` label, so series of different workers never mix
+(a counter would otherwise seem to reset whenever another worker answers).
+Run with several workers, each has to be scraped on its own – e.g. one
+port per worker – and dashboards aggregate with ``sum by (...)`` over
+``worker``.
+
+:func:`timed` wraps a function so every call is observed in a histogram
+and, when span hooks are registered (:func:`add_span_hook`, e.g.
+:func:`enable_opentelemetry`), also runs inside a trace span. With
+``metrics_enabled`` off the decorator returns the function untouched, and
+without hooks a call costs two ``perf_counter`` reads and one bisect.
+"""
+
+import asyncio
+import contextlib
+import functools
+import os
+import socket
+import time
+from bisect import bisect_left
+from typing import Callable, ContextManager, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.config import settings
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metrics: List["Metric"] = []
+_stats: List[Tuple[str, str, Callable[[], dict]]] = []
+_span_hooks: List[Callable[[str, dict], ContextManager]] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Identifies this process in every sample (see the module docstring).
+WORKER = f"{socket.gethostname()}:{os.getpid()}"
+_WORKER_LABEL = f'worker="{_escape(WORKER)}"'
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    pairs.append(_WORKER_LABEL)
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        _metrics.append(self)
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        return self.labels() if not self.labelnames else None
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.type}"
+        for key, child in list(self._children.items()):
+            yield from self._render_child(key, child)
+
+    def _render_child(self, key, child) -> Iterable[str]:
+        yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        self._default().inc(amount)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self._default().dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    def _render_child(self, key, child: _HistogramValue) -> Iterable[str]:
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = 'le="%s"' % _format_value(bound)
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+        labels = _format_labels(self.labelnames, key)
+        yield f"{self.name}_sum{labels} {_format_value(child.sum)}"
+        yield f"{self.name}_count{labels} {child.count}"
+
+
+def register_stats(prefix: str, documentation: str, stats: Callable[[], dict]) -> None:
+    """Expose every numeric entry of ``stats()`` as gauge ``<prefix>_<key>``."""
+    _stats.append((prefix, documentation, stats))
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for prefix, documentation, stats in _stats:
+        try:
+            values = stats()
+        except Exception as e:
+            print("Metrics collection failed", prefix, e)
+            continue
+        for key, value in values.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"{prefix}_{key}"
+            lines.append(f"# HELP {name} {documentation}: {key}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{{{_WORKER_LABEL}}} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# --------------------------------- Tracing -------------------------------- #
+
+
+def add_span_hook(hook: Callable[[str, dict], ContextManager]) -> None:
+    """Run every :func:`timed` call inside ``hook(name, attributes)``."""
+    _span_hooks.append(hook)
+
+
+def remove_span_hook(hook: Callable[[str, dict], ContextManager]) -> None:
+    _span_hooks.remove(hook)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Trace span around a block; a no‑op without hooks."""
+    if not _span_hooks:
+        yield
+        return
+    with contextlib.ExitStack() as stack:
+        for hook in _span_hooks:
+            stack.enter_context(hook(name, attributes))
+        yield
+
+
+def enable_opentelemetry(tracer_name: str = "chatgpt-clone") -> bool:
+    """Export spans through the OpenTelemetry API, if it is installed."""
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        print("opentelemetry is not installed – tracing disabled")
+        return False
+    tracer = trace.get_tracer(tracer_name)
+    add_span_hook(lambda name, attributes: tracer.start_as_current_span(name, attributes=attributes))
+    return True
+
+
+def timed(histogram: Histogram, span_name: Optional[str] = None, **labels):
+    """Decorator: observe the duration of each call (sync or async) in
+    *histogram* with *labels*, inside a trace span named *span_name*."""
+
+    def decorator(fn):
+        if not settings.metrics_enabled:
+            return fn
+        child = histogram.labels(**labels)
+        name = span_name or fn.__qualname__
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    if _span_hooks:
+                        with span(name, **labels):
+                            return await fn(*args, **kwargs)
+                    return await fn(*args, **kwargs)
+                finally:
+                    child.observe(time.perf_counter() - start)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    if _span_hooks:
+                        with span(name, **labels):
+                            return fn(*args, **kwargs)
+                    return fn(*args, **kwargs)
+                finally:
+                    child.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+# ----------------------------- HTTP middleware ----------------------------- #
+
+HTTP_REQUESTS = Histogram(
+    "http_request_duration_seconds",
+    "Time from request to the last body byte (whole stream for streaming responses)",
+    ("method", "route", "status"),
+)
+HTTP_IN_PROGRESS = Gauge("http_requests_in_progress", "Requests being handled")
+
+
+class TimingMiddleware:
+    """ASGI middleware recording :data:`HTTP_REQUESTS` per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        try:
+            with span(f"{scope['method']} {scope['path']}"):
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            route = scope.get("route")
+            HTTP_REQUESTS.labels(
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status,
+            ).observe(time.perf_counter() - start)
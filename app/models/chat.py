@@ -5,6 +5,9 @@ class ChatRequest(BaseModel):
     session_id: Optional[str] = None
     kb_id: Optional[str] = None  # knowledge base to use for RAG (optional)
     message: str
+    # Continue the session's interrupted (truncated) last reply instead of
+    # answering a new message; `message` is ignored.
+    resume: bool = False
 
 class ChatResponse(BaseModel):
     session_id: str
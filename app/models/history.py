@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
 
@@ -8,6 +8,14 @@ class MessageHistory(BaseModel):
     role: str
     content: str
     timestamp: datetime
+    # Set on assistant replies whose stream was interrupted before finishing.
+    truncated: bool = False
+
+
+class MessagePage(BaseModel):
+    messages: List[MessageHistory]
+    # Opaque token for the following page; None once the end is reached.
+    next_cursor: Optional[str] = None
 
 
 # A lightweight summary of a chat session – useful for populating a sidebar
@@ -22,3 +30,5 @@ class SessionSummary(BaseModel):
     session_id: str
     last_message: str
     timestamp: datetime
+    title: Optional[str] = None
+    message_count: Optional[int] = None
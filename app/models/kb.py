@@ -1,12 +1,22 @@
 """Models for Knowledge Base (PDF‑based RAG)."""
 
-from typing import List, Optional
+from typing import List, Literal, Optional
 from pydantic import BaseModel, Field
 
 
-class KBUploadResponse(BaseModel):
-    kb_id: str = Field(..., description="Identifier of the created knowledge base")
-    chunks: int = Field(..., description="Number of text chunks indexed")
+class KBJobStatus(BaseModel):
+    job_id: str = Field(..., description="Identifier of the ingestion job")
+    kb_id: str = Field(..., description="Identifier of the knowledge base being created")
+    filename: str
+    status: str = Field(..., description="queued, running, completed or failed")
+    pages: int = Field(0, description="Pages extracted so far")
+    chunks: int = Field(0, description="Text chunks produced so far")
+    chunks_embedded: int = Field(0, description="Chunks embedded and stored so far")
+    chunks_reused: int = Field(0, description="Chunks whose embedding was reused from the shared store")
+    chunks_new: int = Field(0, description="Chunks that needed a fresh embedding call")
+    error: Optional[str] = None
+    created_at: str
+    updated_at: str
 
 
 class KBListItem(BaseModel):
@@ -20,6 +30,9 @@ class QueryRequest(BaseModel):
     kb_id: str
     query: str
     top_k: int = 3
+    mode: Literal["vector", "lexical", "hybrid"] = Field(
+        "vector", description="vector similarity, BM25 term matching, or a fusion of both"
+    )
 
 
 class QueryResponse(BaseModel):
@@ -0,0 +1,120 @@
+"""Process‑wide resources, created on first use and closed by the app lifespan.
+
+Clients and services are declared with :meth:`Registry.provider`, which turns
+a factory into a getter. Nothing is built at import time: the first call of
+the getter creates the instance and every later call returns the same one,
+so each resource exists once per process however many modules use it. The
+lifespan calls :meth:`Registry.aclose` on shutdown, which closes whatever
+was created, newest first – services before the clients they were built on.
+
+Modules that expose a resource as a module attribute use :func:`lazy`
+(``kbs = lazy(get_kb_service)``); the stand‑in forwards every attribute to
+the real instance and only creates it when first touched.
+"""
+
+import inspect
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class Registry:
+    def __init__(self):
+        self._factories: Dict[str, Tuple[Callable[[], Any], Optional[Callable[[Any], Any]]]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._order: List[str] = []  # creation order
+
+    def provider(self, name: str, close: Optional[Callable[[Any], Any]] = None):
+        """Decorator registering *factory* as resource *name*.
+
+        *close* (sync or async) receives the instance on shutdown.
+        """
+
+        def decorator(factory: Callable[[], T]) -> Callable[[], T]:
+            self._factories[name] = (factory, close)
+
+            def get() -> T:
+                return self.get(name)
+
+            get.__name__ = factory.__name__
+            get.__qualname__ = factory.__qualname__
+            get.__doc__ = factory.__doc__
+            return get
+
+        return decorator
+
+    def get(self, name: str) -> Any:
+        try:
+            return self._instances[name]
+        except KeyError:
+            pass
+        factory, _close = self._factories[name]
+        instance = factory()
+        self._instances[name] = instance
+        self._order.append(name)
+        return instance
+
+    def peek(self, name: str) -> Any:
+        """The instance if it has been created, else ``None``."""
+        return self._instances.get(name)
+
+    def created(self) -> List[str]:
+        """Names of the resources created so far, oldest first."""
+        return list(self._order)
+
+    def discard(self, name: str) -> Any:
+        """Forget *name* without closing it; returns the instance, if any."""
+        if name in self._order:
+            self._order.remove(name)
+        return self._instances.pop(name, None)
+
+    def override(self, name: str, instance: Any) -> None:
+        """Use *instance* for *name* instead of calling its factory – e.g. a
+        stand‑in client for load tests. It is closed like a created one."""
+        if name not in self._instances:
+            self._order.append(name)
+        self._instances[name] = instance
+
+    async def aclose(self) -> None:
+        """Close every created resource, newest first."""
+        while self._order:
+            name = self._order.pop()
+            instance = self._instances.pop(name)
+            _factory, close = self._factories.get(name, (None, None))
+            if close is None or instance is None:
+                continue
+            try:
+                result = close(instance)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print("Closing", name, "failed", e)
+
+
+registry = Registry()
+
+
+class _Lazy:
+    """Stand‑in forwarding attribute and item access to ``getter()``."""
+
+    __slots__ = ("_getter",)
+
+    def __init__(self, getter: Callable[[], Any]):
+        object.__setattr__(self, "_getter", getter)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._getter(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._getter(), name, value)
+
+    def __getitem__(self, key: Any) -> Any:
+        return self._getter()[key]
+
+    def __repr__(self) -> str:
+        return f"<lazy {self._getter.__name__}>"
+
+
+def lazy(getter: Callable[[], T]) -> T:
+    """Module‑level stand‑in for the resource returned by *getter*."""
+    return _Lazy(getter)  # type: ignore[return-value]
@@ -1,7 +1,8 @@
-from fastapi import APIRouter, HTTPException, Depends
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Header, Request, Response
 from app.models.chat import ChatRequest, ChatResponse
-from app.services.chat_service import get_chat_response, history_service, client
-import uuid
+from app.services.chat_service import get_chat_response, pipeline, upstream
+from app.config import settings
 from app.services.auth_service import get_current_user
 from app.models.user import UserInDB
 
@@ -12,12 +13,17 @@ router = APIRouter(prefix="/chat", tags=["chat"])
 # ---------------------------------------------------------------------------
 
 @router.post("/", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest, current_user: UserInDB = Depends(get_current_user)):
+async def chat_endpoint(
+    request: ChatRequest, response: Response, current_user: UserInDB = Depends(get_current_user)
+):
     try:
-        session_id, reply = await get_chat_response(
-            current_user.id, request.session_id, request.message, request.kb_id
+        prepared, reply = await get_chat_response(
+            current_user.id, request.session_id, request.message, request.kb_id, request.resume
         )
-        return ChatResponse(session_id=session_id, reply=reply)
+        response.headers["Server-Timing"] = prepared.server_timing()
+        return ChatResponse(session_id=prepared.session_id, reply=reply)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -25,81 +31,155 @@ async def chat_endpoint(request: ChatRequest, current_user: UserInDB = Depends(g
 # ---------------------------------------------------------------------------
 # Streaming endpoint – returns chunks with partial assistant response so the
 # client can render the reply token‑by‑token similar to ChatGPT.
-# Each chunk is a JSON line (`\n` delimited) with one of the following shapes:
+# Each chunk is a JSON line (`\n` delimited) – or an SSE `data:` event when the
+# client sends `Accept: text/event-stream` – with one of the following shapes:
 #   {"session_id": "id"}  – sent once at beginning if it was newly created.
-#   {"token": "text"}     – delta token from OpenAI stream.
+#   {"token": "text"}     – reply text; consecutive deltas from OpenAI are
+#                           coalesced into frames of a few bytes / ms.
+#                           Cached replies are replayed in frames of the
+#                           same size.
 #   {"done": true}         – final message when complete.
 # ---------------------------------------------------------------------------
 
 from fastapi.responses import StreamingResponse
-import json
+import asyncio
+import time
+from app.metrics import Gauge, Histogram
+from app.services.stream_framing import FrameEncoder, coalesce, replay
+
+UPSTREAM_TTFT = Histogram("upstream_ttft_seconds", "Time from the completion request to its first token")
+STREAM_TOKENS_PER_SECOND = Histogram(
+    "stream_tokens_per_second",
+    "Upstream deltas per second after the first one",
+    buckets=(5, 10, 20, 40, 80, 160, 320, 640, 1280),
+)
+STREAM_DURATION = Histogram("stream_duration_seconds", "Duration of /chat/stream responses", ("outcome",))
+ACTIVE_STREAMS = Gauge("chat_active_streams", "/chat/stream responses in progress")
+
+
+async def _wait_for_disconnect(http_request: Request) -> None:
+    """Return once the client has gone away."""
+    while True:
+        message = await http_request.receive()
+        if message["type"] == "http.disconnect":
+            return
 
 
 @router.post("/stream")
 async def chat_stream_endpoint(
-    request: ChatRequest, current_user: UserInDB = Depends(get_current_user)
+    request: ChatRequest,
+    http_request: Request,
+    current_user: UserInDB = Depends(get_current_user),
+    accept: Optional[str] = Header(None),
 ):
-    """Stream assistant reply token‑by‑token using server‑sent JSON lines."""
+    """Stream assistant reply token‑by‑token using server‑sent JSON lines.
 
-    async def generator():
-        # obtain or create session
-        session_id, user_prompt = request.session_id, request.message
-        if session_id is None:
-            session_id = str(uuid.uuid4())
-            # let client know which id to use going forward
-            yield json.dumps({"session_id": session_id}) + "\n"
-
-        # fetch previous messages and prepare prompt list
-        previous = await history_service.get_messages(current_user.id, session_id)
-        messages = [{"role": m.role, "content": m.content} for m in previous]
-
-        # Custom system prompt (user‑defined)
-        custom_prompt = await history_service.get_system_prompt(current_user.id, session_id)
-        if custom_prompt:
-            messages.insert(0, {"role": "system", "content": custom_prompt})
-
-        # KB context if requested
-        if request.kb_id:
-            from app.services.kb_service import KnowledgeBaseService
-
-            kb_service = KnowledgeBaseService()
-            try:
-                context_chunks = await kb_service.retrieve(current_user.id, request.kb_id, user_prompt, top_k=3)
-                context_text = "\n".join(context_chunks)
-                system_prompt = (
-                    "You are an assistant with access to the following context extracted "
-                    "from the user's documents. Use it to answer the user.\n\n" + context_text
-                )
-                messages.insert(0, {"role": "system", "content": system_prompt})
-            except Exception as e:
-                print("KB retrieve failed", e)
-
-        messages.append({"role": "user", "content": user_prompt})
-
-        # save user message immediately so that it appears in history even if
-        # client disconnects later
-        await history_service.save_message(current_user.id, session_id, "user", user_prompt)
-
-        reply_text = ""
-
-        # call OpenAI streaming
-        response = await client.chat.completions.create(
-            model="gpt-4.1",
-            messages=messages,
-            stream=True,
-        )
+    If the client disconnects mid‑answer the upstream request is closed right
+    away and the partial reply is kept in history marked ``truncated``; send
+    ``resume: true`` for the session to continue it.
+    """
+    frames = FrameEncoder.for_accept(accept)
 
-        async for chunk in response:
-            token = chunk.choices[0].delta.content
-            if token:
-                reply_text += token
-                print(token, end="", flush=True)
-                yield json.dumps({"token": token}) + "\n"
-
-        # finished – save assistant message
-        await history_service.save_message(current_user.id, session_id, "assistant", reply_text)
-
-        # tell client stream done
-        yield json.dumps({"done": True}) + "\n"
+    # Prompt preparation happens before the response starts so that its
+    # timings can be sent as a header and failures surface as HTTP errors.
+    try:
+        prepared = await pipeline.prepare(
+            current_user.id, request.session_id, request.message, request.kb_id, resume=request.resume
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    cached = pipeline.cached_reply(prepared)
+
+    async def replay_cached():
+        # history is complete before the first frame, so a disconnect
+        # during the replay loses nothing
+        await pipeline.save_user_message(prepared)
+        await pipeline.finish(prepared, cached)
+        for text in replay(cached):
+            yield frames.encode({"token": text})
+
+    async def stream_reply(state: dict):
+        recorder = pipeline.recorder(prepared)
+        disconnected = asyncio.create_task(_wait_for_disconnect(http_request))
+
+        # call OpenAI streaming; the user message is saved meanwhile so that it
+        # appears in history even if client disconnects later
+        requested = time.perf_counter()
+        pending = [
+            upstream.chat(settings.chat_model, prepared.messages, stream=True)
+        ]
+        if prepared.resume_from is None:
+            pending.append(pipeline.save_user_message(prepared))
+        try:
+            response, *_ = await asyncio.gather(*pending)
+        except BaseException:
+            disconnected.cancel()
+            raise
+
+        first = None
+        count = 0
+
+        async def deltas():
+            nonlocal first, count
+            async for chunk in response:
+                if disconnected.done():
+                    break
+                token = chunk.choices[0].delta.content
+                if token:
+                    if first is None:
+                        first = time.perf_counter()
+                        UPSTREAM_TTFT.observe(first - requested)
+                    count += 1
+                    recorder.add(token)
+                    yield token
+
+        completed = False
+        try:
+            async for text in coalesce(deltas()):
+                if disconnected.done():
+                    break
+                yield frames.encode({"token": text})
+            completed = not disconnected.done()
+        finally:
+            state["outcome"] = "completed" if completed else "disconnected"
+            disconnected.cancel()
+            # stop generation upstream – nobody is reading any more
+            await response.close()
+            if first is not None and count > 1:
+                elapsed = time.perf_counter() - first
+                if elapsed > 0:
+                    STREAM_TOKENS_PER_SECOND.observe((count - 1) / elapsed)
+            # finished (or interrupted) – save assistant message
+            await recorder.close(truncated=not completed)
 
-    return StreamingResponse(generator(), media_type="application/json")
+    async def generator():
+        ACTIVE_STREAMS.inc()
+        started = time.perf_counter()
+        state = {"outcome": "failed"}
+        try:
+            if prepared.is_new_session:
+                # let client know which id to use going forward
+                yield frames.encode({"session_id": prepared.session_id})
+
+            if cached is not None:
+                state["outcome"] = "cached"
+                frames_out = replay_cached()
+            else:
+                frames_out = stream_reply(state)
+            async for frame in frames_out:
+                yield frame
+            if state["outcome"] == "disconnected":
+                return
+
+            # tell client stream done
+            yield frames.encode({"done": True})
+        finally:
+            ACTIVE_STREAMS.dec()
+            STREAM_DURATION.labels(outcome=state["outcome"]).observe(time.perf_counter() - started)
+
+    return StreamingResponse(
+        generator(),
+        media_type=frames.media_type,
+        headers={"Server-Timing": prepared.server_timing()},
+    )
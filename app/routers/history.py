@@ -1,14 +1,16 @@
 from typing import List, Optional
 from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi.responses import StreamingResponse
 # Import both models
-from app.models.history import MessageHistory, SessionSummary
-from app.services.history_service import HistoryService
+from app.models.history import MessageHistory, MessagePage, SessionSummary
+from app.registry import lazy
+from app.services.history_service import get_history_service
 from pydantic import BaseModel, Field
 from app.services.auth_service import get_current_user
 from app.models.user import UserInDB
 
 router = APIRouter(prefix="/history", tags=["history"])
-history_service = HistoryService()
+history_service = lazy(get_history_service)
 
 
 # ------------------------- System prompt endpoints ---------------------- #
@@ -33,6 +35,28 @@ async def set_system_prompt(
     await history_service.set_system_prompt(current_user.id, session_id, body.prompt)
     return {"status": "ok"}
 
+# ------------------------- Response cache opt‑out ----------------------- #
+
+
+class CacheUpdate(BaseModel):
+    enabled: bool = Field(..., description="Whether replies may be served from the response cache")
+
+
+@router.get("/{session_id}/cache")
+async def get_response_cache(session_id: str, current_user: UserInDB = Depends(get_current_user)):
+    enabled = await history_service.get_response_cache(current_user.id, session_id)
+    return {"enabled": enabled}
+
+
+@router.put("/{session_id}/cache")
+async def set_response_cache(
+    session_id: str,
+    body: CacheUpdate,
+    current_user: UserInDB = Depends(get_current_user),
+):
+    await history_service.set_response_cache(current_user.id, session_id, body.enabled)
+    return {"status": "ok"}
+
 @router.get("/", response_model=List[MessageHistory])
 async def get_history(
     session_id: Optional[str] = Query(None),
@@ -47,6 +71,37 @@ async def get_history(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/page", response_model=MessagePage)
+async def get_history_page(
+    session_id: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """Cursor‑paginated history; prefer this over skip/limit for deep pages."""
+    try:
+        messages, next_cursor = await history_service.get_messages_page(
+            current_user.id, session_id, cursor, limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return MessagePage(messages=messages, next_cursor=next_cursor)
+
+
+@router.get("/export")
+async def export_history(
+    session_id: Optional[str] = Query(None),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """Download the full history (or one session) as newline‑delimited JSON."""
+    filename = f"history-{session_id or 'all'}.ndjson"
+    return StreamingResponse(
+        history_service.export_messages(current_user.id, session_id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 # ------------------------- Delete a session ------------------------------ #
 
 
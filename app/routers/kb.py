@@ -4,37 +4,79 @@ from typing import List
 
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, status
 
-from app.services.kb_service import KnowledgeBaseService
-from app.models.kb import KBUploadResponse, QueryRequest, QueryResponse, KBListItem
+from app.registry import lazy
+from app.services.kb_service import get_kb_service
+from app.services.ingest_job_service import get_ingest_jobs
+from app.models.kb import KBJobStatus, QueryRequest, QueryResponse, KBListItem
 from app.services.auth_service import get_current_user
 from app.models.user import UserInDB
 
 
 router = APIRouter(prefix="/kb", tags=["knowledge_base"])
-kbs = KnowledgeBaseService()
+kbs = lazy(get_kb_service)
+jobs = lazy(get_ingest_jobs)
 
 
-@router.post("/upload", response_model=KBUploadResponse, status_code=status.HTTP_201_CREATED)
+def _job_status(doc: dict) -> KBJobStatus:
+    return KBJobStatus(
+        job_id=doc["_id"],
+        kb_id=doc["kb_id"],
+        filename=doc["filename"],
+        status=doc["status"],
+        pages=doc.get("pages", 0),
+        chunks=doc.get("chunks", 0),
+        chunks_embedded=doc.get("chunks_embedded", 0),
+        chunks_reused=doc.get("chunks_reused", 0),
+        chunks_new=doc.get("chunks_new", 0),
+        error=doc.get("error"),
+        created_at=doc["created_at"].isoformat() + "Z",
+        updated_at=doc["updated_at"].isoformat() + "Z",
+    )
+
+
+@router.post("/upload", response_model=KBJobStatus, status_code=status.HTTP_202_ACCEPTED)
 async def upload_pdf(
     file: UploadFile = File(..., description="PDF file to ingest"),
     current_user: UserInDB = Depends(get_current_user),
 ):
+    """Queue the PDF for ingestion and return the job to poll for progress."""
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
 
-    kb_id = await kbs.ingest_pdf(current_user.id, file)
-    return KBUploadResponse(kb_id=kb_id, chunks=await kbs.chunk_collection.count_documents({"kb_id": kb_id}))
+    job = await jobs.create_job(current_user.id, file)
+    return _job_status(job)
+
+
+@router.get("/jobs/{job_id}", response_model=KBJobStatus)
+async def get_job(job_id: str, current_user: UserInDB = Depends(get_current_user)):
+    job = await jobs.get_job(current_user.id, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_status(job)
+
+
+@router.post("/jobs/{job_id}/resume", response_model=KBJobStatus)
+async def resume_job(job_id: str, current_user: UserInDB = Depends(get_current_user)):
+    """Restart a failed ingestion job from the last persisted chunk."""
+    job = await jobs.resume_job(current_user.id, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_status(job)
 
 
 @router.post("/query", response_model=QueryResponse)
 async def query_kb(request: QueryRequest, current_user: UserInDB = Depends(get_current_user)):
-    texts = await kbs.retrieve(current_user.id, request.kb_id, request.query, request.top_k)
+    texts = await kbs.retrieve(
+        current_user.id, request.kb_id, request.query, request.top_k, mode=request.mode
+    )
     return QueryResponse(kb_id=request.kb_id, query=request.query, results=texts)
 
 
 @router.get("/list", response_model=List[KBListItem])
 async def list_kb(current_user: UserInDB = Depends(get_current_user)):
-    cursor = kbs.kb_collection.find({"user_id": current_user.id}).sort("created_at", -1)
+    cursor = kbs.kb_collection.find(
+        {"user_id": current_user.id}, {"filename": 1, "chunks": 1, "created_at": 1}
+    ).sort("created_at", -1)
     docs = await cursor.to_list(length=None)
     return [
         KBListItem(
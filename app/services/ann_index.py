@@ -0,0 +1,175 @@
+"""Approximate nearest‑neighbour backends for large knowledge bases.
+
+Exact scoring in :class:`app.services.vector_index.KBIndex` touches every
+chunk on every query. Once a KB grows past ``settings.kb_ann_threshold`` chunks
+we instead consult an ANN structure that narrows the search to a small set of
+candidate rows, which are then scored exactly against the KB matrix.
+
+Backends are pluggable through :data:`ANN_BACKENDS`. Each one persists itself
+as plain ``.npy`` files under ``settings.kb_index_dir`` so it can be opened
+with ``mmap_mode="r"`` instead of being read into every worker's heap.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple, Type
+
+import numpy as np
+
+from app.config import settings
+from app.services.shared_index import SAFE_ID
+
+
+class AnnIndex(ABC):
+    """Interface implemented by every ANN backend."""
+
+    name: str = ""
+
+    @classmethod
+    @abstractmethod
+    def build(cls, matrix: np.ndarray) -> "AnnIndex":
+        """Build an index over the rows of an L2‑normalised *matrix*."""
+
+    @abstractmethod
+    def search(self, matrix: np.ndarray, query: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
+        """Return ``(row, score)`` pairs for the approximate *top_k* rows."""
+
+    @abstractmethod
+    def save(self, path: str) -> None:
+        """Write the index as files into the existing directory *path*."""
+
+    @classmethod
+    @abstractmethod
+    def load(cls, path: str) -> "AnnIndex":
+        """Open an index written by :meth:`save`, memory‑mapped."""
+
+
+class IVFFlatIndex(AnnIndex):
+    """Inverted file index: rows are bucketed by their nearest k‑means centroid.
+
+    A query scores the centroids, visits the ``nprobe`` closest buckets and
+    ranks only the rows stored in them.
+    """
+
+    name = "ivf_flat"
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, ids: np.ndarray, nprobe: Optional[int] = None):
+        self.centroids = centroids
+        self.offsets = offsets  # bucket i holds ids[offsets[i]:offsets[i + 1]]
+        self.ids = ids
+        self.nprobe = nprobe or settings.kb_ann_nprobe
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, nlist: Optional[int] = None, iterations: int = 10, seed: int = 0) -> "IVFFlatIndex":
+        n = matrix.shape[0]
+        nlist = max(1, min(n, nlist or int(np.sqrt(n))))
+        rng = np.random.default_rng(seed)
+
+        # Train on a sample – a few dozen points per centroid is plenty.
+        sample_size = min(n, nlist * 64)
+        sample = matrix[rng.choice(n, sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids /= norms
+
+        assign = np.empty(n, dtype=np.int32)
+        for start in range(0, n, 8192):
+            block = matrix[start:start + 8192]
+            assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        ids = np.argsort(assign, kind="stable").astype(np.int32)
+        counts = np.bincount(assign, minlength=nlist)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(centroids.astype(np.float32), offsets, ids)
+
+    def search(self, matrix: np.ndarray, query: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
+        nprobe = min(self.nprobe, len(self.centroids))
+        centroid_scores = self.centroids @ query
+        probes = np.argpartition(centroid_scores, -nprobe)[-nprobe:]
+        candidates = np.concatenate([self.ids[self.offsets[p]:self.offsets[p + 1]] for p in probes])
+        if len(candidates) == 0:
+            return []
+        scores = matrix[candidates] @ query
+        k = min(top_k, len(candidates))
+        best = np.argpartition(scores, -k)[-k:]
+        best = best[np.argsort(scores[best])[::-1]]
+        return [(int(candidates[i]), float(scores[i])) for i in best]
+
+    def save(self, path: str) -> None:
+        np.save(os.path.join(path, "centroids.npy"), self.centroids)
+        np.save(os.path.join(path, "offsets.npy"), self.offsets)
+        np.save(os.path.join(path, "ids.npy"), self.ids)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFFlatIndex":
+        return cls(
+            np.load(os.path.join(path, "centroids.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "offsets.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "ids.npy"), mmap_mode="r"),
+        )
+
+
+ANN_BACKENDS: Dict[str, Type[AnnIndex]] = {
+    IVFFlatIndex.name: IVFFlatIndex,
+}
+
+
+def _index_path(kb_id: str) -> str:
+    # the id becomes a directory name, and remove() deletes that directory
+    if not SAFE_ID.match(kb_id):
+        raise ValueError(f"Unsafe knowledge base id for an ANN index path: {kb_id!r}")
+    return os.path.join(settings.kb_index_dir, kb_id, "ann")
+
+
+def build_and_save(kb_id: str, matrix: np.ndarray, backend: Optional[str] = None) -> AnnIndex:
+    """Build the configured ANN backend for *matrix* and persist it for *kb_id*."""
+    cls = ANN_BACKENDS[backend or settings.kb_ann_backend]
+    index = cls.build(matrix)
+
+    final = _index_path(kb_id)
+    parent = os.path.dirname(final)
+    os.makedirs(parent, exist_ok=True)
+    # a directory of our own – other workers may be building the same KB
+    tmp = tempfile.mkdtemp(prefix="ann.", suffix=".tmp", dir=parent)
+    try:
+        index.save(tmp)
+        with open(os.path.join(tmp, "meta.json"), "w") as fh:
+            json.dump({"backend": cls.name, "rows": int(matrix.shape[0]), "dim": int(matrix.shape[1])}, fh)
+        shutil.rmtree(final, ignore_errors=True)
+        try:
+            os.replace(tmp, final)
+        except OSError:
+            if not os.path.isdir(final):
+                raise
+            # another worker published its build in between – keep that one
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return index
+
+
+def load(kb_id: str, rows: int, dim: int) -> Optional[AnnIndex]:
+    """Open the persisted ANN index for *kb_id* if it matches the KB's shape."""
+    path = _index_path(kb_id)
+    try:
+        with open(os.path.join(path, "meta.json")) as fh:
+            meta = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if meta.get("rows") != rows or meta.get("dim") != dim or meta.get("backend") not in ANN_BACKENDS:
+        return None
+    return ANN_BACKENDS[meta["backend"]].load(path)
+
+
+def remove(kb_id: str) -> None:
+    if SAFE_ID.match(kb_id):  # no index can exist for any other id
+        shutil.rmtree(_index_path(kb_id), ignore_errors=True)
@@ -5,7 +5,7 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from app.config import settings
 from app.models.user import TokenData, UserInDB
-from app.services.user_service import get_user_by_username
+from app.services.user_service import get_cached_user
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
@@ -30,7 +30,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserInDB:
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = await get_user_by_username(token_data.username)
+    user = await get_cached_user(token_data.username)
     if user is None:
         raise credentials_exception
     return user
\ No newline at end of file
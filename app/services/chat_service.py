@@ -1,18 +1,22 @@
-import uuid
-from openai import AsyncOpenAI
-from typing import Optional
+import asyncio
+from typing import Optional, Tuple
 from app.config import settings
-from app.services.history_service import HistoryService
+from app.registry import lazy
+from app.services.history_service import get_history_service
+from app.services.context_service import get_context_builder
+from app.services.upstream import get_upstream
 
+# Created on first use and shared with the routers – see app.registry.
+upstream = lazy(get_upstream)
 
-client = AsyncOpenAI(api_key=settings.openai_api_key)
-# openai.api_key = settings.openai_api_key
+history_service = lazy(get_history_service)
+context_builder = lazy(get_context_builder)
 
-history_service = HistoryService()
+from app.services.kb_service import get_kb_service
+from app.services.prompt_pipeline import PreparedPrompt, get_prompt_pipeline, timed
 
-from app.services.kb_service import KnowledgeBaseService
-
-kbs = KnowledgeBaseService()
+kbs = lazy(get_kb_service)
+pipeline = lazy(get_prompt_pipeline)
 
 
 async def get_chat_response(
@@ -20,40 +24,29 @@ async def get_chat_response(
     session_id: Optional[str],
     message: str,
     kb_id: Optional[str] = None,
-):
-    if session_id is None:
-        session_id = str(uuid.uuid4())
-
-    previous = await history_service.get_messages(user_id, session_id)
-    messages = [{"role": m.role, "content": m.content} for m in previous]
-
-    # User custom system prompt
-    custom_prompt = await history_service.get_system_prompt(user_id, session_id)
-    if custom_prompt:
-        messages.insert(0, {"role": "system", "content": custom_prompt})
-    # Knowledge‑base retrieval for RAG
-    if kb_id:
-        try:
-            context_chunks = await kbs.retrieve(user_id, kb_id, message, top_k=3)
-            context_text = "\n".join(context_chunks)
-            system_prompt = (
-                "You are an assistant with access to the following context extracted "
-                "from the user's documents. Use it to answer the user.\n\n" + context_text
-            )
-            messages.insert(0, {"role": "system", "content": system_prompt})
-        except Exception as e:
-            # just ignore retrieval errors – fallback to no context
-            print("KB retrieval failed", e)
-
-    messages.append({"role": "user", "content": message})
-
-    response = await client.chat.completions.create(
-        model="gpt-4.1",
-        messages=messages
-    )
-    reply = response.choices[0].message.content
-
-    await history_service.save_message(user_id, session_id, "user", message)
-    await history_service.save_message(user_id, session_id, "assistant", reply)
-
-    return session_id, reply
+    resume: bool = False,
+) -> Tuple[PreparedPrompt, str]:
+    prepared = await pipeline.prepare(user_id, session_id, message, kb_id, resume=resume)
+
+    cached = pipeline.cached_reply(prepared)
+    if cached is not None:
+        await pipeline.save_user_message(prepared)
+        await pipeline.finish(prepared, cached)
+        return prepared, cached
+
+    async def complete():
+        response = await timed(
+            prepared.timings,
+            "upstream",
+            upstream.chat(settings.chat_model, prepared.messages),
+        )
+        return response.choices[0].message.content
+
+    # the user message doesn't depend on the reply – store it meanwhile
+    if prepared.resume_from is None:
+        reply, _ = await asyncio.gather(complete(), pipeline.save_user_message(prepared))
+    else:
+        reply = await complete()
+    await pipeline.finish(prepared, reply)
+
+    return prepared, reply
@@ -0,0 +1,398 @@
+"""Cold tier of the chat history: compressed per‑session message buckets.
+
+A message document repeats ``user_id`` and ``session_id``, stores its content
+uncompressed and costs three index entries – for messages nobody has read in
+months. With ``history_cold_tier`` on, :class:`HistoryCompactor` periodically
+moves messages older than ``history_cold_after_days`` into
+``message_buckets``: one document per run of up to
+``history_cold_bucket_size`` messages of a session, the messages zlib
+compressed, indexed once per bucket.
+
+Each user's boundary between the tiers is a single ``message_tiers``
+document, ``cold_until``: buckets hold that user's messages before it, the
+``messages`` collection those from it on. A compaction run writes its
+buckets first, then moves ``cold_until`` and only then deletes the moved
+messages, so every read sees each message exactly once – buckets written by
+an unfinished run lie beyond ``cold_until`` and are ignored (and replaced by
+the next run), and messages it did not get to delete are hidden.
+"""
+
+import asyncio
+import heapq
+import json
+import os
+import socket
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import bson
+from bson import Binary, ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from app.config import settings
+from app.db import db
+from app.indexes import declare_index, declare_query
+from app.metrics import register_stats
+from app.registry import registry
+
+declare_index("message_buckets", [("user_id", 1), ("session_id", 1), ("start", 1)])
+declare_index("message_buckets", [("user_id", 1), ("start", 1)])
+declare_query("message_buckets", "cold history of a session",
+              {"user_id": "u", "session_id": "s", "start": {"$lt": "t"}}, sort=[("start", 1)])
+declare_query("message_buckets", "cold history of a user", {"user_id": "u", "start": {"$lt": "t"}}, sort=[("start", 1)])
+
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+CODEC = "zlib-json"
+# Buckets fetched per round trip while reading.
+FETCH_BUCKETS = 8
+# Buckets written per insert_many while compacting.
+WRITE_BUCKETS = 64
+LEASE = "history_compaction"
+
+Keyset = Tuple[datetime, ObjectId]
+
+
+def encode_bucket(messages: List[dict]) -> dict:
+    """Bucket document for *messages* of one session, oldest first."""
+    first = messages[0]
+    payload = [
+        {
+            "i": str(m["_id"]),
+            "r": m["role"],
+            "c": m["content"],
+            "t": (m["timestamp"] - EPOCH) // MILLISECOND,
+            **({"x": 1} if m.get("truncated") else {}),
+        }
+        for m in messages
+    ]
+    return {
+        "user_id": first["user_id"],
+        "session_id": first["session_id"],
+        "start": first["timestamp"],
+        "end": messages[-1]["timestamp"],
+        "count": len(messages),
+        "codec": CODEC,
+        "data": Binary(zlib.compress(json.dumps(payload, ensure_ascii=False).encode(), 6)),
+    }
+
+
+def decode_bucket(bucket: dict) -> List[dict]:
+    """The message documents stored in *bucket*, oldest first."""
+    if bucket.get("codec") != CODEC:
+        raise ValueError(f"Unknown bucket codec {bucket.get('codec')!r}")
+    messages = []
+    for m in json.loads(zlib.decompress(bucket["data"])):
+        doc = {
+            "_id": ObjectId(m["i"]),
+            "user_id": bucket["user_id"],
+            "session_id": bucket["session_id"],
+            "role": m["r"],
+            "content": m["c"],
+            "timestamp": EPOCH + m["t"] * MILLISECOND,
+        }
+        if m.get("x"):
+            doc["truncated"] = True
+        messages.append(doc)
+    return messages
+
+
+class ColdStore:
+    """Reads and deletes of the cold tier, for :class:`HistoryService`."""
+
+    def __init__(self, buckets=None, tiers=None):
+        self.buckets = buckets if buckets is not None else db["message_buckets"]
+        self.tiers = tiers if tiers is not None else db["message_tiers"]
+
+    async def cutoff(self, user_id: str) -> Optional[datetime]:
+        """``cold_until`` of *user_id*; ``None`` while nothing is cold."""
+        tier = await self.tiers.find_one({"_id": user_id}, {"cold_until": 1})
+        return tier.get("cold_until") if tier else None
+
+    @staticmethod
+    def _scope(user_id: str, session_id: Optional[str], cutoff: datetime) -> dict:
+        query = {"user_id": user_id, "start": {"$lt": cutoff}}
+        if session_id:
+            query["session_id"] = session_id
+        return query
+
+    async def read(
+        self,
+        user_id: str,
+        session_id: Optional[str],
+        cutoff: datetime,
+        skip: int = 0,
+        limit: int = 100,
+        after: Optional[Keyset] = None,
+    ) -> Tuple[List[dict], int]:
+        """Up to *limit* cold messages in ``(timestamp, _id)`` order after
+        skipping *skip* of them – or all up to keyset *after* – and the number
+        of cold messages in the buckets considered.
+
+        Buckets of different sessions overlap in time, so they are merged;
+        only buckets that may hold the next message are fetched.
+        """
+        query = self._scope(user_id, session_id, cutoff)
+        if after is not None:
+            query["end"] = {"$gte": after[0]}
+        metas = await (
+            self.buckets.find(query, {"start": 1, "end": 1, "count": 1})
+            .sort([("start", 1), ("_id", 1)])
+            .to_list(length=None)
+        )
+        total = sum(meta["count"] for meta in metas)
+
+        # whole buckets that end before every later one starts are skipped
+        # without fetching them
+        pos = 0
+        while (
+            pos < len(metas)
+            and skip >= metas[pos]["count"]
+            and (pos + 1 == len(metas) or metas[pos]["end"] < metas[pos + 1]["start"])
+        ):
+            skip -= metas[pos]["count"]
+            pos += 1
+
+        fetched: Dict[ObjectId, dict] = {}
+        heap: List[Tuple[datetime, ObjectId, dict]] = []
+        out: List[dict] = []
+        while len(out) < limit and (heap or pos < len(metas)):
+            while pos < len(metas) and (not heap or metas[pos]["start"] <= heap[0][0]):
+                bucket_id = metas[pos]["_id"]
+                if bucket_id not in fetched:
+                    ids = [meta["_id"] for meta in metas[pos:pos + FETCH_BUCKETS]]
+                    async for bucket in self.buckets.find({"_id": {"$in": ids}}):
+                        fetched[bucket["_id"]] = bucket
+                bucket = fetched.pop(bucket_id, None)
+                pos += 1
+                if bucket is None:  # deleted since the metadata was read
+                    continue
+                for doc in decode_bucket(bucket):
+                    heapq.heappush(heap, (doc["timestamp"], doc["_id"], doc))
+            if not heap:
+                continue
+            timestamp, oid, doc = heapq.heappop(heap)
+            if after is not None and (timestamp, oid) <= after:
+                continue
+            if skip:
+                skip -= 1
+                continue
+            out.append(doc)
+        return out, total
+
+    async def recent(
+        self, user_id: str, session_id: str, cutoff: datetime, since: Optional[datetime], limit: int
+    ) -> List[dict]:
+        """The newest *limit* cold messages of a session after *since*, oldest first."""
+        query = self._scope(user_id, session_id, cutoff)
+        if since is not None:
+            query["end"] = {"$gt": since}
+        newest: List[dict] = []
+        # a session's buckets don't overlap, so newest start = newest messages
+        async for bucket in self.buckets.find(query).sort("start", -1):
+            docs = [doc for doc in decode_bucket(bucket) if since is None or doc["timestamp"] > since]
+            newest = docs + newest
+            if len(newest) >= limit:
+                break
+        return newest[-limit:] if limit else []
+
+    async def delete_session(self, user_id: str, session_id: str) -> int:
+        """Delete the session's buckets; returns how many messages they held.
+
+        Call after the session's hot messages are gone – a compaction run
+        checks for those to drop buckets it writes for a deleted session.
+        """
+        cutoff = await self.cutoff(user_id)
+        counted = 0
+        if cutoff is not None:
+            metas = await self.buckets.find(
+                self._scope(user_id, session_id, cutoff), {"count": 1}
+            ).to_list(length=None)
+            counted = sum(meta["count"] for meta in metas)
+        await self.buckets.delete_many({"user_id": user_id, "session_id": session_id})
+        return counted
+
+
+class HistoryCompactor:
+    """Background task moving old messages into the cold tier.
+
+    Runs every ``history_compaction_interval_seconds`` in whichever worker
+    holds the ``leases`` entry, and reports what it moved and how many bytes
+    of documents that saved through :attr:`stats`.
+    """
+
+    def __init__(self, messages, cold: ColdStore, leases):
+        self.messages = messages
+        self.cold = cold
+        self.leases = leases
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.interval = settings.history_compaction_interval_seconds
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "runs": 0,
+            "users": 0,
+            "sessions": 0,
+            "buckets": 0,
+            "messages": 0,
+            "bytes_before": 0,
+            "bytes_after": 0,
+            "reclaimed_bytes": 0,
+            "last_run_seconds": 0.0,
+        }
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.leases.delete_one({"_id": LEASE, "owner": self.owner})
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.compact()
+            except Exception as e:
+                print("History compaction failed", e)
+            await asyncio.sleep(self.interval)
+
+    async def _lease(self) -> bool:
+        """Take or renew the compaction lease; ``False`` if another worker holds it."""
+        now = datetime.utcnow()
+        try:
+            await self.leases.update_one(
+                {"_id": LEASE, "$or": [{"expires_at": {"$lt": now}}, {"owner": self.owner}]},
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=2 * self.interval)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def compact(self, older_than: Optional[timedelta] = None) -> Optional[dict]:
+        """Move every message older than *older_than* (default
+        ``history_cold_after_days``) into buckets. Returns what this run did,
+        or ``None`` when another worker holds the lease."""
+        if not await self._lease():
+            return None
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        cutoff = now - (older_than if older_than is not None else timedelta(days=settings.history_cold_after_days))
+        # BSON dates have millisecond precision
+        cutoff = cutoff.replace(microsecond=cutoff.microsecond // 1000 * 1000)
+
+        report = {"users": 0, "sessions": 0, "buckets": 0, "messages": 0, "bytes_before": 0, "bytes_after": 0}
+        for user_id in await self.messages.distinct("user_id", {"timestamp": {"$lt": cutoff}}):
+            done = await self._compact_user(user_id, cutoff)
+            for key, value in done.items():
+                report[key] += value
+            if done["messages"]:
+                report["users"] += 1
+            await self._lease()
+        report["reclaimed_bytes"] = report["bytes_before"] - report["bytes_after"]
+        report["seconds"] = round(time.perf_counter() - started, 3)
+
+        self.stats["runs"] += 1
+        for key in ("users", "sessions", "buckets", "messages", "bytes_before", "bytes_after", "reclaimed_bytes"):
+            self.stats[key] += report[key]
+        self.stats["last_run_seconds"] = report["seconds"]
+        if report["messages"]:
+            print("History compaction", report)
+        return report
+
+    async def _compact_user(self, user_id: str, cutoff: datetime) -> Dict[str, int]:
+        done = {"sessions": 0, "buckets": 0, "messages": 0, "bytes_before": 0, "bytes_after": 0}
+        previous = await self.cold.cutoff(user_id)
+        if previous is not None and previous >= cutoff:
+            return done
+        # what an interrupted run left behind: buckets beyond cold_until and
+        # moved messages it did not delete
+        if previous is None:
+            await self.cold.buckets.delete_many({"user_id": user_id})
+            window = {"$lt": cutoff}
+        else:
+            await asyncio.gather(
+                self.cold.buckets.delete_many({"user_id": user_id, "start": {"$gte": previous}}),
+                self.messages.delete_many({"user_id": user_id, "timestamp": {"$lt": previous}}),
+            )
+            window = {"$gte": previous, "$lt": cutoff}
+
+        cursor = (
+            self.messages.find({"user_id": user_id, "timestamp": window})
+            .sort([("session_id", 1), ("timestamp", 1), ("_id", 1)])
+            .batch_size(1000)
+        )
+        pending: List[Tuple[dict, ObjectId]] = []  # bucket, first message of its session
+        chunk: List[dict] = []
+        current: Optional[str] = None
+        first: Optional[ObjectId] = None
+
+        async def close_chunk():
+            nonlocal chunk
+            if chunk:
+                bucket = encode_bucket(chunk)
+                done["bytes_after"] += len(bson.encode(bucket))
+                pending.append((bucket, first))
+                chunk = []
+            if len(pending) >= WRITE_BUCKETS:
+                await self._write(pending, done)
+
+        async for doc in cursor:
+            if doc["session_id"] != current:
+                await close_chunk()
+                current, first = doc["session_id"], doc["_id"]
+                done["sessions"] += 1
+            chunk.append(doc)
+            done["messages"] += 1
+            done["bytes_before"] += len(bson.encode(doc))
+            if len(chunk) >= settings.history_cold_bucket_size:
+                await close_chunk()
+        await close_chunk()
+        await self._write(pending, done)
+
+        if done["messages"]:
+            # the switch: from here on reads take these messages from buckets
+            await self.cold.tiers.update_one(
+                {"_id": user_id}, {"$set": {"cold_until": cutoff, "compacted_at": datetime.utcnow()}}, upsert=True
+            )
+            await self.messages.delete_many({"user_id": user_id, "timestamp": {"$lt": cutoff}})
+        return done
+
+    async def _write(self, pending: List[Tuple[dict, ObjectId]], done: Dict[str, int]) -> None:
+        if not pending:
+            return
+        buckets = [bucket for bucket, _first in pending]
+        await self.cold.buckets.insert_many(buckets)
+        done["buckets"] += len(buckets)
+        # A session deleted while its buckets were being built must not come
+        # back: delete_session removes messages before buckets, so a missing
+        # first message means its bucket delete may already have run.
+        firsts = {first for _bucket, first in pending}
+        present = {
+            doc["_id"] async for doc in self.messages.find({"_id": {"$in": list(firsts)}}, {"_id": 1})
+        }
+        orphans = [bucket["_id"] for bucket, first in pending if first not in present]
+        if orphans:
+            await self.cold.buckets.delete_many({"_id": {"$in": orphans}})
+        pending.clear()
+
+
+@registry.provider("history_compactor", close=lambda compactor: compactor.aclose())
+def get_history_compactor() -> HistoryCompactor:
+    return HistoryCompactor(db["messages"], ColdStore(), db["leases"])
+
+
+def _compaction_stats() -> dict:
+    compactor = registry.peek("history_compactor")
+    return compactor.stats if compactor is not None else {}
+
+
+register_stats("history_compaction", "Cold tier compaction", _compaction_stats)
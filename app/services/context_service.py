@@ -0,0 +1,197 @@
+"""Token‑budgeted prompt assembly with rolling session summaries.
+
+Instead of replaying a session's entire history, each turn sends:
+
+* the system prompts (KB context, custom prompt),
+* a rolling summary of everything older than the recent window, and
+* as many of the most recent messages as fit the model's token budget.
+
+Messages that fall out of the window are folded into the summary after the
+turn by :meth:`ContextBuilder.schedule_fold`, so the summary is updated
+incrementally and never on the request's critical path. A session with more
+unfolded messages than its cached state holds (one that predates summaries,
+say) has the rest read back from Mongo by the fold, a page at a time; the
+summary never moves past a message it was not given.
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.config import settings
+from app.models.history import MessageHistory
+from app.registry import registry
+from app.services.history_service import HistoryService, get_history_service
+from app.services.tokens import message_tokens
+from app.services.upstream import BACKGROUND, Upstream, get_upstream
+
+# Context windows of the models we talk to. The prompt budget is the smaller
+# of this minus the reply reserve and ``settings.chat_context_budget_tokens``.
+MODEL_CONTEXT_TOKENS: Dict[str, int] = {
+    "gpt-4.1": 1_047_576,
+    "gpt-4.1-mini": 1_047_576,
+    "gpt-4o": 128_000,
+    "gpt-4o-mini": 128_000,
+}
+DEFAULT_CONTEXT_TOKENS = 128_000
+# Messages per summary request when a fold pages through older history.
+FOLD_PAGE_MESSAGES = 200
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an "
+    "assistant. Update the summary with the new messages below. Keep every "
+    "fact, decision, name and open question that later turns may rely on; "
+    "drop pleasantries. Reply with the updated summary only."
+)
+
+
+def prompt_budget(model: str) -> int:
+    window = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+    return min(settings.chat_context_budget_tokens, window - settings.chat_reply_reserve_tokens)
+
+
+class ContextBuilder:
+    """Builds the message list for a chat turn within a token budget."""
+
+    def __init__(self, history: HistoryService, upstream: Upstream):
+        self.history = history
+        self.upstream = upstream
+        self._folding: Set[Tuple[str, str]] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def assemble(
+        system_prompts: List[str],
+        summary: Optional[dict],
+        recent: List[MessageHistory],
+        message: str,
+        model: str = None,
+    ) -> Tuple[List[dict], List[MessageHistory]]:
+        """Return ``(messages, overflow)`` for one turn.
+
+        *overflow* holds the older messages that did not fit the budget, or
+        beyond the newest ``chat_context_max_messages``, and should be folded
+        into the summary.
+        """
+        model = model or settings.chat_model
+        head = [{"role": "system", "content": prompt} for prompt in system_prompts]
+        if summary:
+            head.append(
+                {"role": "system", "content": "Summary of the earlier conversation:\n" + summary["summary"]}
+            )
+        tail = [{"role": "user", "content": message}]
+
+        remaining = prompt_budget(model) - sum(message_tokens(m, model) for m in head + tail)
+        kept = len(recent)
+        # no more than chat_context_max_messages however short they are:
+        # the cached session state only drops messages once they are folded
+        floor = max(0, kept - settings.chat_context_max_messages)
+        for m in reversed(recent[floor:]):
+            cost = message_tokens({"content": m.content}, model)
+            if cost > remaining:
+                break
+            remaining -= cost
+            kept -= 1
+        # the summary covers whole timestamps (summary_until), so messages
+        # sharing the last folded one's are folded with it
+        while 0 < kept < len(recent) and recent[kept].timestamp == recent[kept - 1].timestamp:
+            kept += 1
+
+        window = [{"role": m.role, "content": m.content} for m in recent[kept:]]
+        return head + window + tail, recent[:kept]
+
+    def schedule_fold(
+        self,
+        user_id: str,
+        session_id: str,
+        summary: Optional[dict],
+        overflow: List[MessageHistory],
+        backlog_until: Optional[datetime] = None,
+    ) -> None:
+        """Fold *overflow* into the session summary in the background – and
+        first the messages up to *backlog_until* that the session state did
+        not hold (see :class:`SessionState`)."""
+        key = (user_id, session_id)
+        if (not overflow and backlog_until is None) or key in self._folding:
+            return
+        self._folding.add(key)
+        task = asyncio.create_task(self._fold(user_id, session_id, summary, overflow, backlog_until))
+        self._tasks.add(task)
+
+        def done(t: asyncio.Task):
+            self._tasks.discard(t)
+            self._folding.discard(key)
+
+        task.add_done_callback(done)
+
+    async def aclose(self) -> None:
+        """Cancel pending folds – the next turn of each session redoes them."""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _fold(
+        self,
+        user_id: str,
+        session_id: str,
+        summary: Optional[dict],
+        overflow: List[MessageHistory],
+        backlog_until: Optional[datetime],
+    ) -> None:
+        try:
+            if backlog_until is None:
+                for start in range(0, len(overflow), FOLD_PAGE_MESSAGES):
+                    page = overflow[start:start + FOLD_PAGE_MESSAGES]
+                    summary = await self._summarize(user_id, session_id, summary, page)
+                return
+            # overflow only starts after the backlog, so read both from Mongo
+            until = max(backlog_until, overflow[-1].timestamp) if overflow else backlog_until
+            while True:
+                page = await self.history.get_messages_after(
+                    user_id,
+                    session_id,
+                    summary["summary_until"] if summary else None,
+                    until,
+                    FOLD_PAGE_MESSAGES,
+                )
+                if not page:
+                    break
+                full = len(page) == FOLD_PAGE_MESSAGES
+                if full:
+                    # the next page starts after this one's last timestamp
+                    page = [m for m in page if m.timestamp < page[-1].timestamp] or page
+                summary = await self._summarize(user_id, session_id, summary, page)
+                if not full:
+                    break
+        except Exception as e:
+            # the next turn will simply try again with a larger overflow
+            print("Session summary update failed", e)
+
+    async def _summarize(
+        self, user_id: str, session_id: str, summary: Optional[dict], messages: List[MessageHistory]
+    ) -> dict:
+        """Fold *messages*, the next ones after *summary*, into it and store
+        the result."""
+        transcript = "\n".join(f"{m.role}: {m.content}" for m in messages)
+        previous = summary["summary"] if summary else "(empty)"
+        response = await self.upstream.chat(
+            settings.chat_summary_model,
+            [
+                {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                {
+                    "role": "user",
+                    "content": f"Current summary:\n{previous}\n\nNew messages:\n{transcript}",
+                },
+            ],
+            priority=BACKGROUND,
+        )
+        updated = response.choices[0].message.content
+        until = messages[-1].timestamp
+        await self.history.set_summary(user_id, session_id, updated, until)
+        return {"summary": updated, "summary_until": until}
+
+
+@registry.provider("context_builder", close=lambda builder: builder.aclose())
+def get_context_builder() -> ContextBuilder:
+    return ContextBuilder(get_history_service(), get_upstream())
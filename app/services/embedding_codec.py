@@ -0,0 +1,63 @@
+"""Compact binary encoding for stored embeddings.
+
+A BSON array of 1536 doubles costs ~14 KB, most of it per‑element type tags
+and 8‑byte floats. Embeddings are instead packed into a single BSON Binary:
+
+    byte 0      format code (see FORMATS)
+    bytes 1‑3   padding so the payload stays 4‑byte aligned
+    [int8 only] float32 scale
+    payload     little‑endian float32 / float16 / int8 values
+
+float32 and float16 payloads are decoded with ``numpy.frombuffer`` without
+copying. Documents written before this format existed still hold plain
+arrays; :func:`decode` accepts both.
+"""
+
+from typing import Sequence, Union
+
+import numpy as np
+from bson import Binary
+
+from app.config import settings
+
+FORMATS = {"float32": 1, "float16": 2, "int8": 3}
+_CODES = {code: name for name, code in FORMATS.items()}
+_HEADER = 4
+
+
+def encode(vector: Union[Sequence[float], np.ndarray], fmt: str = None) -> Binary:
+    fmt = fmt or settings.kb_embedding_format
+    code = FORMATS[fmt]
+    header = bytes([code, 0, 0, 0])
+    vec = np.asarray(vector, dtype=np.float32)
+    if fmt == "float32":
+        payload = vec.astype("<f4").tobytes()
+    elif fmt == "float16":
+        payload = vec.astype("<f2").tobytes()
+    else:
+        peak = float(np.max(np.abs(vec))) if vec.size else 0.0
+        scale = peak / 127.0 if peak else 1.0
+        quantized = np.clip(np.rint(vec / scale), -127, 127).astype(np.int8)
+        payload = np.float32(scale).astype("<f4").tobytes() + quantized.tobytes()
+    return Binary(header + payload)
+
+
+def decode(value: Union[bytes, Sequence[float]]) -> np.ndarray:
+    """Return a float32 (or float16) view of a stored embedding."""
+    if not isinstance(value, (bytes, bytearray, memoryview)):
+        return np.asarray(value, dtype=np.float32)
+    fmt = _CODES.get(value[0])
+    if fmt == "float32":
+        return np.frombuffer(value, dtype="<f4", offset=_HEADER)
+    if fmt == "float16":
+        return np.frombuffer(value, dtype="<f2", offset=_HEADER)
+    if fmt == "int8":
+        scale = np.frombuffer(value, dtype="<f4", count=1, offset=_HEADER)[0]
+        return np.frombuffer(value, dtype=np.int8, offset=_HEADER + 4).astype(np.float32) * scale
+    raise ValueError(f"Unknown embedding format code {value[0]}")
+
+
+def format_of(value: Union[bytes, Sequence[float]]) -> str:
+    if not isinstance(value, (bytes, bytearray, memoryview)):
+        return "array"
+    return _CODES.get(value[0], "unknown")
@@ -0,0 +1,59 @@
+"""Content‑addressed store of chunk embeddings shared across KBs and users.
+
+Embeddings are keyed by a SHA‑256 of the model name and the exact chunk text,
+so re‑uploading a document (or a lightly edited revision) only pays for the
+chunks that have never been embedded before.
+"""
+
+import hashlib
+from typing import Dict, Sequence
+
+import numpy as np
+from pymongo.errors import BulkWriteError
+
+from app.db import db
+from app.metrics import register_stats
+from app.registry import lazy, registry
+from app.services.embedding_codec import decode, encode
+
+DUPLICATE_KEY = 11000
+
+
+def content_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    def __init__(self):
+        self.collection = db["embedding_store"]
+        # Process‑wide counters, reported alongside other service metrics.
+        self.stats = {"reused": 0, "embedded": 0}
+
+    async def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        cursor = self.collection.find({"_id": {"$in": list(keys)}}, {"_id": 1, "embedding": 1})
+        return {doc["_id"]: decode(doc["embedding"]) async for doc in cursor}
+
+    async def put_many(self, model: str, items: Dict[str, np.ndarray]) -> None:
+        if not items:
+            return
+        docs = [{"_id": key, "model": model, "embedding": encode(emb)} for key, emb in items.items()]
+        try:
+            await self.collection.insert_many(docs, ordered=False)
+        except BulkWriteError as exc:
+            # Another ingestion stored the same chunk first – that's fine.
+            if any(err.get("code") != DUPLICATE_KEY for err in exc.details.get("writeErrors", [])):
+                raise
+
+
+@registry.provider("embedding_store")
+def get_embedding_store() -> EmbeddingStore:
+    return EmbeddingStore()
+
+
+def _stats() -> dict:
+    store = registry.peek("embedding_store")
+    return store.stats if store is not None else {}
+
+
+embedding_store = lazy(get_embedding_store)
+register_stats("embedding_store", "Chunk embeddings reused vs. newly embedded", _stats)
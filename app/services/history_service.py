@@ -1,22 +1,212 @@
-from typing import List, Optional
+import asyncio
+import base64
+import json
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from app.config import settings
 from app.db import db
+from app.indexes import declare_index, declare_query
+from app.metrics import Histogram, register_stats, timed
 from app.models.history import MessageHistory, SessionSummary
+from app.registry import registry
+from app.services.cache import TTLCache
+from app.services.cold_history import ColdStore
+from app.services.message_buffer import MessageBuffer
+
+
+class SessionState:
+    """Cached view of an active session: its system prompt, rolling summary,
+    the messages not yet folded into the summary (oldest first), whether
+    replies may come from the response cache and the session's revision in
+    ``session_meta`` that all of this reflects.
+
+    When more messages were unfolded than ``chat_context_max_messages``,
+    only the newest of them are loaded and *backlog_until* is the timestamp
+    of the newest one left out; the next fold must cover up to it.
+    """
+
+    __slots__ = ("system_prompt", "summary", "messages", "response_cache", "rev", "backlog_until")
+
+    def __init__(
+        self,
+        system_prompt: Optional[str],
+        summary: Optional[dict],
+        messages: List[MessageHistory],
+        response_cache: bool = True,
+        rev: int = 0,
+        backlog_until: Optional[datetime] = None,
+    ):
+        self.system_prompt = system_prompt
+        self.summary = summary
+        self.messages = messages
+        self.response_cache = response_cache
+        self.rev = rev
+        self.backlog_until = backlog_until
+
+
+# _id is the tie‑breaker of keyset pagination, so it is part of the sort keys
+declare_index("messages", [("user_id", 1), ("session_id", 1), ("timestamp", 1), ("_id", 1)])
+declare_index("messages", [("user_id", 1), ("timestamp", 1), ("_id", 1)])
+declare_index("session_meta", [("user_id", 1), ("session_id", 1)], unique=True)
+declare_query("messages", "recent messages of a session",
+              {"user_id": "u", "session_id": "s"}, sort=[("timestamp", -1)])
+declare_query("messages", "history of a session", {"user_id": "u", "session_id": "s"}, sort=[("timestamp", 1)])
+declare_query("messages", "history of a user", {"user_id": "u"}, sort=[("timestamp", 1)])
+declare_query("messages", "history page of a session",
+              {"user_id": "u", "session_id": "s"}, sort=[("timestamp", 1), ("_id", 1)])
+declare_query("messages", "history page of a user", {"user_id": "u"}, sort=[("timestamp", 1), ("_id", 1)])
+declare_index("sessions", [("user_id", 1), ("session_id", 1)], unique=True)
+declare_index("sessions", [("user_id", 1), ("timestamp", -1)])
+declare_query("sessions", "sessions sidebar", {"user_id": "u"}, sort=[("timestamp", -1)])
+declare_query("session_meta", "session prompt and summary", {"user_id": "u", "session_id": "s"})
+declare_query("session_meta", "session revision", {"user_id": "u", "session_id": "s"})
+
+
+# Length of the session title derived from its first message.
+TITLE_LENGTH = 60
+# Sorts after every _id, so keyset (t, LAST_OBJECT_ID) skips all of t.
+LAST_OBJECT_ID = ObjectId("f" * 24)
+
+
+# Shared by every HistoryService instance in the process so that writes made
+# through one are visible to reads through another. Every write to a session
+# advances ``rev`` in its session_meta document once it has landed, and a
+# cached state is only used while that revision still matches – so changes
+# made by other workers are picked up on the next turn.
+session_cache = TTLCache(settings.history_cache_sessions, settings.history_cache_ttl_seconds)
+_revision_stats = {"checks": 0, "stale": 0}
+register_stats(
+    "history_session_cache", "Session state cache", lambda: {**session_cache.stats(), **_revision_stats}
+)
+
+
+def _written(revisions: Dict[Tuple[str, str], int]) -> None:
+    """Advance cached states past the revisions a buffer flush just made."""
+    for key, count in revisions.items():
+        state = session_cache.peek(key)
+        if state is not None:
+            state.rev += count
+
+
+@registry.provider("message_buffer", close=lambda buffer: buffer.close())
+def get_message_buffer() -> Optional[MessageBuffer]:
+    """Write‑behind buffer shared by every HistoryService instance; ``None``
+    when messages are written synchronously."""
+    if not settings.history_write_behind:
+        return None
+    return MessageBuffer(
+        db["messages"],
+        db["sessions"],
+        settings.history_write_batch_size,
+        settings.history_write_interval_ms / 1000,
+        revisions=db["session_meta"],
+        on_written=_written,
+    )
+
+
+def _buffer_stats() -> dict:
+    buffer = registry.peek("message_buffer")
+    return buffer.stats if buffer is not None else {}
+
+
+register_stats("history_write_buffer", "Write‑behind message buffer", _buffer_stats)
+
+
+HISTORY_OPS = Histogram("history_operation_seconds", "Duration of HistoryService operations", ("op",))
+# In‑flight loads by session; the flag is set when a write races the load.
+_loading: Dict[Tuple[str, str], Tuple[asyncio.Future, List[bool]]] = {}
+
 
 class HistoryService:
     def __init__(self):
         self.collection = db["messages"]
+        # One summary document per session, maintained by save_message so the
+        # sidebar never has to aggregate the message log.
+        self.sessions = db["sessions"]
+        self.buffer = get_message_buffer()
+        # Compressed buckets of old messages (see app.services.cold_history)
+        self.cold = ColdStore() if settings.history_cold_tier else None
 
-    async def save_message(self, user_id: str, session_id: str, role: str, content: str) -> None:
+    @timed(HISTORY_OPS, "history.save_message", op="save_message")
+    async def save_message(
+        self, user_id: str, session_id: str, role: str, content: str, truncated: bool = False
+    ) -> datetime:
+        """Store a message and return its timestamp, which together with the
+        session identifies it for :meth:`update_message`."""
+        now = datetime.utcnow()
         doc = {
             "user_id": user_id,
             "session_id": session_id,
             "role": role,
             "content": content,
-            "timestamp": datetime.utcnow()
+            # BSON dates have millisecond precision – match what reads return
+            "timestamp": now.replace(microsecond=now.microsecond // 1000 * 1000)
         }
-        await self.collection.insert_one(doc)
+        if truncated:
+            doc["truncated"] = True
+        rev = None
+        if self.buffer is not None:
+            # the buffer advances the revision once the message is written
+            await self.buffer.add(doc, content[:TITLE_LENGTH])
+        else:
+            await asyncio.gather(
+                self.collection.insert_one(doc),
+                self.sessions.update_one(
+                    {"user_id": user_id, "session_id": session_id},
+                    {
+                        "$set": {"last_message": content, "timestamp": doc["timestamp"]},
+                        "$inc": {"message_count": 1},
+                        "$setOnInsert": {"title": content[:TITLE_LENGTH], "created_at": doc["timestamp"]},
+                    },
+                    upsert=True,
+                ),
+            )
+            rev = await self._advance_revision(user_id, session_id)
 
+        state = self._written_state(user_id, session_id, rev)
+        if state is not None:
+            # trimmed by set_summary once folded – see ContextBuilder.assemble
+            state.messages.append(MessageHistory(**doc))
+        return doc["timestamp"]
+
+    @timed(HISTORY_OPS, "history.update_message", op="update_message")
+    async def update_message(
+        self, user_id: str, session_id: str, timestamp: datetime, content: str, truncated: bool = False
+    ) -> None:
+        """Replace the content of a message saved earlier – used to checkpoint
+        a reply while it is still being streamed."""
+        rev = None
+        if self.buffer is None or not await self.buffer.amend(
+            user_id, session_id, timestamp, content, truncated
+        ):
+            if truncated:
+                update = {"$set": {"content": content, "truncated": True}}
+            else:
+                update = {"$set": {"content": content}, "$unset": {"truncated": ""}}
+            await asyncio.gather(
+                self.collection.update_one(
+                    {"user_id": user_id, "session_id": session_id, "timestamp": timestamp}, update
+                ),
+                self.sessions.update_one(
+                    {"user_id": user_id, "session_id": session_id, "timestamp": timestamp},
+                    {"$set": {"last_message": content}},
+                ),
+            )
+            rev = await self._advance_revision(user_id, session_id)
+
+        state = self._written_state(user_id, session_id, rev)
+        if state is not None:
+            for i in range(len(state.messages) - 1, -1, -1):
+                if state.messages[i].timestamp == timestamp:
+                    state.messages[i] = state.messages[i].model_copy(
+                        update={"content": content, "truncated": truncated}
+                    )
+                    break
+
+    @timed(HISTORY_OPS, "history.get_messages", op="get_messages")
     async def get_messages(
         self,
         user_id: str,
@@ -24,61 +214,416 @@ class HistoryService:
         skip: int = 0,
         limit: int = 100
     ) -> List[MessageHistory]:
+        await self._sync(user_id)
+        query = {"user_id": user_id}
+        if session_id:
+            query["session_id"] = session_id
+        docs = []
+        cutoff = await self._cold_cutoff(user_id)
+        if cutoff is not None:
+            # every cold message is older than every hot one
+            docs, cold = await self.cold.read(user_id, session_id, cutoff, skip, limit)
+            skip = max(0, skip - cold)
+            query["timestamp"] = {"$gte": cutoff}
+        if len(docs) < limit:
+            cursor = self.collection.find(query).sort("timestamp", 1).skip(skip).limit(limit - len(docs))
+            docs += await cursor.to_list(length=limit - len(docs))
+        return [MessageHistory(**doc) for doc in docs]
+
+    # ------------------------- Keyset pagination ------------------------- #
+
+    @staticmethod
+    def _encode_cursor(doc: dict) -> str:
+        raw = json.dumps({"t": doc["timestamp"].isoformat(), "i": str(doc["_id"])})
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    @staticmethod
+    def _decode_cursor(token: str) -> Tuple[datetime, ObjectId]:
+        """Raises ``ValueError`` for tokens this service didn't issue."""
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+            data = json.loads(raw)
+            return datetime.fromisoformat(data["t"]), ObjectId(data["i"])
+        except (ValueError, KeyError, TypeError, InvalidId) as exc:
+            raise ValueError("Invalid cursor") from exc
+
+    def _history_query(self, user_id: str, session_id: Optional[str]) -> dict:
         query = {"user_id": user_id}
         if session_id:
             query["session_id"] = session_id
-        cursor = self.collection.find(query).sort("timestamp", 1).skip(skip).limit(limit)
+        return query
+
+    @timed(HISTORY_OPS, "history.get_messages_page", op="get_messages_page")
+    async def get_messages_page(
+        self,
+        user_id: str,
+        session_id: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+    ) -> Tuple[List[MessageHistory], Optional[str]]:
+        """Return one page of messages in chronological order and the opaque
+        cursor of the next page (``None`` on the last page).
+
+        Pages are addressed by the (timestamp, _id) of their last message
+        rather than an offset, so every page costs the same index seek no
+        matter how deep it is.
+        """
+        await self._sync(user_id)
+        query = self._history_query(user_id, session_id)
+        after = None
+        if cursor:
+            ts, oid = after = self._decode_cursor(cursor)
+            query["$or"] = [{"timestamp": {"$gt": ts}}, {"timestamp": ts, "_id": {"$gt": oid}}]
+        docs = []
+        cutoff = await self._cold_cutoff(user_id)
+        if cutoff is not None:
+            docs, _cold = await self.cold.read(user_id, session_id, cutoff, limit=limit + 1, after=after)
+            query["timestamp"] = {"$gte": cutoff}
+        if len(docs) <= limit:
+            docs += await (
+                self.collection.find(query)
+                .sort([("timestamp", 1), ("_id", 1)])
+                .limit(limit + 1 - len(docs))
+                .to_list(length=limit + 1 - len(docs))
+            )
+        next_cursor = self._encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+        return [MessageHistory(**doc) for doc in docs[:limit]], next_cursor
+
+    async def export_messages(self, user_id: str, session_id: Optional[str] = None) -> AsyncIterator[bytes]:
+        """Stream every message as NDJSON, a few dozen KB at a time.
+
+        Iterates the Motor cursor directly, so memory use is bounded by the
+        cursor batch size regardless of history length.
+        """
+        await self._sync(user_id)
+        buffer = []
+        size = 0
+        async for doc in self._export_docs(user_id, session_id):
+            doc["timestamp"] = doc["timestamp"].isoformat() + "Z"
+            line = json.dumps(doc, ensure_ascii=False).encode("utf-8") + b"\n"
+            buffer.append(line)
+            size += len(line)
+            if size >= 64 * 1024:
+                yield b"".join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield b"".join(buffer)
+
+    async def _export_docs(self, user_id: str, session_id: Optional[str]) -> AsyncIterator[dict]:
+        fields = ("session_id", "role", "content", "timestamp")
+        query = self._history_query(user_id, session_id)
+        cutoff = await self._cold_cutoff(user_id)
+        if cutoff is not None:
+            after = None
+            while True:
+                docs, _cold = await self.cold.read(user_id, session_id, cutoff, limit=1000, after=after)
+                for doc in docs:
+                    yield {field: doc[field] for field in fields}
+                if len(docs) < 1000:
+                    break
+                after = (docs[-1]["timestamp"], docs[-1]["_id"])
+            query["timestamp"] = {"$gte": cutoff}
+        cursor = (
+            self.collection.find(query, {"_id": 0, **{field: 1 for field in fields}})
+            .sort([("timestamp", 1), ("_id", 1)])
+            .batch_size(1000)
+        )
+        async for doc in cursor:
+            yield doc
+
+    @timed(HISTORY_OPS, "history.get_recent_messages", op="get_recent_messages")
+    async def get_recent_messages(
+        self,
+        user_id: str,
+        session_id: str,
+        since: Optional[datetime] = None,
+        limit: int = 200,
+    ) -> List[MessageHistory]:
+        """Return the newest *limit* messages of a session (oldest first),
+        optionally only those after *since*."""
+        await self._sync(user_id)
+        query = {"user_id": user_id, "session_id": session_id}
+        bounds = {}
+        if since is not None:
+            bounds["$gt"] = since
+        cutoff = await self._cold_cutoff(user_id)
+        if cutoff is not None:
+            bounds["$gte"] = cutoff
+        if bounds:
+            query["timestamp"] = bounds
+        cursor = self.collection.find(query).sort("timestamp", -1).limit(limit)
         docs = await cursor.to_list(length=limit)
+        docs.reverse()
+        if cutoff is not None and len(docs) < limit and (since is None or since < cutoff):
+            # a session resumed after its older part went cold
+            docs = await self.cold.recent(user_id, session_id, cutoff, since, limit - len(docs)) + docs
+        return [MessageHistory(**doc) for doc in docs]
+
+    @timed(HISTORY_OPS, "history.get_messages_after", op="get_messages_after")
+    async def get_messages_after(
+        self,
+        user_id: str,
+        session_id: str,
+        since: Optional[datetime],
+        until: datetime,
+        limit: int = 200,
+    ) -> List[MessageHistory]:
+        """Return the oldest *limit* messages of a session after *since* and
+        up to *until* (oldest first) – pages through the part of a session
+        its summary doesn't cover yet."""
+        await self._sync(user_id)
+        bounds = {"$lte": until}
+        if since is not None:
+            bounds["$gt"] = since
+        docs = []
+        cutoff = await self._cold_cutoff(user_id)
+        if cutoff is not None:
+            if since is None or since < cutoff:
+                # every cold message is older than every hot one
+                after = (since, LAST_OBJECT_ID) if since is not None else None
+                cold, _total = await self.cold.read(user_id, session_id, cutoff, limit=limit, after=after)
+                docs = [doc for doc in cold if doc["timestamp"] <= until]
+            bounds["$gte"] = cutoff
+        if len(docs) < limit:
+            docs += await (
+                self.collection.find({"user_id": user_id, "session_id": session_id, "timestamp": bounds})
+                .sort([("timestamp", 1), ("_id", 1)])
+                .limit(limit - len(docs))
+                .to_list(length=limit - len(docs))
+            )
         return [MessageHistory(**doc) for doc in docs]
 
+    @timed(HISTORY_OPS, "history.delete_session", op="delete_session")
     async def delete_session(self, user_id: str, session_id: str) -> int:
         """Delete all messages for a given user/session. Returns deleted count."""
-        res = await self.collection.delete_many({"user_id": user_id, "session_id": session_id})
-        return res.deleted_count
+        if self.buffer is not None:
+            await self.buffer.discard(user_id, session_id)
+        res, _ = await asyncio.gather(
+            self.collection.delete_many({"user_id": user_id, "session_id": session_id}),
+            self.sessions.delete_one({"user_id": user_id, "session_id": session_id}),
+        )
+        cold = 0
+        if self.cold is not None:
+            # only once the hot messages are gone – see ColdStore.delete_session
+            cold = await self.cold.delete_session(user_id, session_id)
+        await self._advance_revision(user_id, session_id)
+        self._cached_state(user_id, session_id)  # flag any racing load
+        session_cache.pop((user_id, session_id))
+        return res.deleted_count + cold
+
+    async def _cold_cutoff(self, user_id: str) -> Optional[datetime]:
+        """Where *user_id*'s hot tier starts; ``None`` when nothing is cold."""
+        if self.cold is None:
+            return None
+        return await self.cold.cutoff(user_id)
+
+    async def _sync(self, user_id: str) -> None:
+        """Read‑your‑writes: flush *user_id*'s buffered messages first."""
+        if self.buffer is not None:
+            await self.buffer.sync(user_id)
+
+    # ------------------------- Session state cache ----------------------- #
+
+    def _cached_state(self, user_id: str, session_id: str) -> Optional[SessionState]:
+        """Cached state for a session, if any. Also flags racing loads as stale
+        – every write path calls this."""
+        key = (user_id, session_id)
+        loading = _loading.get(key)
+        if loading is not None:
+            loading[1][0] = True
+        return session_cache.peek(key)
+
+    def _written_state(self, user_id: str, session_id: str, rev: Optional[int]) -> Optional[SessionState]:
+        """Cached state to apply a write to that took the session to *rev*
+        (``None`` when the revision is advanced later, by the buffer).
+
+        If another write got in between, the entry is dropped instead and the
+        next turn reloads it.
+        """
+        state = self._cached_state(user_id, session_id)
+        if state is None or rev is None:
+            return state
+        if state.rev != rev - 1:
+            session_cache.pop((user_id, session_id))
+            return None
+        state.rev = rev
+        return state
+
+    async def _advance_revision(self, user_id: str, session_id: str, update: Optional[dict] = None) -> int:
+        """Apply *update* to the session's meta document, advance its
+        revision and return the new one."""
+        doc = await self._meta_collection().find_one_and_update(
+            {"user_id": user_id, "session_id": session_id},
+            {**(update or {}), "$inc": {"rev": 1}},
+            projection={"rev": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc["rev"]
+
+    async def _revision(self, user_id: str, session_id: str) -> int:
+        meta = await self._meta_collection().find_one({"user_id": user_id, "session_id": session_id}, {"rev": 1})
+        return meta.get("rev", 0) if meta else 0
+
+    @timed(HISTORY_OPS, "history.get_session_state", op="get_session_state")
+    async def get_session_state(self, user_id: str, session_id: str) -> SessionState:
+        """Everything needed to build a prompt for the session.
+
+        Warm sessions are served from :data:`session_cache` after a point read
+        of their revision; writes through this service keep the cache current.
+        """
+        key = (user_id, session_id)
+        state = session_cache.get(key)
+        if state is not None:
+            if not settings.history_cache_validate:
+                return state
+            _revision_stats["checks"] += 1
+            if await self._revision(user_id, session_id) == state.rev:
+                return state
+            # written by another worker since it was cached
+            _revision_stats["stale"] += 1
+            if session_cache.peek(key) is state:
+                session_cache.pop(key)
+
+        pending = _loading.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending[0])
+
+        future = asyncio.get_running_loop().create_future()
+        stale = [False]
+        _loading[key] = (future, stale)
+        try:
+            state = await self._load_state(user_id, session_id)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            future.exception()
+            raise
+        else:
+            if not stale[0]:
+                session_cache.set(key, state)
+            future.set_result(state)
+            return state
+        finally:
+            _loading.pop(key, None)
+
+    def start_session(self, user_id: str, session_id: str) -> SessionState:
+        """Cache an empty state for a freshly generated session id – there is
+        nothing in the database to load yet."""
+        state = SessionState(None, None, [])
+        session_cache.set((user_id, session_id), state)
+        return state
+
+    @staticmethod
+    def cache_stats() -> dict:
+        """Hit/miss counters of the session cache and of its revision checks."""
+        return {**session_cache.stats(), **_revision_stats}
+
+    @timed(HISTORY_OPS, "history._load_state", op="_load_state")
+    async def _load_state(self, user_id: str, session_id: str) -> SessionState:
+        # so that the revision read below already counts buffered messages
+        await self._sync(user_id)
+        # Meta first, then messages – not concurrently. Writers store the
+        # message before advancing the revision, so a write that lands
+        # between the two reads leaves this state with an older revision and
+        # the next check reloads it. Read the other way round, a state could
+        # miss a message yet carry the revision that includes it, and stay
+        # stale until evicted. The messages also start at summary_until.
+        meta = await self._meta_collection().find_one(
+            {"user_id": user_id, "session_id": session_id},
+            {"system_prompt": 1, "summary": 1, "summary_until": 1, "response_cache": 1, "rev": 1},
+        ) or {}
+        summary = None
+        if meta.get("summary"):
+            summary = {"summary": meta["summary"], "summary_until": meta["summary_until"]}
+        limit = settings.chat_context_max_messages
+        messages = await self.get_recent_messages(
+            user_id,
+            session_id,
+            since=summary["summary_until"] if summary else None,
+            limit=limit + 1,
+        )
+        backlog_until = None
+        if len(messages) > limit:
+            # older unfolded messages stay in Mongo until a fold pages
+            # through them
+            backlog_until = messages[0].timestamp
+            messages = messages[1:]
+        return SessionState(
+            meta.get("system_prompt"),
+            summary,
+            messages,
+            meta.get("response_cache", True),
+            meta.get("rev", 0),
+            backlog_until,
+        )
 
     # ---------------------- System prompt helpers ---------------------- #
 
     def _meta_collection(self):
         return db["session_meta"]
 
+    @timed(HISTORY_OPS, "history.set_system_prompt", op="set_system_prompt")
     async def set_system_prompt(self, user_id: str, session_id: str, prompt: str):
-        col = self._meta_collection()
-        await col.update_one(
-            {"user_id": user_id, "session_id": session_id},
-            {"$set": {"system_prompt": prompt}},
-            upsert=True,
-        )
+        rev = await self._advance_revision(user_id, session_id, {"$set": {"system_prompt": prompt}})
+        state = self._written_state(user_id, session_id, rev)
+        if state is not None:
+            state.system_prompt = prompt
 
     async def get_system_prompt(self, user_id: str, session_id: str):
-        doc = await self._meta_collection().find_one({"user_id": user_id, "session_id": session_id})
-        return doc.get("system_prompt") if doc else None
+        return (await self.get_session_state(user_id, session_id)).system_prompt
+
+    @timed(HISTORY_OPS, "history.set_response_cache", op="set_response_cache")
+    async def set_response_cache(self, user_id: str, session_id: str, enabled: bool):
+        """Opt a session in or out of cached replies."""
+        rev = await self._advance_revision(user_id, session_id, {"$set": {"response_cache": enabled}})
+        state = self._written_state(user_id, session_id, rev)
+        if state is not None:
+            state.response_cache = enabled
 
+    async def get_response_cache(self, user_id: str, session_id: str) -> bool:
+        return (await self.get_session_state(user_id, session_id)).response_cache
+
+    async def get_summary(self, user_id: str, session_id: str) -> Optional[dict]:
+        """Rolling summary of the older part of a session, if one exists.
+
+        Returns a dict with ``summary`` and ``summary_until`` (timestamp of the
+        last message folded into it).
+        """
+        return (await self.get_session_state(user_id, session_id)).summary
+
+    @timed(HISTORY_OPS, "history.set_summary", op="set_summary")
+    async def set_summary(self, user_id: str, session_id: str, summary: str, until: datetime):
+        rev = await self._advance_revision(
+            user_id, session_id, {"$set": {"summary": summary, "summary_until": until}}
+        )
+        state = self._written_state(user_id, session_id, rev)
+        if state is not None:
+            state.summary = {"summary": summary, "summary_until": until}
+            state.messages = [m for m in state.messages if m.timestamp > until]
+            if state.backlog_until is not None and until >= state.backlog_until:
+                state.backlog_until = None
+
+    @timed(HISTORY_OPS, "history.get_sessions", op="get_sessions")
     async def get_sessions(self, user_id: str, limit: int = 100) -> List[SessionSummary]:
         """Return a list of distinct sessions for the given user ordered by the
         timestamp of their most recent message (descending).
 
-        It uses a MongoDB aggregation pipeline to group messages by session and
-        pick the last (most recent) message in each session. The pipeline is
-        designed to be efficient even when the total number of messages is
-        large, because it leverages indexes (if present) and only returns the
-        limited amount of data needed for a sidebar list.
+        Reads the materialised ``sessions`` collection – a single range scan
+        of the (user_id, timestamp) index, independent of how many messages
+        the user has ever sent.
         """
-        pipeline = [
-            {"$match": {"user_id": user_id}},
-            {
-                "$sort": {"timestamp": -1}  # newest messages first so $first gives us last message
-            },
-            {
-                "$group": {
-                    "_id": "$session_id",
-                    "last_message": {"$first": "$content"},
-                    "timestamp": {"$first": "$timestamp"},
-                }
-            },
-            {"$sort": {"timestamp": -1}},
-            {"$limit": limit},
-        ]
-
-        cursor = self.collection.aggregate(pipeline)
+        await self._sync(user_id)
+        cursor = self.sessions.find(
+            {"user_id": user_id},
+            {"_id": 0, "session_id": 1, "last_message": 1, "timestamp": 1, "title": 1, "message_count": 1},
+        ).sort("timestamp", -1).limit(limit)
         docs = await cursor.to_list(length=limit)
-        return [SessionSummary(session_id=doc["_id"], last_message=doc["last_message"], timestamp=doc["timestamp"]) for doc in docs]
+        return [SessionSummary(**doc) for doc in docs]
+
+
+@registry.provider("history_service")
+def get_history_service() -> HistoryService:
+    return HistoryService()
@@ -0,0 +1,206 @@
+"""Background PDF ingestion jobs.
+
+Uploads are written to ``settings.kb_upload_dir`` and processed by an asyncio
+task so the HTTP request returns immediately. Job state and progress live in
+the ``kb_jobs`` collection; a failed job can be resumed and will only embed
+the chunks that were not persisted by the previous attempt.
+
+A job runs in whichever worker claims it: claiming atomically sets ``owner``
+and a ``lease_expires`` that the running worker keeps pushing forward. A job
+is only claimable while nobody's lease on it is live, so a resume that lands
+on another worker can't start a second run. A worker that dies leaves a
+lease that expires after :data:`LEASE_SECONDS`, and then the job can be
+resumed anywhere.
+"""
+
+import asyncio
+import os
+import shutil
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from fastapi import UploadFile
+from pymongo import ReturnDocument
+
+from app.config import settings
+from app.db import db
+from app.registry import registry
+from app.services.kb_service import KnowledgeBaseService, get_kb_service
+
+# How long a claim on a job lasts without a heartbeat, and how often the
+# worker running the job renews it.
+LEASE_SECONDS = 60
+HEARTBEAT_SECONDS = 20
+
+# Jobs this process runs, by id – keeps a reference to each task.
+_running: Dict[str, asyncio.Task] = {}
+
+
+class IngestJobService:
+    def __init__(self, kbs: KnowledgeBaseService):
+        self.collection = db["kb_jobs"]
+        self.kbs = kbs
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    @staticmethod
+    def _upload_path(job_id: str) -> str:
+        return os.path.join(settings.kb_upload_dir, f"{job_id}.pdf")
+
+    async def create_job(self, user_id: str, file: UploadFile) -> dict:
+        """Persist the upload, record a queued job and start processing it."""
+        job_id = str(uuid.uuid4())
+        path = self._upload_path(job_id)
+        os.makedirs(settings.kb_upload_dir, exist_ok=True)
+
+        def save():
+            with open(path, "wb") as out:
+                shutil.copyfileobj(file.file, out)
+
+        await asyncio.to_thread(save)
+
+        now = datetime.utcnow()
+        job = {
+            "_id": job_id,
+            "kb_id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "filename": file.filename,
+            "status": "queued",
+            "pages": 0,
+            "chunks": 0,
+            "chunks_embedded": 0,
+            "chunks_reused": 0,
+            "chunks_new": 0,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        await self.collection.insert_one(job)
+        return await self._claim(job_id) or job
+
+    async def get_job(self, user_id: str, job_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"_id": job_id, "user_id": user_id})
+
+    async def resume_job(self, user_id: str, job_id: str) -> Optional[dict]:
+        """Restart a job that failed or whose worker went away; chunks stored
+        by earlier attempts are kept. A job that is still running somewhere
+        is returned as it is."""
+        job = await self.get_job(user_id, job_id)
+        if job is None:
+            return None
+        return await self._claim(job_id) or await self.get_job(user_id, job_id)
+
+    async def aclose(self) -> None:
+        """Stop running jobs on shutdown; they stay resumable, at once by
+        any worker since their leases are released."""
+        job_ids = list(_running)
+        tasks = list(_running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if job_ids:
+            await self.collection.update_many(
+                {"_id": {"$in": job_ids}, "owner": self.owner}, {"$set": {"lease_expires": None}}
+            )
+
+    async def _claim(self, job_id: str) -> Optional[dict]:
+        """Take the job and start running it here; ``None`` if it is finished
+        or another worker holds a live lease on it."""
+        now = datetime.utcnow()
+        job = await self.collection.find_one_and_update(
+            {
+                "_id": job_id,
+                "status": {"$ne": "completed"},
+                "$or": [{"lease_expires": None}, {"lease_expires": {"$lt": now}}],
+            },
+            {
+                "$set": {
+                    "status": "queued",
+                    "error": None,
+                    "owner": self.owner,
+                    "lease_expires": now + timedelta(seconds=LEASE_SECONDS),
+                    "updated_at": now,
+                }
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is None:
+            return None
+        task = asyncio.create_task(self._run(job))
+        _running[job_id] = task
+        task.add_done_callback(lambda _t: _running.pop(job_id, None))
+        return job
+
+    async def _heartbeat(self, job_id: str) -> None:
+        """Renew the lease while the job runs; returns once it was lost."""
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            now = datetime.utcnow()
+            result = await self.collection.update_one(
+                {"_id": job_id, "owner": self.owner},
+                {"$set": {"lease_expires": now + timedelta(seconds=LEASE_SECONDS)}},
+            )
+            if not result.matched_count:
+                return
+
+    async def _update(self, job_id: str, **fields) -> Optional[dict]:
+        """Update the job unless another worker has claimed it since."""
+        fields["updated_at"] = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {"_id": job_id, "owner": self.owner}, {"$set": fields}, return_document=ReturnDocument.AFTER
+        )
+
+    async def _run(self, job: dict) -> None:
+        job_id = job["_id"]
+        ingest = asyncio.create_task(self._ingest(job))
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            await asyncio.wait({ingest, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            heartbeat.cancel()
+            if not ingest.done():
+                # the lease was lost – the job belongs to another worker now
+                print("KB ingestion lease lost", job_id)
+                ingest.cancel()
+            await asyncio.gather(ingest, heartbeat, return_exceptions=True)
+
+    async def _ingest(self, job: dict) -> None:
+        job_id = job["_id"]
+        await self._update(job_id, status="running")
+
+        # a resumed job only reports on the chunks it handles itself
+        carried = {key: job.get(key, 0) for key in ("chunks_reused", "chunks_new")}
+
+        async def on_progress(progress: dict):
+            for key, value in carried.items():
+                progress[key] += value
+            # batches finish out of order – never move a counter backwards
+            await self.collection.update_one(
+                {"_id": job_id},
+                {"$max": progress, "$set": {"updated_at": datetime.utcnow()}},
+            )
+
+        try:
+            await self.kbs.ingest_pdf(
+                job["user_id"],
+                self._upload_path(job_id),
+                job["filename"],
+                kb_id=job["kb_id"],
+                on_progress=on_progress,
+            )
+        except Exception as e:
+            print("KB ingestion failed", job_id, e)
+            await self._update(job_id, status="failed", error=str(e), lease_expires=None)
+            return
+
+        await self._update(job_id, status="completed", lease_expires=None)
+        try:
+            os.remove(self._upload_path(job_id))
+        except OSError:
+            pass
+
+
+@registry.provider("ingest_jobs", close=lambda jobs: jobs.aclose())
+def get_ingest_jobs() -> IngestJobService:
+    return IngestJobService(get_kb_service())
@@ -1,120 +1,344 @@
 """Knowledge base service – handles PDF ingestion and retrieval."""
 
+import asyncio
 import uuid
 from datetime import datetime
-from typing import List
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 
-from fastapi import UploadFile
+from pymongo.errors import BulkWriteError
 
 from app.db import db
+from app.indexes import declare_index, declare_query
+from app.metrics import Histogram, timed
+from app.registry import registry
 from app.config import settings
 
-# Third‑party imports – we expect PyPDF2 to be installed. If missing, raise a
-# clear error so that maintainers know which extra lib to add to
-# requirements.txt.
+import numpy as np
 
-try:
-    import PyPDF2
-except ImportError as exc:  # pragma: no cover
-    raise ImportError("PyPDF2 must be installed to use the knowledge‑base features") from exc
+from app.services import ann_index, pdf_extract, shared_index
+from app.services.embedding_codec import encode
+from app.services.embedding_store import content_key, embedding_store
+from app.services.lexical_index import term_counts
+from app.services.query_embedder import QueryEmbedder
+from app.services.upstream import BULK, Upstream, get_upstream
+from app.services.vector_index import RETRIEVAL_MODES, KBIndex, index_cache
 
-from openai import AsyncOpenAI
-import math
 
+EMBEDDING_MODEL = "text-embedding-ada-002"
 
-client = AsyncOpenAI(api_key=settings.openai_api_key)
+# unique, so a chunk stored by one run of an ingestion job can't be stored
+# again by another (app.tools.dedupe_kb_chunks upgrades older databases)
+declare_index("kb_chunks", [("kb_id", 1), ("user_id", 1), ("chunk_index", 1)], unique=True)
+declare_index("knowledge_bases", [("user_id", 1), ("created_at", -1)])
+declare_query("kb_chunks", "chunks of a KB", {"kb_id": "k", "user_id": "u"}, sort=[("chunk_index", 1)])
+declare_query("knowledge_bases", "KB list", {"user_id": "u"}, sort=[("created_at", -1)])
+
+KB_OPS = Histogram("kb_operation_seconds", "Duration of KnowledgeBaseService operations", ("op",))
 
 
 class KnowledgeBaseService:
     """CRUD & search for PDF knowledge bases stored in MongoDB."""
 
-    def __init__(self):
+    def __init__(self, upstream: Optional[Upstream] = None):
+        self.upstream = upstream or get_upstream()
+        self.query_embedder = QueryEmbedder(self.upstream, EMBEDDING_MODEL)
         self.kb_collection = db["knowledge_bases"]  # metadata documents
         self.chunk_collection = db["kb_chunks"]  # individual chunks with embeddings
 
     # ------------------------------ Ingestion ----------------------------- #
 
-    async def ingest_pdf(self, user_id: str, file: UploadFile, chunk_size: int = 1000, overlap: int = 200) -> str:
-        """Parse the uploaded PDF, chunk its text and embed each chunk.
+    @staticmethod
+    def iter_pages(path: str) -> AsyncIterator[str]:
+        """Yield the text of each page of the PDF at *path*, in order.
 
-        Returns the ID of the created knowledge base.
+        Extraction runs on the process pool in :mod:`app.services.pdf_extract`
+        so it never blocks the event loop.
         """
-        kb_id = str(uuid.uuid4())
-
-        # Read PDF bytes and extract text
-        pdf_reader = PyPDF2.PdfReader(file.file)
-        pages_text = [page.extract_text() or "" for page in pdf_reader.pages]
-        full_text = "\n".join(pages_text)
-
-        # simple overlapping chunking by characters
-        chunks = []
-        start = 0
-        while start < len(full_text):
-            end = start + chunk_size
-            chunk = full_text[start:end]
-            chunks.append(chunk)
-            start = end - overlap  # overlap for better continuity
-
-        # Generate embeddings in batches (OpenAI can handle multiple inputs)
-        embeddings_response = await client.embeddings.create(
-            model="text-embedding-ada-002",
-            input=chunks,
-        )
-        embeddings = [d.embedding for d in embeddings_response.data]
+        return pdf_extract.iter_pages(path)
+
+    @staticmethod
+    async def iter_chunks(pages: AsyncIterator[str], chunk_size: int = 1000, overlap: int = 200) -> AsyncIterator[str]:
+        """Overlapping character chunks of the newline‑joined *pages*.
+
+        Produces exactly the chunks of ``"\n".join(pages)`` sliced every
+        ``chunk_size - overlap`` characters, without holding the whole
+        document in memory.
+        """
+        step = chunk_size - overlap
+        buffer = ""
+        first = True
+        async for text in pages:
+            buffer += text if first else "\n" + text
+            first = False
+            while len(buffer) >= chunk_size:
+                yield buffer[:chunk_size]
+                buffer = buffer[step:]
+        while buffer:
+            yield buffer[:chunk_size]
+            buffer = buffer[step:]
+
+    @timed(KB_OPS, "kb.embed_texts", op="embed_texts")
+    async def embed_texts(self, texts: List[str], priority: int = BULK) -> List[np.ndarray]:
+        return await self.upstream.embed(EMBEDDING_MODEL, texts, priority)
+
+    @timed(KB_OPS, "kb.embed_chunks", op="embed_chunks")
+    async def embed_chunks(self, texts: List[str]) -> Tuple[List[np.ndarray], int]:
+        """Embed *texts*, reusing any embedding already in the shared store.
+
+        Returns the embeddings in input order and how many were reused.
+        """
+        keys = [content_key(EMBEDDING_MODEL, text) for text in texts]
+        known = await embedding_store.get_many(keys)
+
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in known:
+                missing.setdefault(key, text)
+        if missing:
+            fresh = dict(zip(missing, await self.embed_texts(list(missing.values()))))
+            await embedding_store.put_many(EMBEDDING_MODEL, fresh)
+            known.update(fresh)
+
+        reused = len(texts) - len(missing)
+        embedding_store.stats["reused"] += reused
+        embedding_store.stats["embedded"] += len(missing)
+        return [known[key] for key in keys], reused
+
+    @timed(KB_OPS, "kb.ingest_pdf", op="ingest_pdf")
+    async def ingest_pdf(
+        self,
+        user_id: str,
+        path: str,
+        filename: str,
+        kb_id: Optional[str] = None,
+        chunk_size: int = 1000,
+        overlap: int = 200,
+        on_progress: Optional[Callable[[dict], Awaitable[None]]] = None,
+    ) -> str:
+        """Parse the PDF at *path*, chunk its text and embed each chunk.
+
+        Chunks are embedded in batches of ``settings.kb_embed_batch_size`` with
+        at most ``settings.kb_embed_concurrency`` requests in flight, and each
+        batch is written as soon as it is embedded. Passing the *kb_id* of a
+        previous, interrupted run skips every chunk that was already persisted.
+
+        Returns the ID of the knowledge base.
+        """
+        kb_id = kb_id or str(uuid.uuid4())
+
+        existing = await self.chunk_collection.distinct("chunk_index", {"kb_id": kb_id, "user_id": user_id})
+        done = set(existing)
+        progress = {"pages": 0, "chunks": 0, "chunks_embedded": len(done), "chunks_reused": 0, "chunks_new": 0}
+
+        semaphore = asyncio.Semaphore(settings.kb_embed_concurrency)
+        tasks = set()
+        failures: List[Exception] = []
+
+        async def report():
+            if on_progress is not None:
+                await on_progress(dict(progress))
+
+        async def process(batch: List[Tuple[int, str]]):
+            try:
+                embeddings, reused = await self.embed_chunks([text for _idx, text in batch])
+                await self._insert_chunks(
+                    [
+                        {
+                            "kb_id": kb_id,
+                            "user_id": user_id,
+                            "chunk_index": idx,
+                            "text": text,
+                            "embedding": encode(emb),
+                            "terms": term_counts(text),
+                        }
+                        for (idx, text), emb in zip(batch, embeddings)
+                    ]
+                )
+                progress["chunks_embedded"] += len(batch)
+                progress["chunks_reused"] += reused
+                progress["chunks_new"] += len(batch) - reused
+                await report()
+            except Exception as exc:
+                failures.append(exc)
+            finally:
+                semaphore.release()
+
+        async def submit(batch: List[Tuple[int, str]]):
+            await semaphore.acquire()
+            # surface failures as early as possible instead of after the
+            # whole document has been read
+            if failures:
+                semaphore.release()
+                raise failures[0]
+            task = asyncio.create_task(process(batch))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        async def pages():
+            async for text in self.iter_pages(path):
+                progress["pages"] += 1
+                yield text
+
+        batch: List[Tuple[int, str]] = []
+        try:
+            async for chunk in self.iter_chunks(pages(), chunk_size, overlap):
+                idx = progress["chunks"]
+                progress["chunks"] += 1
+                if idx in done:
+                    continue
+                batch.append((idx, chunk))
+                if len(batch) >= settings.kb_embed_batch_size:
+                    await submit(batch)
+                    batch = []
+            if batch:
+                await submit(batch)
+            await asyncio.gather(*tasks)
+            if failures:
+                raise failures[0]
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
 
         now = datetime.utcnow()
         # Insert metadata doc
-        await self.kb_collection.insert_one(
+        await self.kb_collection.replace_one(
+            {"_id": kb_id},
             {
                 "_id": kb_id,
                 "user_id": user_id,
-                "filename": file.filename,
-                "chunks": len(chunks),
+                "filename": filename,
+                "chunks": progress["chunks"],
                 "created_at": now,
-            }
+            },
+            upsert=True,
         )
+        await report()
 
-        # Insert chunks with embedding
-        docs = [
-            {
-                "kb_id": kb_id,
-                "user_id": user_id,
-                "chunk_index": idx,
-                "text": chunk,
-                "embedding": emb,
-            }
-            for idx, (chunk, emb) in enumerate(zip(chunks, embeddings))
-        ]
-        if docs:
-            await self.chunk_collection.insert_many(docs)
+        await asyncio.to_thread(shared_index.retire, user_id, kb_id)
+        index_cache.invalidate(kb_id)
+        # Large KBs get an ANN index up front so the first query doesn't pay
+        # for building it.
+        if progress["chunks"] >= settings.kb_ann_threshold:
+            await asyncio.to_thread(ann_index.remove, kb_id)
+            await self.get_index(user_id, kb_id)
 
         return kb_id
 
+    async def _insert_chunks(self, docs: List[dict]) -> None:
+        """Insert *docs*, skipping chunks that are already stored."""
+        try:
+            await self.chunk_collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if not errors or any(error.get("code") != 11000 for error in errors):
+                raise
+
     # ------------------------------ Retrieval ----------------------------- #
 
-    async def retrieve(self, user_id: str, kb_id: str, query: str, top_k: int = 3) -> List[str]:
-        """Return the *top_k* most similar chunks for the given query."""
-        # Embed query
-        q_emb_resp = await client.embeddings.create(model="text-embedding-ada-002", input=[query])
-        q_emb = q_emb_resp.data[0].embedding
-
-        # Fetch all chunks for kb (could be optimised with vector DB) – OK for small pdfs
-        cursor = self.chunk_collection.find({"kb_id": kb_id, "user_id": user_id})
-        chunks = await cursor.to_list(length=None)
-
-        # Compute cosine similarity
-        def cosine(a, b):
-            dot = sum(i * j for i, j in zip(a, b))
-            norm_a = math.sqrt(sum(i * i for i in a))
-            norm_b = math.sqrt(sum(i * i for i in b))
-            if norm_a == 0 or norm_b == 0:
-                return -1
-            return dot / (norm_a * norm_b)
-
-        scored = [
-            (cosine(q_emb, doc["embedding"]), doc["text"])
-            for doc in chunks
-        ]
-        scored.sort(key=lambda t: t[0], reverse=True)
-        top_chunks = [text for _score, text in scored[:top_k]]
-        return top_chunks
+    async def _read_index(self, user_id: str, kb_id: str) -> KBIndex:
+        cursor = self.chunk_collection.find(
+            {"kb_id": kb_id, "user_id": user_id},
+            {"_id": 0, "chunk_index": 1, "text": 1, "embedding": 1, "terms": 1},
+        ).sort("chunk_index", 1)
+        docs = await cursor.to_list(length=None)
+        return KBIndex.from_docs(docs)
+
+    async def _publish_shared(self, user_id: str, kb_id: str) -> KBIndex:
+        """Load a finished KB and publish it as the host's shared copy, unless
+        another worker does so while we wait for the lock."""
+        async with shared_index.publishing(user_id, kb_id):
+            index = await asyncio.to_thread(shared_index.open_index, user_id, kb_id)
+            if index is not None:
+                return index
+            index = await self._read_index(user_id, kb_id)
+            if not len(index):
+                return index
+            try:
+                return await asyncio.to_thread(shared_index.publish, user_id, kb_id, index)
+            except Exception as e:
+                # this worker still has its own copy
+                shared_index.stats["failures"] += 1
+                print("Publishing KB index failed", e)
+                return index
+
+    @timed(KB_OPS, "kb._load_index", op="_load_index")
+    async def _load_index(self, user_id: str, kb_id: str) -> KBIndex:
+        index = None
+        if settings.kb_shared_index:
+            # only finished KBs are ever published
+            index = await asyncio.to_thread(shared_index.open_index, user_id, kb_id)
+        if index is None:
+            # a KB without its metadata document is still being ingested: it
+            # is read afresh for every query – never cached, published or
+            # given an ANN index
+            complete = await self.kb_collection.find_one({"_id": kb_id, "user_id": user_id}, {"_id": 1}) is not None
+            if complete and settings.kb_shared_index:
+                index = await self._publish_shared(user_id, kb_id)
+            else:
+                index = await self._read_index(user_id, kb_id)
+            index.complete = complete
+        if index.complete and len(index) >= settings.kb_ann_threshold:
+            try:
+                index.ann = await asyncio.to_thread(self._open_ann, kb_id, index)
+            except Exception as e:
+                # exact search still works – just slower
+                print("ANN index unavailable", e)
+        return index
+
+    @staticmethod
+    def _open_ann(kb_id: str, index: KBIndex):
+        rows, dim = index.matrix.shape
+        ann = ann_index.load(kb_id, rows, dim)
+        if ann is None:
+            # KB predates ANN support or the file went stale – rebuild it.
+            ann = ann_index.build_and_save(kb_id, index.matrix)
+        return ann
+
+    @timed(KB_OPS, "kb.get_index", op="get_index")
+    async def get_index(self, user_id: str, kb_id: str) -> KBIndex:
+        """Return the cached embedding matrix for a KB, loading it on a miss."""
+        index = await index_cache.get_or_load(user_id, kb_id, lambda: self._load_index(user_id, kb_id))
+        if index.version is not None and index.version != shared_index.version(user_id, kb_id):
+            # re‑ingested since it was mapped, possibly through another worker
+            index_cache.invalidate(kb_id)
+            index = await index_cache.get_or_load(user_id, kb_id, lambda: self._load_index(user_id, kb_id))
+        return index
+
+    @timed(KB_OPS, "kb.embed_query", op="embed_query")
+    async def embed_query(self, query: str) -> np.ndarray:
+        return await self.query_embedder.embed(query)
+
+    @timed(KB_OPS, "kb.retrieve", op="retrieve")
+    async def retrieve(
+        self,
+        user_id: str,
+        kb_id: str,
+        query: str,
+        top_k: int = 3,
+        query_embedding: Optional[np.ndarray] = None,
+        mode: str = "vector",
+    ) -> List[str]:
+        """Return the *top_k* best chunks for the given query.
+
+        *mode* is one of :data:`RETRIEVAL_MODES`. Pass *query_embedding* when
+        the caller has already embedded *query*; ``lexical`` mode needs none.
+        """
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {mode!r}")
+        if query_embedding is None and mode != "lexical":
+            query_embedding = await self.embed_query(query)
+
+        index = await self.get_index(user_id, kb_id)
+        if mode == "lexical":
+            hits = index.search_lexical(query, top_k)
+        elif mode == "hybrid":
+            hits = index.search_hybrid(query, query_embedding, top_k)
+        else:
+            hits = index.search(query_embedding, top_k)
+        return [index.texts[row] for row, _score in hits]
+
+
+@registry.provider("kb_service")
+def get_kb_service() -> KnowledgeBaseService:
+    return KnowledgeBaseService(get_upstream())
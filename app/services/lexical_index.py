@@ -0,0 +1,210 @@
+"""BM25 inverted index over the chunks of a knowledge base.
+
+Vector search knows nothing about exact terms: a question about part number
+``AB-1234`` or error ``E0x1F`` scores every chunk and may still miss the one
+that mentions it. The lexical index fixes both problems cheaply:
+
+* ``ingest_pdf`` stores each chunk's term counts next to its embedding in
+  ``kb_chunks`` (:func:`term_counts`), so loading a KB only assembles the
+  postings instead of re‑tokenising every chunk;
+* a query touches only the posting lists of its own terms, which makes it a
+  cheap candidate *prefilter* for hybrid retrieval on large KBs and a ranking
+  of its own for ``lexical`` mode.
+
+Postings are stored CSR‑style (one ``offsets`` array into flat ``rows`` and
+``weights`` arrays) with the BM25 weight of every (term, chunk) pair computed
+once at build time, so scoring a query is a handful of vectorised additions.
+All of it converts to flat arrays (:meth:`LexicalIndex.to_arrays`) for the
+memory‑mapped copy in :mod:`app.services.shared_index`.
+"""
+
+import bisect
+import re
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from app.services.string_table import StringTable
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Words, numbers and compounds such as "ab-1234", "v2.1" or "err_42". A
+# compound is indexed whole as well as by its parts.
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./:][a-z0-9]+)*")
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i if in into is it its of on or "
+    "our she so that the their them then there these they this to was we were what when where "
+    "which who will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower‑cased terms of *text* without stopwords."""
+    terms = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if token.isalnum():
+            if token not in STOPWORDS:
+                terms.append(token)
+        else:
+            terms.append(token)
+            terms.extend(word for word in WORD_RE.findall(token) if word not in STOPWORDS)
+    return terms
+
+
+def term_counts(text: str) -> List[List]:
+    """``[term, count]`` pairs of *text* as stored on ``kb_chunks`` documents.
+
+    A list rather than a mapping because terms may contain ``.`` which Mongo
+    does not allow in field names.
+    """
+    return [[term, count] for term, count in Counter(tokenize(text)).items()]
+
+
+class SortedVocabulary:
+    """Term -> posting list lookup over sorted terms, for mapped indexes.
+
+    Behaves like the read‑only part of the ``dict`` a built index uses, but
+    is two arrays instead of a heap object per term.
+    """
+
+    def __init__(self, terms: StringTable, ids: np.ndarray):
+        self.terms = terms  # sorted
+        self.ids = ids  # posting list number of terms[i]
+
+    def get(self, term: str, default: Optional[int] = None) -> Optional[int]:
+        i = bisect.bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return int(self.ids[i])
+        return default
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.terms)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.terms.nbytes + self.ids.nbytes)
+
+
+class LexicalIndex:
+    """Immutable BM25 postings for the rows of one :class:`KBIndex`."""
+
+    def __init__(self, vocabulary: Union[Dict[str, int], SortedVocabulary], offsets: np.ndarray, rows: np.ndarray, weights: np.ndarray, n_rows: int):
+        self.vocabulary = vocabulary  # term -> posting list number
+        self.offsets = offsets  # posting list i is rows/weights[offsets[i]:offsets[i + 1]]
+        self.rows = rows
+        self.weights = weights
+        self.n_rows = n_rows
+
+    @classmethod
+    def build(cls, documents: Sequence[Iterable[Sequence]]) -> "LexicalIndex":
+        """Build from one iterable of ``(term, count)`` pairs per row."""
+        vocabulary: Dict[str, int] = {}
+        term_ids: List[int] = []
+        counts: List[int] = []
+        sizes: List[int] = []
+        setdefault = vocabulary.setdefault
+        for pairs in documents:
+            terms, tfs = zip(*pairs) if pairs else ((), ())
+            term_ids.extend([setdefault(term, len(vocabulary)) for term in terms])
+            counts.extend(tfs)
+            sizes.append(len(terms))
+
+        n = len(sizes)
+        ids = np.asarray(term_ids, dtype=np.int64)
+        tf = np.asarray(counts, dtype=np.float32)
+        rows = np.repeat(np.arange(n, dtype=np.int32), sizes)
+        lengths = np.bincount(rows, weights=tf, minlength=n).astype(np.float32)
+        avg_length = float(lengths.mean()) if n and lengths.any() else 1.0
+        df = np.bincount(ids, minlength=len(vocabulary))
+        idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        weights = idf[ids] * tf * (K1 + 1) / (tf + K1 * (1 - B + B * lengths[rows] / avg_length))
+
+        # group postings by term; a stable sort keeps each list in row order
+        order = np.argsort(ids, kind="stable")
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(df, out=offsets[1:])
+        return cls(vocabulary, offsets, rows[order], weights[order].astype(np.float32), n)
+
+    @classmethod
+    def from_texts(cls, texts: Sequence[str]) -> "LexicalIndex":
+        return cls.build([Counter(tokenize(text)).items() for text in texts])
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Flat arrays for :meth:`from_arrays`, vocabulary sorted by term."""
+        pairs = sorted((term, self.vocabulary.get(term)) for term in self.vocabulary)
+        terms = StringTable.from_strings([term for term, _ in pairs])
+        return {
+            "lexical_offsets": self.offsets,
+            "lexical_rows": self.rows,
+            "lexical_weights": self.weights,
+            "lexical_terms": terms.blob,
+            "lexical_term_offsets": terms.offsets,
+            "lexical_term_ids": np.fromiter((i for _, i in pairs), dtype=np.int64, count=len(pairs)),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], n_rows: int) -> "LexicalIndex":
+        vocabulary = SortedVocabulary(
+            StringTable(arrays["lexical_terms"], arrays["lexical_term_offsets"]),
+            arrays["lexical_term_ids"],
+        )
+        return cls(vocabulary, arrays["lexical_offsets"], arrays["lexical_rows"], arrays["lexical_weights"], n_rows)
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory footprint used for cache accounting."""
+        if isinstance(self.vocabulary, SortedVocabulary):
+            vocabulary = self.vocabulary.nbytes
+        else:
+            vocabulary = sum(len(term) + 64 for term in self.vocabulary)
+        return int(self.offsets.nbytes + self.rows.nbytes + self.weights.nbytes + vocabulary)
+
+    def score(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """``(rows, scores)`` of every row sharing a term with *query*."""
+        lists = [self.vocabulary.get(term) for term in set(tokenize(query))]
+        lists = [i for i in lists if i is not None]
+        if not lists:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        if len(lists) == 1:
+            start, end = self.offsets[lists[0]], self.offsets[lists[0] + 1]
+            return self.rows[start:end], self.weights[start:end]
+        scores = np.zeros(self.n_rows, dtype=np.float32)
+        for i in lists:
+            start, end = self.offsets[i], self.offsets[i + 1]
+            # rows are unique within a posting list, so fancy += is safe
+            scores[self.rows[start:end]] += self.weights[start:end]
+        rows = np.flatnonzero(scores).astype(np.int32)
+        return rows, scores[rows]
+
+    def search(self, query: str, top_k: int) -> List[Tuple[int, float]]:
+        """Return ``(row, score)`` pairs for the *top_k* rows by BM25 score."""
+        rows, scores = self.score(query)
+        return [(int(rows[i]), float(scores[i])) for i in top_indices(scores, top_k)]
+
+    def candidates(self, query: str, limit: int) -> Optional[np.ndarray]:
+        """Rows of the best *limit* lexical matches, or ``None`` if nothing matches."""
+        rows, scores = self.score(query)
+        if not len(rows):
+            return None
+        return rows[top_indices(scores, limit)]
+
+
+def top_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the *k* largest *scores*, best first."""
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    picked = np.argpartition(scores, -k)[-k:] if k < n else np.arange(n)
+    return picked[np.argsort(scores[picked])[::-1]]
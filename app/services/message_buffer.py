@@ -0,0 +1,403 @@
+"""Write‑behind buffer for chat messages.
+
+With ``history_write_behind`` on, :meth:`HistoryService.save_message` hands
+its writes to a :class:`MessageBuffer` instead of awaiting an ``insert_one``
+and a ``sessions`` upsert per message. Messages from every request are
+written together – one ``insert_many`` plus one ``bulk_write`` with a single
+coalesced summary update per session – as soon as
+``history_write_batch_size`` messages are waiting or the oldest has waited
+``history_write_interval_ms``.
+
+Reads stay consistent within the process: the history service calls
+:meth:`sync` before reading for a user with unwritten messages, edits of a
+message that is still buffered are applied in memory (:meth:`amend`) and a
+deleted session's messages are dropped (:meth:`discard`). Other workers see
+a message once it has been flushed; only then is the session's revision in
+``session_meta`` advanced, which makes their session caches reload. The app
+lifespan calls :meth:`close`, so a graceful shutdown loses nothing; a crash
+loses at most the unwritten messages.
+
+Failed flushes are retried with growing delays. A message or session update
+that Mongo itself rejects :data:`REJECTED_ATTEMPTS` times is logged and
+dropped so it can't hold up the rest, and while
+``history_write_batch_size * 10`` messages are waiting no more are accepted
+(:class:`BufferFullError`) – the buffer never grows without bound while
+Mongo is unavailable.
+"""
+
+import asyncio
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.metrics import Histogram
+
+WRITE_BATCH = Histogram(
+    "history_write_batch_messages",
+    "Messages written per write‑behind flush",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+)
+WRITE_LAG = Histogram(
+    "history_write_lag_seconds",
+    "Time from save_message until the message is written to Mongo",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+
+# Attempts of the final flush on shutdown before giving up.
+CLOSE_ATTEMPTS = 3
+# Writes Mongo rejects this often (as opposed to failing as a whole) are
+# dropped.
+REJECTED_ATTEMPTS = 3
+# Longest wait between retries of a failing flush, in seconds.
+MAX_RETRY_DELAY = 5.0
+DUPLICATE_KEY = 11000
+
+
+class BufferFullError(RuntimeError):
+    """Raised by :meth:`MessageBuffer.add` while too many messages are unwritten."""
+
+SessionKey = Tuple[str, str]
+MessageKey = Tuple[str, str, datetime]
+
+
+class _SessionDelta:
+    """Summary update for all buffered messages of one session."""
+
+    __slots__ = ("last_message", "timestamp", "count", "title", "created_at", "rejections")
+
+    def __init__(self, doc: dict, title: str):
+        self.last_message = doc["content"]
+        self.timestamp = doc["timestamp"]
+        self.count = 1
+        self.title = title
+        self.created_at = doc["timestamp"]
+        self.rejections = 0
+
+    def add(self, doc: dict) -> None:
+        self.last_message = doc["content"]
+        self.timestamp = doc["timestamp"]
+        self.count += 1
+
+    def absorb_newer(self, newer: "_SessionDelta") -> None:
+        """Fold in a delta of messages saved after this one's."""
+        self.last_message = newer.last_message
+        self.timestamp = newer.timestamp
+        self.count += newer.count
+
+    def operation(self, key: SessionKey) -> UpdateOne:
+        user_id, session_id = key
+        return UpdateOne(
+            {"user_id": user_id, "session_id": session_id},
+            {
+                "$set": {"last_message": self.last_message, "timestamp": self.timestamp},
+                "$inc": {"message_count": self.count},
+                "$setOnInsert": {"title": self.title, "created_at": self.created_at},
+            },
+            upsert=True,
+        )
+
+
+def _failed_indexes(result, size: int) -> Dict[int, Optional[str]]:
+    """Positions of a bulk request that have to be retried, each with the
+    error Mongo rejected it with – ``None`` when the request failed as a
+    whole.
+
+    Duplicate keys mean the document made it in on an earlier attempt.
+    """
+    if isinstance(result, BulkWriteError) and result.details.get("writeErrors"):
+        return {
+            error["index"]: error.get("errmsg", "")
+            for error in result.details["writeErrors"]
+            if error.get("code") != DUPLICATE_KEY
+        }
+    if isinstance(result, BaseException):
+        return dict.fromkeys(range(size))
+    return {}
+
+
+class MessageBuffer:
+    def __init__(
+        self,
+        messages,
+        sessions,
+        batch_size: int,
+        interval: float,
+        revisions=None,
+        on_written: Optional[Callable[[Dict[SessionKey, int]], None]] = None,
+    ):
+        self.messages = messages
+        self.sessions = sessions
+        # session_meta: each written message advances its session's ``rev``,
+        # after which *on_written* is told by how much per session
+        self.revisions = revisions
+        self.on_written = on_written
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = batch_size * 10
+        # Waiting messages with the time they were saved, oldest first.
+        self._pending: List[Tuple[dict, float]] = []
+        # Times Mongo rejected a message, by _id.
+        self._rejections: Counter = Counter()
+        self._by_key: Dict[MessageKey, dict] = {}
+        self._deltas: Dict[SessionKey, _SessionDelta] = {}
+        # Revision increments still to be written.
+        self._revs: Counter = Counter()
+        # Messages being written by the current flush.
+        self._inflight: set = set()
+        # Unwritten messages (pending or in flight) per user.
+        self._unwritten: Counter = Counter()
+        self._lock = asyncio.Lock()
+        self._full = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        self.stats = {
+            "pending": 0,
+            "flushes": 0,
+            "messages": 0,
+            "session_updates": 0,
+            "failures": 0,
+            "dropped": 0,
+            "refused": 0,
+        }
+
+    @staticmethod
+    def _key(doc: dict) -> MessageKey:
+        return doc["user_id"], doc["session_id"], doc["timestamp"]
+
+    async def add(self, doc: dict, title: str) -> None:
+        """Queue *doc* for insertion; *title* names the session if it's new.
+
+        Raises :class:`BufferFullError` if the buffer is still full after
+        trying to flush it.
+        """
+        if self._waiting() >= self.max_pending:
+            # back‑pressure when Mongo can't keep up
+            await self.flush()
+            if self._waiting() >= self.max_pending:
+                self.stats["refused"] += 1
+                raise BufferFullError(f"{self._waiting()} messages are waiting to be written")
+        # a client‑side _id makes retried inserts idempotent
+        doc.setdefault("_id", ObjectId())
+        self._pending.append((doc, time.monotonic()))
+        self._by_key[self._key(doc)] = doc
+        self._unwritten[doc["user_id"]] += 1
+        session = (doc["user_id"], doc["session_id"])
+        delta = self._deltas.get(session)
+        if delta is None:
+            self._deltas[session] = _SessionDelta(doc, title)
+        else:
+            delta.add(doc)
+        self.stats["pending"] = len(self._pending)
+
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+
+    async def amend(self, user_id: str, session_id: str, timestamp: datetime, content: str, truncated: bool) -> bool:
+        """Apply an edit to a message that has not been written yet.
+
+        Returns ``False`` once the message is in Mongo – the caller updates it
+        there. Waits for a flush that is writing the message right now.
+        """
+        key = (user_id, session_id, timestamp)
+        while True:
+            doc = self._by_key.get(key)
+            if doc is not None:
+                doc["content"] = content
+                if truncated:
+                    doc["truncated"] = True
+                else:
+                    doc.pop("truncated", None)
+                delta = self._deltas.get((user_id, session_id))
+                if delta is not None and delta.timestamp == timestamp:
+                    delta.last_message = content
+                return True
+            if key not in self._inflight:
+                return False
+            await self._settle()
+
+    async def sync(self, user_id: str) -> None:
+        """Write *user_id*'s buffered messages before a read."""
+        if self._unwritten.get(user_id):
+            await self.flush()
+
+    async def discard(self, user_id: str, session_id: str) -> None:
+        """Drop the buffered messages of a session that is being deleted."""
+        kept = []
+        for doc, saved_at in self._pending:
+            if doc["user_id"] == user_id and doc["session_id"] == session_id:
+                self._by_key.pop(self._key(doc), None)
+                self._rejections.pop(doc["_id"], None)
+                self._release(user_id)
+            else:
+                kept.append((doc, saved_at))
+        self._pending = kept
+        self._deltas.pop((user_id, session_id), None)
+        self.stats["pending"] = len(self._pending)
+        # a flush in progress must land before the delete runs
+        await self._settle()
+
+    async def flush(self) -> bool:
+        """Write everything buffered; ``False`` if part of it failed and was
+        put back for the next attempt.
+
+        The write runs in its own task, so a cancelled caller can't strand
+        messages half way through a flush.
+        """
+        return await asyncio.shield(asyncio.create_task(self._flush()))
+
+    async def _flush(self) -> bool:
+        async with self._lock:
+            if not self._pending and not self._deltas and not self._revs:
+                return True
+            batch, self._pending = self._pending, []
+            deltas, self._deltas = self._deltas, {}
+            docs = [doc for doc, _saved_at in batch]
+            for doc in docs:
+                key = self._key(doc)
+                self._by_key.pop(key, None)
+                self._inflight.add(key)
+            operations = [delta.operation(key) for key, delta in deltas.items()]
+
+            async def nothing():
+                return None
+
+            inserted, updated = await asyncio.gather(
+                self.messages.insert_many(docs, ordered=False) if docs else nothing(),
+                self.sessions.bulk_write(operations, ordered=False) if operations else nothing(),
+                return_exceptions=True,
+            )
+            self._inflight.clear()
+            failed_docs = _failed_indexes(inserted, len(docs))
+            failed_deltas = _failed_indexes(updated, len(operations))
+            for result in (inserted, updated):
+                if isinstance(result, BaseException):
+                    print("Message flush failed", result)
+
+            now = time.monotonic()
+            retry = []
+            for i, (doc, saved_at) in enumerate(batch):
+                if i not in failed_docs:
+                    WRITE_LAG.observe(now - saved_at)
+                    self._rejections.pop(doc["_id"], None)
+                    self._release(doc["user_id"])
+                    self._revs[(doc["user_id"], doc["session_id"])] += 1
+                    continue
+                if failed_docs[i] is not None:
+                    self._rejections[doc["_id"]] += 1
+                    if self._rejections[doc["_id"]] >= REJECTED_ATTEMPTS:
+                        print("Dropping message Mongo keeps rejecting", doc["_id"], failed_docs[i])
+                        del self._rejections[doc["_id"]]
+                        self._release(doc["user_id"])
+                        self.stats["dropped"] += 1
+                        continue
+                retry.append((doc, saved_at))
+                self._by_key[self._key(doc)] = doc
+            self._pending = retry + self._pending
+            for i, (key, delta) in enumerate(deltas.items()):
+                if i not in failed_deltas:
+                    continue
+                if failed_deltas[i] is not None:
+                    delta.rejections += 1
+                    if delta.rejections >= REJECTED_ATTEMPTS:
+                        print("Dropping session update Mongo keeps rejecting", key, failed_deltas[i])
+                        self.stats["dropped"] += 1
+                        continue
+                newer = self._deltas.get(key)
+                if newer is not None:
+                    delta.absorb_newer(newer)
+                self._deltas[key] = delta
+
+            revs_failed = await self._write_revisions()
+
+            written = len(docs) - len(failed_docs)
+            if written:
+                WRITE_BATCH.observe(written)
+            self.stats["flushes"] += 1
+            self.stats["messages"] += written
+            self.stats["session_updates"] += len(operations) - len(failed_deltas)
+            self.stats["pending"] = len(self._pending)
+            if failed_docs or failed_deltas or revs_failed:
+                self.stats["failures"] += 1
+                return False
+            return True
+
+    async def _write_revisions(self) -> bool:
+        """Advance the revisions of sessions with newly written messages;
+        ``True`` if that failed and has to be retried."""
+        revs, self._revs = self._revs, Counter()
+        if self.revisions is None or not revs:
+            return False
+        keys = list(revs)
+        try:
+            await self.revisions.bulk_write(
+                [
+                    UpdateOne({"user_id": key[0], "session_id": key[1]}, {"$inc": {"rev": revs[key]}}, upsert=True)
+                    for key in keys
+                ],
+                ordered=False,
+            )
+            failed = set()
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            print("Session revision update failed", e)
+        except Exception as e:
+            # unknown how much was applied, so all of it is retried – a
+            # revision advanced twice only costs a cache one extra reload
+            failed = set(range(len(keys)))
+            print("Session revision update failed", e)
+        for i in failed:
+            self._revs[keys[i]] += revs.pop(keys[i])
+        if revs and self.on_written is not None:
+            self.on_written(dict(revs))
+        return bool(failed)
+
+    async def close(self) -> None:
+        """Stop the background flusher and write what is left."""
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+        for _attempt in range(CLOSE_ATTEMPTS):
+            if await self.flush():
+                return
+        print("Message buffer closed with unwritten messages", len(self._pending))
+
+    async def _run(self) -> None:
+        failures = 0
+        while self._pending or self._deltas or self._revs:
+            oldest = self._pending[0][1] if self._pending else time.monotonic()
+            delay = oldest + self.interval - time.monotonic()
+            if delay > 0 and len(self._pending) < self.batch_size:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            if await self.flush():
+                failures = 0
+            else:
+                failures += 1
+                await asyncio.sleep(min(self.interval * 2 ** failures, MAX_RETRY_DELAY))
+
+    async def _settle(self) -> None:
+        """Wait for the flush in progress, if any."""
+        async with self._lock:
+            pass
+
+    def _waiting(self) -> int:
+        """Unwritten messages, including those of a flush in progress."""
+        return len(self._pending) + len(self._inflight)
+
+    def _release(self, user_id: str) -> None:
+        self._unwritten[user_id] -= 1
+        if self._unwritten[user_id] <= 0:
+            del self._unwritten[user_id]
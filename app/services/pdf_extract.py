@@ -0,0 +1,99 @@
+"""PDF text extraction on a process pool.
+
+PyPDF2 is pure Python, so extracting a large document on the event loop – or
+even on a thread – holds the GIL and stalls every other request on the
+worker. Here page ranges are farmed out to a pool of processes and the page
+texts are yielded back in document order. A bounded number of ranges is in
+flight at any time so memory stays proportional to the worker count rather
+than the document size.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, List, Optional
+
+from app.config import settings
+from app.registry import registry
+
+
+class PDFTooLargeError(ValueError):
+    """Raised when a document exceeds the configured page or text limits."""
+
+
+def worker_count() -> int:
+    return settings.pdf_extract_workers or os.cpu_count() or 1
+
+
+@registry.provider("pdf_executor", close=lambda executor: executor.shutdown(cancel_futures=True))
+def get_executor() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=worker_count())
+
+
+def shutdown() -> None:
+    """Stop the worker processes now instead of at app shutdown."""
+    executor = registry.discard("pdf_executor")
+    if executor is not None:
+        executor.shutdown(cancel_futures=True)
+
+
+def open_pdf(path: str):
+    # PyPDF2 is only needed inside the pool workers, so it is imported there
+    # rather than when the API starts. If it is missing, raise a clear error
+    # so that maintainers know which extra lib to add to requirements.txt.
+    try:
+        import PyPDF2
+    except ImportError as exc:  # pragma: no cover
+        raise ImportError("PyPDF2 must be installed to use the knowledge‑base features") from exc
+    return PyPDF2.PdfReader(path)
+
+
+def count_pages(path: str) -> int:
+    return len(open_pdf(path).pages)
+
+
+def extract_range(path: str, start: int, end: int) -> List[str]:
+    """Extract the text of pages ``[start, end)`` – runs inside a pool worker."""
+    reader = open_pdf(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+async def iter_pages(
+    path: str,
+    max_pages: Optional[int] = None,
+    max_text_bytes: Optional[int] = None,
+) -> AsyncIterator[str]:
+    """Yield the text of each page of the PDF at *path*, in order.
+
+    Raises :class:`PDFTooLargeError` if the document has more than *max_pages*
+    pages or its extracted text grows past *max_text_bytes*.
+    """
+    max_pages = max_pages if max_pages is not None else settings.pdf_max_pages
+    max_text_bytes = max_text_bytes if max_text_bytes is not None else settings.pdf_max_text_mb * 1024 * 1024
+
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    total = await loop.run_in_executor(executor, count_pages, path)
+    if max_pages and total > max_pages:
+        raise PDFTooLargeError(f"PDF has {total} pages, the limit is {max_pages}")
+
+    step = max(1, settings.pdf_pages_per_task)
+    ranges = [(start, min(start + step, total)) for start in range(0, total, step)]
+    lookahead = 2 * worker_count()
+    pending: List[asyncio.Future] = []
+    text_bytes = 0
+    try:
+        next_range = 0
+        while next_range < len(ranges) or pending:
+            while next_range < len(ranges) and len(pending) < lookahead:
+                start, end = ranges[next_range]
+                pending.append(loop.run_in_executor(executor, extract_range, path, start, end))
+                next_range += 1
+            for text in await pending.pop(0):
+                text_bytes += len(text.encode("utf-8"))
+                if max_text_bytes and text_bytes > max_text_bytes:
+                    raise PDFTooLargeError(f"PDF text exceeds {max_text_bytes} bytes")
+                yield text
+    finally:
+        for future in pending:
+            future.cancel()
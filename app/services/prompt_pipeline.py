@@ -0,0 +1,333 @@
+"""Prompt assembly shared by ``/chat`` and ``/chat/stream``.
+
+Loading the session (history, summary and custom system prompt) and
+retrieving knowledge‑base context are independent, so they run concurrently;
+the turn waits for the slower of the two instead of their sum. Every stage is
+timed and the timings travel with the prepared prompt so the endpoints can
+report them (``Server-Timing``).
+
+When enabled, :mod:`app.services.response_cache` is consulted before the
+completion and fed with every finished reply.
+"""
+
+import asyncio
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Dict, List, Optional, Set, Tuple, TypeVar
+
+from app.config import settings
+from app.metrics import Histogram
+from app.models.history import MessageHistory
+from app.registry import registry
+from app.services.context_service import ContextBuilder, get_context_builder
+from app.services.history_service import HistoryService, get_history_service
+from app.services.kb_service import KnowledgeBaseService, get_kb_service
+from app.services.response_cache import response_cache
+
+T = TypeVar("T")
+
+CHAT_STAGES = Histogram("chat_stage_seconds", "Duration of each stage of a chat turn", ("stage",))
+
+# Final reply writes that must outlive a cancelled request.
+_background: Set[asyncio.Task] = set()
+
+KB_CONTEXT_PREAMBLE = (
+    "You are an assistant with access to the following context extracted "
+    "from the user's documents. Use it to answer the user.\n\n"
+)
+
+# Sent in place of a user message when continuing an interrupted reply.
+RESUME_INSTRUCTION = (
+    "Your previous reply was cut off. Continue it exactly where it stopped, "
+    "without repeating anything or adding a preamble."
+)
+
+
+async def timed(timings: Dict[str, float], stage: str, aw: Awaitable[T]) -> T:
+    """Await *aw* and record how long it took, in ms, under *stage*."""
+    start = time.perf_counter()
+    try:
+        return await aw
+    finally:
+        timings[stage] = (time.perf_counter() - start) * 1000
+
+
+class PreparedPrompt:
+    """Messages for one chat turn plus what is needed to finish it."""
+
+    def __init__(
+        self,
+        user_id: str,
+        session_id: str,
+        is_new_session: bool,
+        message: str,
+        messages: List[dict],
+        summary: Optional[dict],
+        overflow: List[MessageHistory],
+        timings: Dict[str, float],
+        resume_from: Optional[MessageHistory] = None,
+        use_cache: bool = False,
+        cache_scope: Optional[list] = None,
+        query_embedding=None,
+        backlog_until: Optional[datetime] = None,
+    ):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.is_new_session = is_new_session
+        self.message = message
+        self.messages = messages
+        self.summary = summary
+        self.overflow = overflow
+        # unfolded messages older than the session state held, up to here
+        self.backlog_until = backlog_until
+        self.timings = timings
+        # the truncated reply being continued, for resumed turns
+        self.resume_from = resume_from
+        # response cache: whether to use it, the context a semantic match
+        # must share and the question's embedding (KB turns only)
+        self.use_cache = use_cache
+        self.cache_scope = cache_scope
+        self.query_embedding = query_embedding
+        # "exact" or "semantic" when the reply came from the cache
+        self.cache_hit: Optional[str] = None
+
+    def server_timing(self) -> str:
+        """Stage timings formatted for a ``Server-Timing`` header."""
+        return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in self.timings.items())
+
+    def observe(self) -> None:
+        """Record the stage timings in :data:`CHAT_STAGES` once the turn is over."""
+        for stage, ms in self.timings.items():
+            CHAT_STAGES.labels(stage=stage).observe(ms / 1000)
+
+
+class PromptPipeline:
+    def __init__(
+        self,
+        history: HistoryService,
+        kbs: KnowledgeBaseService,
+        context_builder: ContextBuilder,
+        top_k: int = 3,
+    ):
+        self.history = history
+        self.kbs = kbs
+        self.context_builder = context_builder
+        self.top_k = top_k
+
+    async def _kb_context(self, user_id: str, kb_id: str, message: str) -> Tuple[Optional[str], Any]:
+        """KB context for *message* and the query embedding used to find it."""
+        try:
+            embedding = await self.kbs.embed_query(message)
+            context_chunks = await self.kbs.retrieve(
+                user_id,
+                kb_id,
+                message,
+                top_k=self.top_k,
+                query_embedding=embedding,
+                mode=settings.kb_retrieval_mode,
+            )
+        except Exception as e:
+            # just ignore retrieval errors – fallback to no context
+            print("KB retrieval failed", e)
+            return None, None
+        return KB_CONTEXT_PREAMBLE + "\n".join(context_chunks), embedding
+
+    async def prepare(
+        self,
+        user_id: str,
+        session_id: Optional[str],
+        message: str,
+        kb_id: Optional[str] = None,
+        resume: bool = False,
+    ) -> PreparedPrompt:
+        """Build the prompt for one turn.
+
+        With *resume*, the turn continues the session's last reply if it was
+        interrupted; ``ValueError`` is raised when there is nothing to resume.
+        """
+        timings: Dict[str, float] = {}
+        start = time.perf_counter()
+        is_new_session = session_id is None
+        if is_new_session:
+            session_id = str(uuid.uuid4())
+
+        stages = []
+        if is_new_session:
+            state = self.history.start_session(user_id, session_id)
+        else:
+            stages.append(timed(timings, "session", self.history.get_session_state(user_id, session_id)))
+        if kb_id:
+            stages.append(timed(timings, "kb", self._kb_context(user_id, kb_id, message)))
+        results = await asyncio.gather(*stages)
+        if not is_new_session:
+            state = results.pop(0)
+        kb_prompt, query_embedding = results[0] if results else (None, None)
+
+        history = list(state.messages)
+        resume_from = None
+        if resume:
+            if not history or history[-1].role != "assistant" or not history[-1].truncated:
+                raise ValueError("No interrupted reply to resume")
+            resume_from = history[-1]
+            # the partial reply stays in the window; the model is asked to go on
+            message = RESUME_INSTRUCTION
+
+        system_prompts = [kb_prompt] if kb_prompt else []
+        if state.system_prompt:
+            system_prompts.append(state.system_prompt)
+
+        assemble_start = time.perf_counter()
+        messages, overflow = self.context_builder.assemble(system_prompts, state.summary, history, message)
+        timings["assemble"] = (time.perf_counter() - assemble_start) * 1000
+        timings["prepare"] = (time.perf_counter() - start) * 1000
+
+        use_cache = settings.response_cache_enabled and state.response_cache and resume_from is None
+        cache_scope = None
+        if use_cache and query_embedding is not None:
+            # everything except the retrieved context and the question itself
+            cache_scope = [kb_id] + messages[1:-1]
+        return PreparedPrompt(
+            user_id,
+            session_id,
+            is_new_session,
+            message,
+            messages,
+            state.summary,
+            overflow,
+            timings,
+            resume_from,
+            use_cache=use_cache,
+            cache_scope=cache_scope,
+            query_embedding=query_embedding,
+            backlog_until=state.backlog_until,
+        )
+
+    def cached_reply(self, prepared: PreparedPrompt) -> Optional[str]:
+        """Reply from the response cache, if the turn may use it and one matches."""
+        if not prepared.use_cache:
+            return None
+        start = time.perf_counter()
+        reply, prepared.cache_hit = response_cache.lookup(
+            settings.chat_model, prepared.messages, prepared.cache_scope, prepared.query_embedding
+        )
+        prepared.timings["cache"] = (time.perf_counter() - start) * 1000
+        return reply
+
+    @staticmethod
+    def remember(prepared: PreparedPrompt, reply: str) -> None:
+        """Offer a finished reply to the response cache."""
+        if prepared.use_cache and prepared.cache_hit is None and reply:
+            response_cache.store(
+                settings.chat_model, prepared.messages, reply, prepared.cache_scope, prepared.query_embedding
+            )
+
+    async def save_user_message(self, prepared: PreparedPrompt) -> None:
+        await timed(
+            prepared.timings,
+            "save_user",
+            self.history.save_message(prepared.user_id, prepared.session_id, "user", prepared.message),
+        )
+
+    def recorder(self, prepared: PreparedPrompt) -> "ReplyRecorder":
+        """Checkpointing writer for a streamed reply."""
+        return ReplyRecorder(self, prepared)
+
+    async def finish(self, prepared: PreparedPrompt, reply: str) -> None:
+        """Store the assistant reply and fold old turns into the summary."""
+        resumed = prepared.resume_from
+        if resumed is not None:
+            # the continuation completes the interrupted message in place
+            save = self.history.update_message(
+                prepared.user_id, prepared.session_id, resumed.timestamp, resumed.content + reply
+            )
+        else:
+            save = self.history.save_message(prepared.user_id, prepared.session_id, "assistant", reply)
+        await timed(prepared.timings, "save_reply", save)
+        self.remember(prepared, reply)
+        prepared.observe()
+        self.context_builder.schedule_fold(
+            prepared.user_id, prepared.session_id, prepared.summary, prepared.overflow, prepared.backlog_until
+        )
+
+
+class ReplyRecorder:
+    """Persists a streamed reply while it is produced.
+
+    The reply is written as a ``truncated`` assistant message every
+    ``stream_checkpoint_tokens`` deltas or ``stream_checkpoint_seconds``,
+    whichever comes first, so an interrupted stream leaves its partial
+    answer in history where a later ``resume`` turn can continue it.
+    Checkpoints run in the background and never delay the stream.
+    """
+
+    def __init__(self, pipeline: PromptPipeline, prepared: PreparedPrompt):
+        self.pipeline = pipeline
+        self.history = pipeline.history
+        self.prepared = prepared
+        resumed = prepared.resume_from
+        self.parts: List[str] = [resumed.content] if resumed else []
+        self.timestamp: Optional[datetime] = resumed.timestamp if resumed else None
+        self._pending = 0
+        self._last_write = time.monotonic()
+        self._writer: Optional[asyncio.Task] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def add(self, delta: str) -> None:
+        self.parts.append(delta)
+        self._pending += 1
+        due = (
+            self._pending >= settings.stream_checkpoint_tokens
+            or time.monotonic() - self._last_write >= settings.stream_checkpoint_seconds
+        )
+        if due and (self._writer is None or self._writer.done()):
+            self._pending = 0
+            self._last_write = time.monotonic()
+            self._writer = asyncio.create_task(self._write(self.text, truncated=True))
+
+    async def _write(self, content: str, truncated: bool) -> None:
+        p = self.prepared
+        if self.timestamp is None:
+            self.timestamp = await self.history.save_message(
+                p.user_id, p.session_id, "assistant", content, truncated=truncated
+            )
+        else:
+            await self.history.update_message(p.user_id, p.session_id, self.timestamp, content, truncated)
+
+    async def close(self, truncated: bool = False) -> None:
+        """Write the final state of the reply.
+
+        Safe to call while the surrounding task is being cancelled (client
+        disconnect): the write runs in its own task and is shielded.
+        """
+        task = asyncio.create_task(self._close(truncated))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+        await asyncio.shield(task)
+
+    async def _close(self, truncated: bool) -> None:
+        if self._writer is not None:
+            try:
+                await self._writer
+            except Exception as e:
+                print("Reply checkpoint failed", e)
+        if truncated and not self.parts:
+            return
+        start = time.perf_counter()
+        await self._write(self.text, truncated)
+        self.prepared.timings["save_reply"] = (time.perf_counter() - start) * 1000
+        self.prepared.observe()
+        if not truncated:
+            p = self.prepared
+            self.pipeline.remember(p, self.text)
+            self.pipeline.context_builder.schedule_fold(
+                p.user_id, p.session_id, p.summary, p.overflow, p.backlog_until
+            )
+
+
+@registry.provider("prompt_pipeline")
+def get_prompt_pipeline() -> PromptPipeline:
+    return PromptPipeline(get_history_service(), get_kb_service(), get_context_builder())
@@ -0,0 +1,110 @@
+"""Micro‑batched embedding of retrieval queries.
+
+Every KB turn needs the embedding of the user's question. Instead of one
+``embeddings.create`` round trip per question, :class:`QueryEmbedder`
+queues questions for up to ``kb_query_batch_ms`` (or until
+``kb_query_batch_size`` are waiting) and embeds them in a single call,
+handing each waiting coroutine its own vector. Identical questions already
+queued or in flight share one input, and recently embedded questions are
+answered from an LRU cache without calling upstream at all.
+"""
+
+import asyncio
+import weakref
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+from app.config import settings
+from app.metrics import register_stats
+from app.services.cache import TTLCache
+from app.services.upstream import INTERACTIVE, Upstream
+
+_embedders: "weakref.WeakSet[QueryEmbedder]" = weakref.WeakSet()
+
+
+def _stats() -> dict:
+    totals: dict = {}
+    for embedder in list(_embedders):
+        for key, value in embedder.stats.items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+register_stats("query_embedder", "Query embedding batcher, summed over instances", _stats)
+
+
+class QueryEmbedder:
+    def __init__(
+        self,
+        upstream: Upstream,
+        model: str,
+        max_batch: Optional[int] = None,
+        max_delay: Optional[float] = None,
+        cache: Optional[TTLCache] = None,
+    ):
+        self.upstream = upstream
+        self.model = model
+        self.max_batch = max_batch or settings.kb_query_batch_size
+        self.max_delay = max_delay if max_delay is not None else settings.kb_query_batch_ms / 1000
+        self.cache = cache or TTLCache(settings.kb_query_cache_size, settings.kb_query_cache_ttl_seconds)
+        # unresolved embeddings by text; the queue holds those not yet sent
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._queue: List[str] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._batches: Set[asyncio.Task] = set()
+        self.stats = {"requests": 0, "cache_hits": 0, "coalesced": 0, "batches": 0, "batched_inputs": 0}
+        _embedders.add(self)
+
+    async def embed(self, text: str) -> np.ndarray:
+        """Embedding of *text*. The returned array is shared – don't modify it."""
+        self.stats["requests"] += 1
+        vector = self.cache.get(text)
+        if vector is not None:
+            self.stats["cache_hits"] += 1
+            return vector
+
+        future = self._inflight.get(text)
+        if future is not None:
+            self.stats["coalesced"] += 1
+        else:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._inflight[text] = future
+            self._queue.append(text)
+            if len(self._queue) >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.max_delay, self._flush)
+        # one waiter giving up must not cancel the others
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._queue = self._queue, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._send(batch))
+        self._batches.add(task)
+        task.add_done_callback(self._batches.discard)
+
+    async def _send(self, texts: List[str]) -> None:
+        self.stats["batches"] += 1
+        self.stats["batched_inputs"] += len(texts)
+        try:
+            vectors = await self.upstream.embed(self.model, texts, INTERACTIVE)
+        except asyncio.CancelledError:
+            for text in texts:
+                self._inflight.pop(text).cancel()
+            raise
+        except Exception as exc:
+            for text in texts:
+                future = self._inflight.pop(text)
+                future.set_exception(exc)
+                future.exception()  # waiters may all be gone – don't warn
+            return
+        for text, vector in zip(texts, vectors):
+            self.cache.set(text, vector)
+            self._inflight.pop(text).set_result(vector)
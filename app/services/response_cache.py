@@ -0,0 +1,134 @@
+"""Cache of chat replies for repeated prompts.
+
+Many users ask the same questions against the same knowledge base and system
+prompt. The cache answers those without another completion, in two tiers:
+
+* **exact** – keyed by a hash of the complete prompt (system prompts, KB
+  context, history window and message), so only identical prompts match;
+* **semantic** – for turns with KB retrieval, the query embedding computed
+  for retrieval is compared with earlier questions asked in the same
+  *scope* (model, KB, custom prompt, summary and history window – everything
+  but the KB context and the question). The reply of the closest one is
+  reused if its cosine similarity reaches ``response_cache_similarity``.
+
+Entries live in process memory, bounded by ``response_cache_size`` and
+``response_cache_ttl_seconds``.
+"""
+
+import hashlib
+import json
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.metrics import register_stats
+from app.services.cache import TTLCache
+
+# Questions remembered per scope for the semantic tier.
+SCOPE_ENTRIES = 256
+
+
+def digest(value) -> str:
+    payload = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Scope:
+    """Normalised question embeddings and the exact keys of their replies."""
+
+    __slots__ = ("vectors", "keys")
+
+    def __init__(self, dim: int):
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.keys: List[str] = []
+
+    def add(self, vector: np.ndarray, key: str) -> None:
+        self.vectors = np.vstack([self.vectors[-(SCOPE_ENTRIES - 1):], vector[None, :]])
+        self.keys = self.keys[-(SCOPE_ENTRIES - 1):] + [key]
+
+    def nearest(self, vector: np.ndarray) -> Tuple[Optional[str], float]:
+        if not self.keys:
+            return None, 0.0
+        scores = self.vectors @ vector
+        best = int(np.argmax(scores))
+        return self.keys[best], float(scores[best])
+
+
+def _normalize(vector) -> Optional[np.ndarray]:
+    v = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else None
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int, ttl: float, threshold: float):
+        self.threshold = threshold
+        self.replies = TTLCache(maxsize, ttl)  # exact key -> reply
+        self.scopes = TTLCache(maxsize, ttl)  # scope key -> _Scope
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0}
+
+    @staticmethod
+    def key(model: str, messages: List[dict]) -> str:
+        return digest([model, messages])
+
+    def lookup(
+        self,
+        model: str,
+        messages: List[dict],
+        scope: Optional[list] = None,
+        embedding=None,
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """Return ``(reply, tier)`` for a prompt, or ``(None, None)`` on a miss."""
+        reply = self.replies.get(self.key(model, messages))
+        if reply is not None:
+            self.stats["exact_hits"] += 1
+            return reply, "exact"
+
+        vector = _normalize(embedding) if embedding is not None and scope is not None else None
+        if vector is not None:
+            entries = self.scopes.get(digest([model, scope]))
+            if entries is not None and entries.vectors.shape[1] == len(vector):
+                key, score = entries.nearest(vector)
+                if key is not None and score >= self.threshold:
+                    reply = self.replies.get(key)
+                    if reply is not None:
+                        self.stats["semantic_hits"] += 1
+                        return reply, "semantic"
+
+        self.stats["misses"] += 1
+        return None, None
+
+    def store(
+        self,
+        model: str,
+        messages: List[dict],
+        reply: str,
+        scope: Optional[list] = None,
+        embedding=None,
+    ) -> None:
+        key = self.key(model, messages)
+        self.replies.set(key, reply)
+        self.stats["stores"] += 1
+
+        vector = _normalize(embedding) if embedding is not None and scope is not None else None
+        if vector is None:
+            return
+        scope_key = digest([model, scope])
+        entries = self.scopes.peek(scope_key)
+        if entries is None or entries.vectors.shape[1] != len(vector):
+            entries = _Scope(len(vector))
+        entries.add(vector, key)
+        self.scopes.set(scope_key, entries)
+
+    def clear(self) -> None:
+        self.replies.clear()
+        self.scopes.clear()
+
+
+response_cache = ResponseCache(
+    settings.response_cache_size,
+    settings.response_cache_ttl_seconds,
+    settings.response_cache_similarity,
+)
+register_stats("response_cache", "Chat response cache", lambda: response_cache.stats)
@@ -0,0 +1,218 @@
+"""KB indexes published once per host and memory‑mapped by every worker.
+
+Each uvicorn worker used to load a KB from Mongo into its own heap: N workers
+held N copies of the same matrices and warmed them N times. Instead, the
+first worker to need a KB writes its :class:`KBIndex` arrays to one file
+under ``settings.kb_index_dir`` and every worker – that one included – maps
+the file read‑only. The pages live once in the host's page cache however
+many workers use them.
+
+Layout per KB and owner::
+
+    {kb_index_dir}/{kb_id}/shared/{user_id}/
+        manifest.json        current version and where each array starts
+        index-<version>.bin  the arrays, back to back, 64‑byte aligned
+        .lock                held while a worker loads and publishes
+
+Re‑ingesting a KB :func:`retire`\\ s it. The next load publishes a new
+version and swaps the manifest atomically; workers notice the changed
+:func:`version` on their next query and remap. Replaced files are unlinked
+straight away – mappings that still use them stay valid until dropped.
+"""
+
+import asyncio
+import json
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows – publishing then just isn't serialised
+    fcntl = None
+
+from app.config import settings
+from app.metrics import register_stats
+from app.services.vector_index import KBIndex
+
+MANIFEST = "manifest.json"
+ALIGNMENT = 64
+# How long a worker waits for another one to publish before loading the KB
+# itself.
+LOCK_TIMEOUT = 30.0
+LOCK_POLL = 0.02
+
+# IDs end up in paths; anything else is served from the worker's own heap.
+SAFE_ID = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+stats = {"mapped": 0, "published": 0, "retired": 0, "failures": 0}
+register_stats("kb_shared_index", "Per‑host memory‑mapped KB indexes", lambda: dict(stats))
+
+# manifest path -> ((inode, mtime), manifest) so an unchanged manifest is
+# only stat'ed
+_manifests: Dict[str, Tuple[Tuple[int, int], dict]] = {}
+
+
+def _root(user_id: str, kb_id: str) -> Optional[str]:
+    if not (SAFE_ID.match(user_id) and SAFE_ID.match(kb_id)):
+        return None
+    return os.path.join(settings.kb_index_dir, kb_id, "shared", user_id)
+
+
+def manifest(user_id: str, kb_id: str) -> Optional[dict]:
+    """The current manifest of the KB's shared index, or ``None``."""
+    root = _root(user_id, kb_id)
+    if root is None:
+        return None
+    path = os.path.join(root, MANIFEST)
+    try:
+        st = os.stat(path)
+    except OSError:
+        _manifests.pop(path, None)
+        return None
+    token = (st.st_ino, st.st_mtime_ns)
+    cached = _manifests.get(path)
+    if cached is not None and cached[0] == token:
+        return cached[1]
+    try:
+        with open(path) as fh:
+            data = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    _manifests[path] = (token, data)
+    return data
+
+
+def version(user_id: str, kb_id: str) -> Optional[str]:
+    """Version currently published for the KB; ``None`` if there is none."""
+    data = manifest(user_id, kb_id)
+    return data.get("version") if data else None
+
+
+def open_index(user_id: str, kb_id: str) -> Optional[KBIndex]:
+    """Map the published index read‑only; ``None`` if there is none (or it
+    doesn't open, in which case the caller loads and publishes afresh)."""
+    data = manifest(user_id, kb_id)
+    if data is None:
+        return None
+    try:
+        path = os.path.join(_root(user_id, kb_id), data["file"])
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        arrays = {}
+        for name, (dtype, shape, offset) in data["arrays"].items():
+            dtype = np.dtype(dtype)
+            count = int(np.prod(shape, dtype=np.int64))
+            arrays[name] = buffer[offset:offset + count * dtype.itemsize].view(dtype).reshape(shape)
+        index = KBIndex.from_arrays(arrays)
+        if index.matrix.shape != (data["rows"], data["dim"]):
+            raise ValueError(f"shape {index.matrix.shape} does not match the manifest")
+    except FileNotFoundError:
+        # swapped out between reading the manifest and opening the file
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        stats["failures"] += 1
+        print("Opening shared KB index failed", kb_id, e)
+        return None
+    index.version = data["version"]
+    stats["mapped"] += 1
+    return index
+
+
+def publish(user_id: str, kb_id: str, index: KBIndex) -> KBIndex:
+    """Write *index* as the KB's new version and return it mapped.
+
+    Returns *index* itself if the IDs can't be used in a path.
+    """
+    root = _root(user_id, kb_id)
+    if root is None:
+        return index
+    os.makedirs(root, exist_ok=True)
+    new_version = f"{time.time_ns():x}"
+    name = f"index-{new_version}.bin"
+    tmp = os.path.join(root, name + ".tmp")
+
+    layout = {}
+    with open(tmp, "wb") as fh:
+        for key, array in index.to_arrays().items():
+            array = np.ascontiguousarray(array)
+            fh.write(b"\0" * (-fh.tell() % ALIGNMENT))
+            layout[key] = (array.dtype.str, list(array.shape), fh.tell())
+            fh.write(memoryview(array.reshape(-1)).cast("B"))
+    os.replace(tmp, os.path.join(root, name))
+
+    rows, dim = index.matrix.shape
+    data = {
+        "version": new_version,
+        "file": name,
+        "rows": int(rows),
+        "dim": int(dim),
+        "bytes": os.path.getsize(os.path.join(root, name)),
+        "published_at": time.time(),
+        "arrays": layout,
+    }
+    _write_manifest(root, data)
+    _remove_unused(root, keep=name)
+    stats["published"] += 1
+    return open_index(user_id, kb_id) or index
+
+
+def retire(user_id: str, kb_id: str) -> None:
+    """Unpublish the KB's index, e.g. because it is being re‑ingested."""
+    root = _root(user_id, kb_id)
+    if root is None:
+        return
+    try:
+        os.remove(os.path.join(root, MANIFEST))
+    except FileNotFoundError:
+        return
+    _remove_unused(root, keep=None)
+    stats["retired"] += 1
+
+
+@asynccontextmanager
+async def publishing(user_id: str, kb_id: str):
+    """Hold the KB's publish lock so one worker per host loads it from Mongo.
+
+    Gives up waiting after :data:`LOCK_TIMEOUT` – loading twice beats
+    stalling queries behind a stuck worker.
+    """
+    root = _root(user_id, kb_id)
+    if root is None or fcntl is None:
+        yield
+        return
+    os.makedirs(root, exist_ok=True)
+    fd = os.open(os.path.join(root, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    break
+                await asyncio.sleep(LOCK_POLL)
+        yield
+    finally:
+        # closing the descriptor releases the lock
+        os.close(fd)
+
+
+def _write_manifest(root: str, data: dict) -> None:
+    tmp = os.path.join(root, f"{MANIFEST}.{os.getpid()}.tmp")
+    with open(tmp, "w") as fh:
+        json.dump(data, fh)
+    os.replace(tmp, os.path.join(root, MANIFEST))
+
+
+def _remove_unused(root: str, keep: Optional[str]) -> None:
+    for entry in os.listdir(root):
+        if entry.startswith("index-") and entry != keep:
+            try:
+                os.remove(os.path.join(root, entry))
+            except OSError:
+                pass
@@ -0,0 +1,120 @@
+"""Output framing for streamed chat replies.
+
+Upstream models emit one delta per token – often a single character or two.
+Writing each one as its own frame costs a ``json.dumps``, a chunk write and a
+trip through the ASGI server per token. :func:`coalesce` merges deltas into
+frames bounded by size and time (``stream_coalesce_bytes`` /
+``stream_coalesce_ms``), and :class:`FrameEncoder` renders frames either as
+JSON lines (the original format) or as ``text/event-stream`` SSE events.
+"""
+
+import asyncio
+import json
+from typing import AsyncIterator, Iterator, Optional
+
+from app.config import settings
+
+JSONL = "application/json"
+SSE = "text/event-stream"
+
+
+class FrameEncoder:
+    """Serialises stream events in the negotiated wire format."""
+
+    def __init__(self, media_type: str = JSONL):
+        self.media_type = media_type
+
+    @classmethod
+    def for_accept(cls, accept: Optional[str]) -> "FrameEncoder":
+        """Pick SSE when the client asks for ``text/event-stream``."""
+        return cls(SSE if accept and SSE in accept else JSONL)
+
+    def encode(self, event: dict) -> bytes:
+        payload = json.dumps(event, ensure_ascii=False)
+        if self.media_type == SSE:
+            return f"data: {payload}\n\n".encode("utf-8")
+        return (payload + "\n").encode("utf-8")
+
+
+_END = object()
+
+
+def replay(text: str, size: Optional[int] = None) -> Iterator[str]:
+    """Split an already complete reply (e.g. a cached one) into frame‑sized
+    pieces of *size* characters."""
+    size = size or settings.stream_coalesce_bytes
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+
+async def coalesce(
+    deltas: AsyncIterator[str],
+    max_bytes: Optional[int] = None,
+    max_delay: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """Merge *deltas* into larger pieces.
+
+    A piece is emitted once it reaches *max_bytes* or *max_delay* seconds
+    after its first delta arrived, whichever comes first – so a stalled
+    upstream never holds back text that is already buffered.
+    """
+    max_bytes = max_bytes if max_bytes is not None else settings.stream_coalesce_bytes
+    max_delay = max_delay if max_delay is not None else settings.stream_coalesce_ms / 1000
+
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for delta in deltas:
+                queue.put_nowait(delta)
+        except BaseException as exc:  # includes cancellation of the consumer
+            queue.put_nowait(exc)
+        else:
+            queue.put_nowait(_END)
+
+    producer = asyncio.create_task(pump())
+    loop = asyncio.get_running_loop()
+    parts = []
+    size = 0
+    deadline = None
+    try:
+        while True:
+            if not queue.empty():
+                # cheap path: deltas are already waiting, no timer needed
+                item = queue.get_nowait()
+                if parts and loop.time() >= deadline:
+                    yield "".join(parts)
+                    parts, size = [], 0
+            elif parts:
+                timeout = deadline - loop.time()
+                try:
+                    item = await asyncio.wait_for(queue.get(), max(timeout, 0))
+                except asyncio.TimeoutError:
+                    item = None
+            else:
+                item = await queue.get()
+
+            if item is None:
+                # time bound reached
+                yield "".join(parts)
+                parts, size = [], 0
+                continue
+            if item is _END or isinstance(item, BaseException):
+                if parts:
+                    yield "".join(parts)
+                    parts = []
+                if item is _END:
+                    break
+                raise item
+
+            if not parts:
+                deadline = loop.time() + max_delay
+            parts.append(item)
+            size += len(item.encode("utf-8"))
+            if size >= max_bytes:
+                yield "".join(parts)
+                parts, size = [], 0
+        if parts:
+            yield "".join(parts)
+    finally:
+        producer.cancel()
@@ -0,0 +1,48 @@
+"""Packed UTF‑8 strings that can live in a memory‑mapped file.
+
+A list of ``str`` is a separate heap object per entry in every process that
+holds it. :class:`StringTable` keeps all entries in one byte array with an
+offsets array next to it, so a KB's chunk texts and vocabulary can be mapped
+read‑only from :mod:`app.services.shared_index` and decoded only when an
+entry is actually used.
+"""
+
+from typing import Iterator, Sequence
+
+import numpy as np
+
+
+class StringTable:
+    """Read‑only sequence of strings; entry *i* is ``blob[offsets[i]:offsets[i + 1]]``."""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings: Sequence[str]) -> "StringTable":
+        if isinstance(strings, StringTable):
+            return strings
+        encoded = [s.encode() for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(blob, offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode()
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.blob.nbytes + self.offsets.nbytes)
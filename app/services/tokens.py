@@ -0,0 +1,46 @@
+"""Token counting for prompts and embedding inputs.
+
+Uses tiktoken when it is installed and its encodings can be loaded, and a
+≈4 characters per token heuristic otherwise.
+"""
+
+from functools import lru_cache
+
+from app.config import settings
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - falls back to a character heuristic
+    tiktoken = None
+
+# Per‑message framing overhead in the chat format.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception:
+        # the BPE files could not be loaded (e.g. offline) – use the heuristic
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str, model: str = None) -> int:
+    """Number of tokens *text* takes for *model* (≈4 chars/token without tiktoken)."""
+    encoding = _encoding(model or settings.chat_model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message: dict, model: str = None) -> int:
+    return count_tokens(message["content"] or "", model) + MESSAGE_OVERHEAD_TOKENS
@@ -0,0 +1,347 @@
+"""Shared OpenAI client with rate‑limit‑aware scheduling.
+
+Every service talks to the provider through one :class:`Upstream`, obtained
+with :func:`get_upstream` (or passed in explicitly). It owns
+
+* a single ``AsyncOpenAI`` client whose HTTP pool size and keep‑alive are
+  configured by the ``upstream_*`` settings,
+* a :class:`RequestScheduler` – token buckets for requests and tokens per
+  minute, in front of a priority queue so interactive chat is served before
+  background summaries and bulk ingestion embeddings, and
+* retries with jittered exponential backoff that honour ``Retry-After``.
+"""
+
+import asyncio
+import email.utils
+import heapq
+import itertools
+import random
+import time
+from typing import TYPE_CHECKING, List, Optional
+
+import numpy as np
+
+from app.config import settings
+from app.metrics import Histogram, register_stats
+from app.registry import registry
+from app.services.tokens import count_tokens, message_tokens
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# Request priorities, most urgent first.
+INTERACTIVE = 0
+BACKGROUND = 1
+BULK = 2
+
+UPSTREAM_SECONDS = Histogram(
+    "upstream_request_seconds",
+    "Upstream call latency including retries (stream: until the stream opened)",
+    ("operation", "priority"),
+)
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background", BULK: "bulk"}
+
+
+
+def retryable() -> tuple:
+    """Exceptions worth retrying. ``openai`` takes about a second to import,
+    so it is only loaded once a client is built or a call fails."""
+    import openai
+
+    return openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError
+
+
+class TokenBucket:
+    """Capacity refilled continuously at ``per_minute / 60`` per second.
+
+    ``per_minute <= 0`` disables the limit.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until *amount* can be taken (requests above capacity only
+        have to wait for a full bucket)."""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(missing / self.rate, 0.0)
+
+    def take(self, amount: float) -> None:
+        if self.capacity > 0:
+            self._refill()
+            self.level -= amount
+
+    def drain(self) -> None:
+        if self.capacity > 0:
+            self._refill()
+            self.level = min(self.level, 0.0)
+
+
+class RequestScheduler:
+    """Admits upstream calls within the request and token budgets.
+
+    Waiting calls queue by priority, then arrival; a provider ``429`` pauses
+    all admissions for its ``Retry-After``.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.paused_until = 0.0
+        self._queue: list = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        self.stats = {"admitted": 0, "throttled": 0, "waited_ms": 0.0}
+
+    def queued(self) -> int:
+        return sum(1 for *_rest, future in self._queue if not future.done())
+
+    async def acquire(self, tokens: int, priority: int = INTERACTIVE) -> None:
+        """Wait until a call estimated at *tokens* may be sent."""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), tokens, future))
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+        self._wakeup.set()
+        start = time.perf_counter()
+        await future
+        self.stats["waited_ms"] += (time.perf_counter() - start) * 1000
+
+    def settle(self, estimated: int, actual: int) -> None:
+        """Correct the token bucket once the real usage of a call is known."""
+        self.tokens.take(actual - estimated)
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.requests.drain()
+        self.stats["throttled"] += 1
+
+    async def _run(self) -> None:
+        while self._queue:
+            _priority, _seq, tokens, future = self._queue[0]
+            if future.done():  # caller went away
+                heapq.heappop(self._queue)
+                continue
+            wait = max(
+                self.paused_until - time.monotonic(),
+                self.requests.wait_time(1),
+                self.tokens.wait_time(tokens),
+            )
+            if wait > 0:
+                # a more urgent call may arrive meanwhile – re‑check on wakeup
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._queue)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.stats["admitted"] += 1
+            future.set_result(None)
+
+
+def retry_after(exc: Exception) -> Optional[float]:
+    """Delay requested by the provider, in seconds, if any."""
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            date = email.utils.parsedate_to_datetime(value)
+            return max(date.timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class MeteredStream:
+    """A streamed chat completion that charges its real usage to the token
+    bucket once it ends.
+
+    The stream is requested with ``include_usage``: the provider then reports
+    the usage in a last chunk without choices, which is consumed here rather
+    than handed to the caller. A stream closed before that chunk arrives is
+    charged for the output counted from its deltas.
+    """
+
+    def __init__(self, stream, scheduler: RequestScheduler, estimate: int, model: str):
+        self.stream = stream
+        self.scheduler = scheduler
+        self.estimate = estimate
+        self.model = model
+        self._parts: List[str] = []
+        self._settled = False
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        async for chunk in self.stream:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None:
+                self._settle(usage.total_tokens)
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if content:
+                self._parts.append(content)
+            yield chunk
+        self._settle()
+
+    async def close(self) -> None:
+        try:
+            await self.stream.close()
+        finally:
+            self._settle()
+
+    def _settle(self, actual: Optional[int] = None) -> None:
+        if self._settled:
+            return
+        self._settled = True
+        if actual is None:
+            actual = self.estimate + count_tokens("".join(self._parts), self.model)
+        self.scheduler.settle(self.estimate, actual)
+
+
+def backoff(attempt: int) -> float:
+    """Full‑jitter exponential backoff for retry *attempt* (0‑based)."""
+    ceiling = min(settings.upstream_backoff_max_seconds, settings.upstream_backoff_base_seconds * 2 ** attempt)
+    return random.uniform(0, ceiling)
+
+
+class Upstream:
+    def __init__(self, client: "AsyncOpenAI", scheduler: RequestScheduler, max_retries: int = 4):
+        self.client = client
+        self.scheduler = scheduler
+        self.max_retries = max_retries
+        self.stats = {"calls": 0, "retries": 0, "failures": 0}
+
+    async def _call(self, operation: str, create, tokens: int, priority: int):
+        start = time.perf_counter()
+        try:
+            return await self._attempt(create, tokens, priority)
+        finally:
+            UPSTREAM_SECONDS.labels(operation=operation, priority=PRIORITY_NAMES.get(priority, priority)).observe(
+                time.perf_counter() - start
+            )
+
+    async def _attempt(self, create, tokens: int, priority: int):
+        for attempt in range(self.max_retries + 1):
+            await self.scheduler.acquire(tokens, priority)
+            self.stats["calls"] += 1
+            try:
+                return await create()
+            except retryable() as e:
+                if attempt == self.max_retries:
+                    self.stats["failures"] += 1
+                    raise
+                delay = retry_after(e)
+                if isinstance(e, retryable()[0]):
+                    # everyone is over the limit, not just this call
+                    self.scheduler.pause(delay if delay is not None else backoff(attempt))
+                if delay is None:
+                    delay = backoff(attempt)
+                self.stats["retries"] += 1
+                await asyncio.sleep(delay)
+
+    async def chat(self, model: str, messages: List[dict], priority: int = INTERACTIVE, **params):
+        """``chat.completions.create`` through the scheduler.
+
+        With ``stream=True`` only opening the stream is retried, and a
+        :class:`MeteredStream` is returned.
+        """
+        estimate = sum(message_tokens(m, model) for m in messages)
+        stream = params.get("stream")
+        if stream:
+            params["stream_options"] = {**params.get("stream_options", {}), "include_usage": True}
+        response = await self._call(
+            "chat_stream" if stream else "chat",
+            lambda: self.client.chat.completions.create(model=model, messages=messages, **params),
+            estimate,
+            priority,
+        )
+        if stream:
+            return MeteredStream(response, self.scheduler, estimate, model)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.scheduler.settle(estimate, usage.total_tokens)
+        return response
+
+    async def embed(self, model: str, texts: List[str], priority: int = BULK) -> List[np.ndarray]:
+        estimate = sum(count_tokens(text, model) for text in texts)
+        response = await self._call(
+            "embeddings",
+            lambda: self.client.embeddings.create(model=model, input=texts),
+            estimate,
+            priority,
+        )
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.scheduler.settle(estimate, usage.total_tokens)
+        return [np.asarray(d.embedding, dtype=np.float32) for d in response.data]
+
+    async def aclose(self) -> None:
+        await self.client.close()
+
+
+def build_client() -> "AsyncOpenAI":
+    import openai
+    from openai import AsyncOpenAI
+
+    try:
+        import httpx
+    except ImportError:  # pragma: no cover - newer openai releases use the httpx2 fork
+        import httpx2 as httpx
+
+    http_client = openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=settings.upstream_max_connections,
+            max_keepalive_connections=settings.upstream_max_keepalive,
+            keepalive_expiry=settings.upstream_keepalive_seconds,
+        ),
+        timeout=settings.upstream_timeout_seconds,
+    )
+    # retries are handled by Upstream so they go through the scheduler
+    return AsyncOpenAI(api_key=settings.openai_api_key, http_client=http_client, max_retries=0)
+
+
+@registry.provider("upstream", close=lambda upstream: upstream.aclose())
+def get_upstream() -> Upstream:
+    """The process‑wide upstream client, created on first use."""
+    return Upstream(
+        build_client(),
+        RequestScheduler(settings.upstream_requests_per_minute, settings.upstream_tokens_per_minute),
+        settings.upstream_max_retries,
+    )
+
+
+def _stats() -> dict:
+    upstream = registry.peek("upstream")
+    if upstream is None:
+        return {}
+    scheduler = upstream.scheduler
+    return {**upstream.stats, **scheduler.stats, "queued": scheduler.queued()}
+
+
+register_stats("upstream", "Upstream calls, retries and scheduler admissions", _stats)
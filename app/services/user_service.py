@@ -1,13 +1,50 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 from passlib.context import CryptContext
+from app.config import settings
 from app.db import db
+from app.indexes import declare_index, declare_query
+from app.metrics import register_stats
+from app.registry import registry
 from app.models.user import UserCreate, UserInDB
+from app.services.cache import TTLCache
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-collection = db["users"]
+
+declare_index("users", [("username", 1)], unique=True)
+declare_query("users", "user by username", {"username": "x"})
+
+# bcrypt is deliberately slow; run it on a small dedicated pool so a burst of
+# logins queues up there instead of blocking the event loop (and every
+# streaming chat with it).
+@registry.provider("hash_executor", close=lambda pool: pool.shutdown(wait=False))
+def get_hash_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=settings.auth_hash_workers, thread_name_prefix="bcrypt")
+
+
+# Resolved users by username, so authenticated requests don't hit Mongo.
+user_cache = TTLCache(settings.auth_cache_size, settings.auth_cache_ttl_seconds)
+register_stats("auth_user_cache", "Resolved user cache", user_cache.stats)
+
+
+async def hash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hash_executor(), pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hash_executor(), pwd_context.verify, password, hashed_password)
+
+
+def invalidate_user(username: str) -> None:
+    """Forget the cached copy of a user after it changes."""
+    user_cache.pop(username)
+
 
 async def get_user_by_username(username: str) -> Optional[UserInDB]:
-    doc = await collection.find_one({"username": username})
+    doc = await db["users"].find_one({"username": username})
     if not doc:
         return None
     return UserInDB(
@@ -17,14 +54,27 @@ async def get_user_by_username(username: str) -> Optional[UserInDB]:
         hashed_password=doc.get("hashed_password")
     )
 
+
+async def get_cached_user(username: str) -> Optional[UserInDB]:
+    """Like :func:`get_user_by_username` but served from :data:`user_cache`
+    when possible. Unknown users are not cached."""
+    user = user_cache.get(username)
+    if user is None:
+        user = await get_user_by_username(username)
+        if user is not None:
+            user_cache.set(username, user)
+    return user
+
+
 async def create_user(user: UserCreate) -> UserInDB:
-    hashed_password = pwd_context.hash(user.password)
+    hashed_password = await hash_password(user.password)
     doc = {
         "username": user.username,
         "email": user.email,
         "hashed_password": hashed_password
     }
-    result = await collection.insert_one(doc)
+    result = await db["users"].insert_one(doc)
+    invalidate_user(user.username)
     return UserInDB(
         id=str(result.inserted_id),
         username=user.username,
@@ -34,6 +84,8 @@ async def create_user(user: UserCreate) -> UserInDB:
 
 async def authenticate_user(username: str, password: str) -> Optional[UserInDB]:
     user = await get_user_by_username(username)
-    if not user or not pwd_context.verify(password, user.hashed_password):
+    if not user or not await verify_password(password, user.hashed_password):
         return None
-    return user
\ No newline at end of file
+    # the token issued next will be used right away – warm the cache
+    user_cache.set(username, user)
+    return user
@@ -0,0 +1,322 @@
+"""In‑memory embedding matrices used to score knowledge‑base chunks.
+
+Each knowledge base is loaded once into a contiguous, L2‑normalised float32
+matrix so a query can be scored with a single matrix‑vector product instead of
+a Python loop over every chunk. A BM25 index over the chunk texts
+(:mod:`app.services.lexical_index`) rides along for lexical and hybrid
+retrieval (see :data:`RETRIEVAL_MODES`). Loaded indexes live in a process‑wide LRU cache
+bounded by a memory budget and are dropped whenever their KB changes. With
+``kb_shared_index`` the arrays are memory‑mapped from a per‑host copy that
+every worker shares (:mod:`app.services.shared_index`).
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.metrics import Histogram, register_stats
+from app.services.embedding_codec import decode
+from app.services.lexical_index import LexicalIndex, term_counts, top_indices
+from app.services.string_table import StringTable
+
+RETRIEVAL_SCORING = Histogram(
+    "retrieval_scoring_seconds",
+    "Time to score a query against a KB index",
+    ("method",),
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+RETRIEVAL_CANDIDATES = Histogram(
+    "retrieval_vector_candidates",
+    "Rows handed to vector scoring per hybrid query (the whole KB without the lexical prefilter)",
+    buckets=(16, 64, 256, 1024, 4096, 16384, 65536, 262144),
+)
+
+# vector  – cosine similarity only (ANN on large KBs)
+# lexical – BM25 only; the query is not embedded
+# hybrid  – reciprocal rank fusion of both; on KBs with at least
+#           ``kb_lexical_prefilter_threshold`` chunks only the best lexical
+#           matches are scored by vector
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2‑normalise *matrix* in place (rows with zero norm are left at zero)."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+class KBIndex:
+    """Pre‑normalised embedding matrix plus the chunk texts it was built from."""
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        texts: Sequence[str],
+        chunk_indices: Sequence[int],
+        lexical: Optional[LexicalIndex] = None,
+        normalized: bool = False,
+    ):
+        matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.matrix = matrix if normalized else normalize_rows(matrix)
+        self.texts = texts if isinstance(texts, StringTable) else list(texts)
+        self.chunk_indices = np.asarray(chunk_indices, dtype=np.int32)
+        self.lexical = lexical if lexical is not None else LexicalIndex.from_texts(self.texts)
+        # Optional approximate index (see app.services.ann_index); when unset
+        # every query is scored exactly.
+        self.ann = None
+        # Version of the shared copy this index is mapped from, if any.
+        self.version: Optional[str] = None
+        # False while the KB is still being ingested – such an index is
+        # never cached.
+        self.complete = True
+
+    @classmethod
+    def from_docs(cls, docs: List[dict]) -> "KBIndex":
+        """Build an index from ``kb_chunks`` documents.
+
+        Uses the stored ``terms`` of each chunk; chunks ingested before the
+        lexical index existed are tokenised here.
+        """
+        if not docs:
+            return cls(np.zeros((0, 0), dtype=np.float32), [], [])
+        embeddings = np.empty((len(docs), len(decode(docs[0]["embedding"]))), dtype=np.float32)
+        for row, doc in enumerate(docs):
+            embeddings[row] = decode(doc["embedding"])
+        texts = [doc["text"] for doc in docs]
+        lexical = LexicalIndex.build(
+            [doc["terms"] if "terms" in doc else term_counts(doc["text"]) for doc in docs]
+        )
+        return cls(
+            embeddings,
+            texts,
+            [doc.get("chunk_index", i) for i, doc in enumerate(docs)],
+            lexical,
+        )
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """The index as flat arrays, for :meth:`from_arrays`."""
+        texts = StringTable.from_strings(self.texts)
+        return {
+            "matrix": self.matrix,
+            "chunk_indices": self.chunk_indices,
+            "texts": texts.blob,
+            "text_offsets": texts.offsets,
+            **self.lexical.to_arrays(),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "KBIndex":
+        """Wrap arrays from :meth:`to_arrays` – e.g. read‑only mapped ones – without copying."""
+        texts = StringTable(arrays["texts"], arrays["text_offsets"])
+        return cls(
+            arrays["matrix"],
+            texts,
+            arrays["chunk_indices"],
+            LexicalIndex.from_arrays(arrays, len(texts)),
+            normalized=True,
+        )
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory footprint used for cache accounting."""
+        if isinstance(self.texts, StringTable):
+            texts = self.texts.nbytes
+        else:
+            texts = sum(len(t) for t in self.texts)
+        return int(self.matrix.nbytes + self.chunk_indices.nbytes + texts + self.lexical.nbytes)
+
+    def search(
+        self,
+        query: Sequence[float],
+        top_k: int,
+        exact: bool = False,
+        candidates: Optional[np.ndarray] = None,
+    ) -> List[Tuple[int, float]]:
+        """Return ``(row, score)`` pairs for the *top_k* rows by cosine similarity.
+
+        Uses the attached ANN index when there is one unless *exact* is set.
+        With *candidates*, only those rows are scored (exactly).
+        """
+        use_ann = self.ann is not None and not exact and candidates is None
+        method = "prefiltered" if candidates is not None else "ann" if use_ann else "exact"
+        start = time.perf_counter()
+        try:
+            return self._search(query, top_k, use_ann, candidates)
+        finally:
+            RETRIEVAL_SCORING.labels(method=method).observe(time.perf_counter() - start)
+
+    def _search(
+        self,
+        query: Sequence[float],
+        top_k: int,
+        use_ann: bool,
+        candidates: Optional[np.ndarray] = None,
+    ) -> List[Tuple[int, float]]:
+        n = len(self)
+        if n == 0 or top_k <= 0:
+            return []
+        q = np.asarray(query, dtype=np.float32)
+        q_norm = np.linalg.norm(q)
+        if q_norm == 0:
+            return []
+        q = q / q_norm
+        if use_ann:
+            return self.ann.search(self.matrix, q, top_k)
+        if candidates is not None:
+            scores = self.matrix[candidates] @ q
+            return [(int(candidates[i]), float(scores[i])) for i in top_indices(scores, top_k)]
+        scores = self.matrix @ q
+        return [(int(i), float(scores[i])) for i in top_indices(scores, top_k)]
+
+    def search_lexical(self, query: str, top_k: int) -> List[Tuple[int, float]]:
+        """Return ``(row, score)`` pairs for the *top_k* rows by BM25 score."""
+        start = time.perf_counter()
+        try:
+            return self.lexical.search(query, top_k)
+        finally:
+            RETRIEVAL_SCORING.labels(method="lexical").observe(time.perf_counter() - start)
+
+    def search_hybrid(
+        self, text: str, query: Sequence[float], top_k: int, exact: bool = False
+    ) -> List[Tuple[int, float]]:
+        """Return ``(row, score)`` pairs for the *top_k* rows by fused rank.
+
+        Both rankings are cut at ``kb_lexical_candidates`` rows and merged by
+        reciprocal rank fusion, so the score is ``sum(1 / (kb_hybrid_rrf_k +
+        rank))`` over the rankings a row appears in. On KBs of at least
+        ``kb_lexical_prefilter_threshold`` rows the vector ranking covers only
+        the lexical candidates – unless fewer than *top_k* rows match a query
+        term, in which case the vector side searches the whole KB.
+        """
+        depth = max(top_k, settings.kb_lexical_candidates)
+        start = time.perf_counter()
+        try:
+            lexical = self.lexical.search(text, depth)
+        finally:
+            RETRIEVAL_SCORING.labels(method="lexical").observe(time.perf_counter() - start)
+
+        candidates = None
+        if len(self) >= settings.kb_lexical_prefilter_threshold and len(lexical) >= top_k:
+            candidates = np.fromiter((row for row, _ in lexical), dtype=np.int64, count=len(lexical))
+        vector = self.search(query, depth, exact=exact, candidates=candidates)
+        RETRIEVAL_CANDIDATES.observe(len(self) if candidates is None else len(candidates))
+
+        fused: Dict[int, float] = {}
+        for ranking in (vector, lexical):
+            for rank, (row, _score) in enumerate(ranking):
+                fused[row] = fused.get(row, 0.0) + 1.0 / (settings.kb_hybrid_rrf_k + rank + 1)
+        return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+
+class KBIndexCache:
+    """LRU cache of :class:`KBIndex` objects keyed by ``(user_id, kb_id)``.
+
+    The cache evicts least recently used indexes once the sum of their
+    footprints exceeds *max_bytes*. Concurrent misses for the same key share a
+    single load. Incomplete indexes, and loads that were already running when
+    their KB was invalidated, are handed to the caller but not cached.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], KBIndex]" = OrderedDict()
+        self._loading: Dict[Tuple[str, str], asyncio.Future] = {}
+        # Bumped by invalidate(); a load only caches its result if the
+        # generation of its KB is unchanged when it finishes.
+        self._generations: Dict[str, int] = {}
+        self._bytes = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, user_id: str, kb_id: str) -> Optional[KBIndex]:
+        key = (user_id, kb_id)
+        index = self._entries.get(key)
+        if index is not None:
+            self._entries.move_to_end(key)
+        return index
+
+    def put(self, user_id: str, kb_id: str, index: KBIndex) -> None:
+        key = (user_id, kb_id)
+        self._discard(key)
+        if index.nbytes > self.max_bytes:
+            # Too big to cache – callers still get to use it for this query.
+            return
+        self._entries[key] = index
+        self._bytes += index.nbytes
+        while self._bytes > self.max_bytes and self._entries:
+            _key, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def invalidate(self, kb_id: str) -> None:
+        """Drop every cached index for *kb_id* regardless of owner.
+
+        Loads in flight are detached: they finish for their callers, but
+        later misses start a new load and nothing stale is cached.
+        """
+        self._generations[kb_id] = self._generations.get(kb_id, 0) + 1
+        for key in [k for k in self._entries if k[1] == kb_id]:
+            self._discard(key)
+        for key in [k for k in self._loading if k[1] == kb_id]:
+            del self._loading[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    async def get_or_load(
+        self, user_id: str, kb_id: str, loader: Callable[[], Awaitable[KBIndex]]
+    ) -> KBIndex:
+        index = self.get(user_id, kb_id)
+        if index is not None:
+            return index
+
+        key = (user_id, kb_id)
+        pending = self._loading.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        generation = self._generations.get(kb_id, 0)
+        try:
+            index = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # Nobody else may be awaiting – mark the exception as retrieved.
+            future.exception()
+            raise
+        else:
+            if index.complete and self._generations.get(kb_id, 0) == generation:
+                self.put(user_id, kb_id, index)
+            future.set_result(index)
+            return index
+        finally:
+            if self._loading.get(key) is future:
+                del self._loading[key]
+
+    def _discard(self, key: Tuple[str, str]) -> None:
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+
+
+index_cache = KBIndexCache(settings.kb_index_cache_mb * 1024 * 1024)
+register_stats(
+    "kb_index_cache",
+    "Loaded KB indexes",
+    lambda: {"entries": len(index_cache._entries), "bytes": index_cache._bytes},
+)
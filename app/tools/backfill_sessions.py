@@ -0,0 +1,65 @@
+"""Build the materialised ``sessions`` collection from the message log.
+
+Usage (from the repository root)::
+
+    python -m app.tools.backfill_sessions [--user USER_ID] [--batch-size 1000]
+
+Aggregates ``messages`` per (user_id, session_id) and upserts one summary
+document per session. It recomputes every field from scratch, so it is
+idempotent; run it once before switching traffic to the new sidebar query
+(messages saved while it runs may be counted twice or not at all – re‑run it
+to settle them).
+"""
+
+import argparse
+import asyncio
+
+from pymongo import UpdateOne
+
+from app.db import db
+from app.services.history_service import TITLE_LENGTH
+
+
+async def backfill(user_id: str = None, batch_size: int = 1000) -> int:
+    pipeline = []
+    if user_id:
+        pipeline.append({"$match": {"user_id": user_id}})
+    pipeline += [
+        {"$sort": {"user_id": 1, "session_id": 1, "timestamp": 1}},
+        {
+            "$group": {
+                "_id": {"user_id": "$user_id", "session_id": "$session_id"},
+                "title": {"$first": "$content"},
+                "created_at": {"$first": "$timestamp"},
+                "last_message": {"$last": "$content"},
+                "timestamp": {"$last": "$timestamp"},
+                "message_count": {"$sum": 1},
+            }
+        },
+    ]
+
+    sessions = db["sessions"]
+    ops = []
+    written = 0
+    async for doc in db["messages"].aggregate(pipeline, allowDiskUse=True):
+        key = doc.pop("_id")
+        doc["title"] = (doc["title"] or "")[:TITLE_LENGTH]
+        ops.append(UpdateOne(key, {"$set": doc}, upsert=True))
+        if len(ops) >= batch_size:
+            await sessions.bulk_write(ops, ordered=False)
+            written += len(ops)
+            ops = []
+            print(f"{written} sessions written", flush=True)
+    if ops:
+        await sessions.bulk_write(ops, ordered=False)
+        written += len(ops)
+    print(f"done – {written} sessions", flush=True)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill the sessions collection from messages")
+    parser.add_argument("--user", help="only backfill this user id")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(backfill(args.user, args.batch_size))
@@ -0,0 +1,40 @@
+"""Verify that every declared canonical query is served by an index.
+
+Usage (from the repository root)::
+
+    python -m app.tools.check_indexes [--no-create]
+
+Ensures the declared indexes exist (unless ``--no-create``), then runs
+``explain()`` on each query registered with :func:`app.indexes.declare_query`
+and exits non‑zero if any winning plan contains a collection scan or an
+in‑memory sort.
+"""
+
+import argparse
+import asyncio
+import sys
+
+import app.main  # noqa: F401 – importing the app registers every service's indexes
+from app.indexes import QUERIES, ensure_indexes, explain_query
+
+
+async def main(create: bool) -> int:
+    if create:
+        await ensure_indexes()
+    failures = 0
+    for spec in QUERIES:
+        stages, problems = await explain_query(spec)
+        status = "FAIL" if problems else "ok"
+        detail = ", ".join(problems) if problems else " > ".join(stages)
+        print(f"[{status}] {spec.collection}: {spec.name} – {detail}")
+        failures += bool(problems)
+    if failures:
+        print(f"{failures} quer{'y' if failures == 1 else 'ies'} not served by an index", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check query plans of the canonical queries")
+    parser.add_argument("--no-create", action="store_true", help="don't create missing indexes first")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(not args.no_create)))
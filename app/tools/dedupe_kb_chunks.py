@@ -0,0 +1,75 @@
+"""Remove duplicate KB chunks and make their index unique.
+
+Usage (from the repository root)::
+
+    python -m app.tools.dedupe_kb_chunks [--dry-run]
+
+Two runs of the same ingestion job used to be able to insert the same
+``chunk_index`` of a KB twice. Keeps the first stored copy of every
+(kb_id, user_id, chunk_index), deletes the others and replaces the old
+non‑unique ``kb_chunks`` index with the unique one the app declares, which
+can't be built while duplicates exist. Safe to re‑run.
+"""
+
+import argparse
+import asyncio
+
+from pymongo.errors import OperationFailure
+
+from app.db import db
+
+INDEX_KEYS = [("kb_id", 1), ("user_id", 1), ("chunk_index", 1)]
+INDEX_NAME = "kb_id_1_user_id_1_chunk_index_1"
+
+
+async def dedupe(dry_run: bool = False, batch_size: int = 1000) -> int:
+    chunks = db["kb_chunks"]
+    pipeline = [
+        {"$sort": {"_id": 1}},
+        {
+            "$group": {
+                "_id": {"kb_id": "$kb_id", "user_id": "$user_id", "chunk_index": "$chunk_index"},
+                "ids": {"$push": "$_id"},
+                "count": {"$sum": 1},
+            }
+        },
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    extra = []
+    removed = 0
+    async for group in chunks.aggregate(pipeline, allowDiskUse=True):
+        extra += group["ids"][1:]
+        if len(extra) >= batch_size:
+            removed += await _delete(chunks, extra, dry_run)
+            extra = []
+    if extra:
+        removed += await _delete(chunks, extra, dry_run)
+    print(f"{'would remove' if dry_run else 'removed'} {removed} duplicate chunks", flush=True)
+
+    if not dry_run:
+        info = await chunks.index_information()
+        if INDEX_NAME in info and not info[INDEX_NAME].get("unique"):
+            await chunks.drop_index(INDEX_NAME)
+        try:
+            await chunks.create_index(INDEX_KEYS, name=INDEX_NAME, unique=True)
+        except OperationFailure as e:
+            # chunks inserted while this ran – run it again
+            print("Could not create the unique index", e)
+        else:
+            print("unique index in place", flush=True)
+    return removed
+
+
+async def _delete(chunks, ids: list, dry_run: bool) -> int:
+    if dry_run:
+        return len(ids)
+    result = await chunks.delete_many({"_id": {"$in": ids}})
+    return result.deleted_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove duplicate KB chunks and make their index unique")
+    parser.add_argument("--dry-run", action="store_true", help="only count the duplicates")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(dedupe(args.dry_run, args.batch_size))
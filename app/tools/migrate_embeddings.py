@@ -0,0 +1,61 @@
+"""Rewrite stored embeddings into the compact binary format.
+
+Usage (from the repository root)::
+
+    python -m app.tools.migrate_embeddings [--format float16] [--batch-size 500]
+
+Walks ``kb_chunks`` and ``embedding_store`` in ``_id`` order, re‑encoding
+legacy array embeddings in place with one ``bulk_write`` per batch. With
+``--reencode`` documents that are already binary are converted too (e.g. to
+switch an existing deployment from float32 to int8). The command is safe to
+interrupt and re‑run.
+"""
+
+import argparse
+import asyncio
+
+from pymongo import UpdateOne
+
+from app.config import settings
+from app.db import db
+from app.services.embedding_codec import FORMATS, decode, encode, format_of
+
+
+async def migrate_collection(name: str, fmt: str, batch_size: int, reencode: bool) -> int:
+    collection = db[name]
+    query = {} if reencode else {"embedding": {"$type": "array"}}
+    last_id = None
+    migrated = 0
+    while True:
+        batch_query = dict(query)
+        if last_id is not None:
+            batch_query["_id"] = {"$gt": last_id}
+        cursor = collection.find(batch_query, {"_id": 1, "embedding": 1}).sort("_id", 1).limit(batch_size)
+        docs = await cursor.to_list(length=batch_size)
+        if not docs:
+            break
+        last_id = docs[-1]["_id"]
+        ops = [
+            UpdateOne({"_id": doc["_id"]}, {"$set": {"embedding": encode(decode(doc["embedding"]), fmt)}})
+            for doc in docs
+            if "embedding" in doc and format_of(doc["embedding"]) != fmt
+        ]
+        if ops:
+            await collection.bulk_write(ops, ordered=False)
+            migrated += len(ops)
+        print(f"{name}: {migrated} documents rewritten", flush=True)
+    return migrated
+
+
+async def main(fmt: str, batch_size: int, reencode: bool) -> None:
+    for name in ("kb_chunks", "embedding_store"):
+        await migrate_collection(name, fmt, batch_size, reencode)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert stored embeddings to the binary format")
+    parser.add_argument("--format", choices=sorted(FORMATS), default=settings.kb_embedding_format)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--reencode", action="store_true", help="also convert binary embeddings in another format")
+    args = parser.parse_args()
+    asyncio.run(main(args.format, args.batch_size, args.reencode))
@@ -0,0 +1,80 @@
+"""Recall@k and latency of the ANN backends against exact KB search.
+
+Run from the repository root::
+
+    python -m benchmarks.ann_recall --rows 50000 --dim 1536 --queries 200
+
+The data is synthetic but clustered (like real document embeddings), so the
+recall numbers are representative of what a large KB sees.
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.services.ann_index import ANN_BACKENDS
+from app.services.vector_index import KBIndex, normalize_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--backend", default="ivf_flat", choices=sorted(ANN_BACKENDS))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    centers = rng.standard_normal((args.clusters, args.dim)).astype(np.float32)
+    matrix = centers[rng.integers(0, args.clusters, args.rows)]
+    matrix += 0.6 * rng.standard_normal(matrix.shape).astype(np.float32)
+    queries = centers[rng.integers(0, args.clusters, args.queries)]
+    queries += 0.6 * rng.standard_normal(queries.shape).astype(np.float32)
+    normalize_rows(queries)
+
+    index = KBIndex(matrix, [""] * args.rows, range(args.rows))
+
+    t0 = time.perf_counter()
+    ann = ANN_BACKENDS[args.backend].build(index.matrix)
+    build_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    truth = [{row for row, _ in index.search(q, args.top_k, exact=True)} for q in queries]
+    exact_ms = (time.perf_counter() - t0) * 1000 / args.queries
+
+    report = {
+        "rows": args.rows,
+        "dim": args.dim,
+        "top_k": args.top_k,
+        "backend": args.backend,
+        "build_s": round(build_s, 3),
+        "exact_ms_per_query": round(exact_ms, 3),
+        "ann": [],
+    }
+    index.ann = ann
+    for nprobe in args.nprobe:
+        ann.nprobe = nprobe
+        t0 = time.perf_counter()
+        found = [{row for row, _ in index.search(q, args.top_k)} for q in queries]
+        ann_ms = (time.perf_counter() - t0) * 1000 / args.queries
+        recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+        report["ann"].append(
+            {
+                "nprobe": nprobe,
+                "recall_at_k": round(float(recall), 4),
+                "ms_per_query": round(ann_ms, 3),
+                "speedup": round(exact_ms / ann_ms, 2) if ann_ms else None,
+            }
+        )
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
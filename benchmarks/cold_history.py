@@ -0,0 +1,133 @@
+"""Space reclaimed by the cold history tier and what reads pay for it.
+
+Run from the repository root::
+
+    python -m benchmarks.cold_history --users 20 --sessions 10 --messages 200
+
+Fills the in‑process Mongo stand‑in of the load test with old chat history
+(prose‑like messages, replies several times longer than questions), times a
+few reads, runs one :class:`HistoryCompactor` pass and times the same reads
+again. Sizes are BSON document bytes. ``index_entries`` counts entries in
+the secondary indexes declared for each collection, and it shrinks the same
+way on a real server. The stand‑in scans rather than seeks, so read timings
+are only a rough comparison.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+WORDS = (
+    "the model returns a list of results for each query and we can cache them per session so that "
+    "retrieval stays fast while the index grows with every document uploaded by users in the workspace"
+).split()
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+async def timed_reads(history, users, sessions, rounds: int) -> dict:
+    samples = {"session_page": [], "recent": [], "user_page": []}
+    for _ in range(rounds):
+        for user_id in users:
+            session_id = random.choice(sessions[user_id])
+            t0 = time.perf_counter()
+            await history.get_messages_page(user_id, session_id, None, 50)
+            samples["session_page"].append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            await history.get_recent_messages(user_id, session_id, None, 20)
+            samples["recent"].append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            await history.get_messages(user_id, None, 0, 100)
+            samples["user_page"].append(time.perf_counter() - t0)
+    return {name: round(sum(values) / len(values) * 1000, 3) for name, values in samples.items()}
+
+
+async def run(args) -> dict:
+    import bson
+
+    from benchmarks.loadtest.__main__ import install_fake_mongo
+
+    install_fake_mongo(0)
+    from app.db import db
+    from app.indexes import INDEXES
+    from app.services.cold_history import get_history_compactor
+    from app.services.history_service import get_history_service
+
+    rng = random.Random(args.seed)
+    start = datetime.utcnow() - timedelta(days=args.age_days)
+    users = [f"user-{u}" for u in range(args.users)]
+    sessions = {}
+    for user_id in users:
+        sessions[user_id] = [f"{user_id}-s{s}" for s in range(args.sessions)]
+        docs = []
+        for session_id in sessions[user_id]:
+            t = start + timedelta(minutes=rng.randrange(60 * 24 * 7))
+            for i in range(args.messages):
+                t += timedelta(seconds=rng.randrange(5, 120))
+                role = "user" if i % 2 == 0 else "assistant"
+                words = rng.randrange(8, 30) if role == "user" else rng.randrange(60, 250)
+                docs.append({
+                    "user_id": user_id,
+                    "session_id": session_id,
+                    "role": role,
+                    "content": sentence(rng, words),
+                    "timestamp": t.replace(microsecond=t.microsecond // 1000 * 1000),
+                })
+        await db["messages"].insert_many(docs)
+
+    async def footprint(name: str) -> dict:
+        docs = await db[name].find({}).to_list(length=None)
+        indexes = sum(1 for spec in INDEXES if spec.collection == name)
+        return {
+            "documents": len(docs),
+            "bytes": sum(len(bson.encode(doc)) for doc in docs),
+            "index_entries": len(docs) * (indexes + 1),  # + the _id index
+        }
+
+    history = get_history_service()
+    before = {"messages": await footprint("messages")}
+    reads_hot = await timed_reads(history, users, sessions, args.rounds)
+
+    t0 = time.perf_counter()
+    report = await get_history_compactor().compact(older_than=timedelta(days=args.age_days // 2))
+    compact_s = time.perf_counter() - t0
+
+    after = {"messages": await footprint("messages"), "message_buckets": await footprint("message_buckets")}
+    after_bytes = after["messages"]["bytes"] + after["message_buckets"]["bytes"]
+    reads_cold = await timed_reads(history, users, sessions, args.rounds)
+    return {
+        "messages": args.users * args.sessions * args.messages,
+        "compaction": report,
+        "compaction_s": round(compact_s, 2),
+        "before": before,
+        "after": after,
+        "bytes_ratio": round(before["messages"]["bytes"] / max(1, after_bytes), 2),
+        "read_ms_hot": reads_hot,
+        "read_ms_cold": reads_cold,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--sessions", type=int, default=10, help="sessions per user")
+    parser.add_argument("--messages", type=int, default=200, help="messages per session")
+    parser.add_argument("--age-days", type=int, default=90, help="age of the generated history")
+    parser.add_argument("--rounds", type=int, default=5, help="read rounds over all users")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-cold-history")
+    os.environ.setdefault("JWT_SECRET_KEY", "cold-history")
+    os.environ["HISTORY_COLD_TIER"] = "1"
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Import time, startup time and first‑request latency of the app.
+
+Run from the repository root::
+
+    python -m benchmarks.cold_start --runs 7 --max-import-ms 2500
+
+Every run is a fresh interpreter: it imports ``app.main``, then runs the
+lifespan startup against the in‑process Mongo stand‑in of the load test and
+times one authenticated ``GET /history/`` – the first request builds the
+history service, its Mongo collections and the session cache. The report
+also lists heavy modules loaded by the import and resources the import
+created (both should be empty: clients are built on first use, see
+:mod:`app.registry`).
+
+With ``--max-import-ms``/``--max-startup-ms``/``--max-first-request-ms`` the
+command exits non‑zero when a median exceeds its budget, or when the import
+loads a heavy module or creates a resource, so CI can guard cold starts.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Modules that must not be loaded just by importing the app.
+HEAVY_MODULES = ("openai", "httpx", "httpx2", "motor", "PyPDF2")
+
+
+def child() -> dict:
+    t0 = time.perf_counter()
+    import app.main
+
+    import_ms = (time.perf_counter() - t0) * 1000
+    from app.registry import registry
+
+    report = {
+        "import_ms": import_ms,
+        "heavy_modules": [name for name in HEAVY_MODULES if name in sys.modules],
+        "created_on_import": registry.created(),
+        "modules": len(sys.modules),
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+    from benchmarks.loadtest.__main__ import call, install_fake_mongo, seed_users
+
+    async def start() -> None:
+        install_fake_mongo(0)
+        t0 = time.perf_counter()
+        async with app.main.app.router.lifespan_context(app.main.app):
+            report["startup_ms"] = (time.perf_counter() - t0) * 1000
+            (token,) = await seed_users(1)
+            result = await call(app.main.app, "GET", "/history/", token)
+            if result.status != 200:
+                raise RuntimeError(f"GET /history/ returned {result.status}: {result.body[:200]!r}")
+            report["first_request_ms"] = result.latency_ms
+            report["created_by_first_request"] = registry.created()
+        report["left_open"] = registry.created()
+
+    asyncio.run(start())
+    return report
+
+
+def run_child(env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.cold_start", "--child"],
+        env=env,
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    return json.loads(output)
+
+
+def summary(samples) -> dict:
+    return {
+        "median": round(statistics.median(samples), 1),
+        "min": round(min(samples), 1),
+        "max": round(max(samples), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=None)
+    parser.add_argument("--max-startup-ms", type=float, default=None)
+    parser.add_argument("--max-first-request-ms", type=float, default=None)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child()))
+        return
+
+    workdir = tempfile.mkdtemp(prefix="cold-start-")
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "sk-cold-start")
+    env.setdefault("JWT_SECRET_KEY", "cold-start")
+    env["KB_UPLOAD_DIR"] = os.path.join(workdir, "uploads")
+    env["KB_INDEX_DIR"] = os.path.join(workdir, "kb_indexes")
+
+    runs = [run_child(env) for _ in range(args.runs)]
+    last = runs[-1]
+    report = {
+        "runs": args.runs,
+        "import_ms": summary([r["import_ms"] for r in runs]),
+        "startup_ms": summary([r["startup_ms"] for r in runs]),
+        "first_request_ms": summary([r["first_request_ms"] for r in runs]),
+        "max_rss_mb": round(max(r["max_rss_mb"] for r in runs), 1),
+        "modules": last["modules"],
+        "heavy_modules": last["heavy_modules"],
+        "created_on_import": last["created_on_import"],
+        "created_by_first_request": last["created_by_first_request"],
+        "left_open": last["left_open"],
+    }
+
+    failures = []
+    for key, budget in (
+        ("import_ms", args.max_import_ms),
+        ("startup_ms", args.max_startup_ms),
+        ("first_request_ms", args.max_first_request_ms),
+    ):
+        if budget is not None and report[key]["median"] > budget:
+            failures.append(f"{key} median {report[key]['median']} > {budget}")
+    if any(budget is not None for budget in (args.max_import_ms, args.max_startup_ms, args.max_first_request_ms)):
+        if report["heavy_modules"]:
+            failures.append(f"import loads {', '.join(report['heavy_modules'])}")
+        if report["created_on_import"]:
+            failures.append(f"import creates {', '.join(report['created_on_import'])}")
+    report["failures"] = failures
+
+    print(json.dumps(report, indent=2))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
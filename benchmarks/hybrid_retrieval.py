@@ -0,0 +1,117 @@
+"""Candidate‑set reduction, latency and hit rate of the retrieval modes.
+
+Run from the repository root::
+
+    python -m benchmarks.hybrid_retrieval --rows 50000 --dim 1536 --queries 200
+
+Chunks are synthetic: Zipf‑distributed filler words plus one unique part
+number each, with clustered embeddings. Half of the queries ask for a part
+number (their embedding only matches the chunk's topic, as with real code
+lookups), half paraphrase a chunk (embedding near the chunk, a few of its
+words). ``hit_rate`` is the fraction of queries whose target chunk is in
+the top *k*.
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.config import settings
+from app.services.lexical_index import LexicalIndex
+from app.services.vector_index import KBIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--words", type=int, default=120, help="words per chunk")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--candidates", type=int, default=settings.kb_lexical_candidates)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    ranks = np.arange(1, args.vocabulary + 1)
+    p = 1 / ranks
+    p /= p.sum()
+    words = rng.choice(args.vocabulary, size=(args.rows, args.words), p=p)
+    texts = [
+        " ".join(f"w{w}" for w in row) + f" part PN-{i:06d}"
+        for i, row in enumerate(words)
+    ]
+
+    centers = rng.standard_normal((args.clusters, args.dim)).astype(np.float32)
+    labels = rng.integers(0, args.clusters, args.rows)
+    matrix = centers[labels]
+    matrix += 0.6 * rng.standard_normal(matrix.shape).astype(np.float32)
+
+    targets = rng.integers(0, args.rows, args.queries)
+    queries = []
+    for n, target in enumerate(targets):
+        noise = rng.standard_normal(args.dim).astype(np.float32)
+        if n % 2 == 0:
+            # the embedding only knows the topic, not the part
+            text = f"what is the torque spec for PN-{target:06d}"
+            vector = centers[labels[target]] + 0.6 * noise
+        else:
+            picked = rng.choice(words[target], size=6, replace=False)
+            text = " ".join(f"w{w}" for w in picked)
+            vector = matrix[target] + 0.3 * noise
+        queries.append((int(target), text, vector))
+
+    t0 = time.perf_counter()
+    lexical = LexicalIndex.from_texts(texts)
+    build_s = time.perf_counter() - t0
+    # normalises matrix in place, so queries are drawn first
+    index = KBIndex(matrix, texts, range(args.rows), lexical)
+
+    settings.kb_lexical_candidates = args.candidates
+    modes = {
+        "vector": lambda text, vector: index.search(vector, args.top_k, exact=True),
+        "lexical": lambda text, vector: index.search_lexical(text, args.top_k),
+        "hybrid": lambda text, vector: index.search_hybrid(text, vector, args.top_k, exact=True),
+    }
+    report = {
+        "rows": args.rows,
+        "dim": args.dim,
+        "top_k": args.top_k,
+        "lexical_build_s": round(build_s, 3),
+        "lexical_mb": round(lexical.nbytes / 2**20, 1),
+        "prefilter_threshold": settings.kb_lexical_prefilter_threshold,
+        "modes": {},
+    }
+
+    for name, run in modes.items():
+        hits = 0
+        t0 = time.perf_counter()
+        for target, text, vector in queries:
+            hits += target in {row for row, _ in run(text, vector)}
+        ms = (time.perf_counter() - t0) * 1000 / len(queries)
+        report["modes"][name] = {"ms_per_query": round(ms, 3), "hit_rate": round(hits / len(queries), 4)}
+
+    scored = []
+    for _target, text, _vector in queries:
+        candidates = lexical.candidates(text, max(args.top_k, args.candidates))
+        prefiltered = (
+            candidates is not None
+            and len(candidates) >= args.top_k
+            and args.rows >= settings.kb_lexical_prefilter_threshold
+        )
+        scored.append(len(candidates) if prefiltered else args.rows)
+    report["vector_rows_scored"] = {
+        "vector": args.rows,
+        "hybrid_mean": round(float(np.mean(scored)), 1),
+        "reduction": round(args.rows / float(np.mean(scored)), 1),
+    }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+"""Offline load tests: the API against local OpenAI and MongoDB stand‑ins.
+
+* :mod:`.fake_openai` – OpenAI‑compatible HTTP server with configurable
+  time‑to‑first‑token, token rate, embedding latency and 429s;
+* :mod:`.fake_mongo` – in‑process replacement for the Motor client;
+* ``python -m benchmarks.loadtest`` – load generator that drives the API's
+  endpoints at a given concurrency and prints latency percentiles, TTFT and
+  throughput as JSON.
+"""
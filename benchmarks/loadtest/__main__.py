@@ -0,0 +1,417 @@
+"""Load‑test the API offline and report latency percentiles as JSON.
+
+Starts :mod:`benchmarks.loadtest.fake_openai` in a subprocess (or uses
+``--openai-url``), swaps :mod:`app.db` for the in‑process
+:mod:`benchmarks.loadtest.fake_mongo` (unless ``--mongo-uri`` is given),
+then calls the real FastAPI app in‑process as an ASGI application – no
+HTTP client needed – with ``--concurrency`` workers per scenario:
+
+* ``upload``   – ``POST /kb/upload`` of a generated PDF, plus time until the
+  ingestion job completes (``ingest_ms``);
+* ``query``    – ``POST /kb/query`` against an uploaded KB;
+* ``chat``     – ``POST /chat/``;
+* ``stream``   – ``POST /chat/stream``, with time to the first token frame;
+* ``sessions`` – ``GET /history/sessions``.
+
+Example::
+
+    python -m benchmarks.loadtest --concurrency 50 --requests 500 --ttft-ms 300 --token-rate 80 > run.json
+
+Runs write their JSON to stdout (or ``--output``) so two versions can be
+diffed; progress goes to stderr.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Tuple
+
+from benchmarks.loadtest import fake_openai
+from benchmarks.loadtest.fake_mongo import FakeMongoClient
+
+SCENARIOS = ("upload", "query", "chat", "stream", "sessions")
+
+
+def log(*args) -> None:
+    print(*args, file=sys.stderr, flush=True)
+
+
+def percentiles(samples: List[float]) -> Optional[Dict[str, float]]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))]
+
+    return {
+        "p50": round(rank(50), 2),
+        "p95": round(rank(95), 2),
+        "p99": round(rank(99), 2),
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "max": round(ordered[-1], 2),
+    }
+
+
+# ------------------------------ ASGI client ------------------------------ #
+
+
+class Result:
+    __slots__ = ("status", "body", "latency_ms", "ttft_ms")
+
+    def __init__(self, status: int, body: bytes, latency_ms: float, ttft_ms: Optional[float]):
+        self.status = status
+        self.body = body
+        self.latency_ms = latency_ms
+        self.ttft_ms = ttft_ms
+
+    def json(self):
+        return json.loads(self.body)
+
+
+async def call(
+    app,
+    method: str,
+    path: str,
+    token: Optional[str] = None,
+    body: bytes = b"",
+    content_type: str = "application/json",
+    first_marker: Optional[bytes] = None,
+) -> Result:
+    """Issue one request straight at the ASGI *app*.
+
+    ``ttft_ms`` is the time until a body chunk containing *first_marker*
+    arrived.
+    """
+    path, _, query = path.partition("?")
+    headers = [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())]
+    if token:
+        headers.append((b"authorization", f"Bearer {token}".encode()))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": headers,
+        "client": ("127.0.0.1", 0),
+        "server": ("loadtest", 80),
+    }
+    status = 0
+    chunks: List[bytes] = []
+    ttft = None
+    sent = False
+    complete = asyncio.Event()
+    start = time.perf_counter()
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # a well‑behaved client: only "disconnect" once the response is done
+        await complete.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, ttft
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunk = message.get("body", b"")
+            if chunk:
+                chunks.append(chunk)
+                if ttft is None and first_marker is not None and first_marker in chunk:
+                    ttft = (time.perf_counter() - start) * 1000
+            if not message.get("more_body", False):
+                complete.set()
+
+    await app(scope, receive, send)
+    return Result(status, b"".join(chunks), (time.perf_counter() - start) * 1000, ttft)
+
+
+def multipart(filename: str, data: bytes, content_type: str = "application/pdf") -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+# ------------------------------- Scenarios ------------------------------- #
+
+
+class Scenarios:
+    """One coroutine per request type; each returns ``(Result, extra metrics)``."""
+
+    def __init__(self, app, args, pdf: bytes):
+        self.app = app
+        self.args = args
+        self.pdf = pdf
+        self.kbs: Dict[str, str] = {}  # token -> kb_id
+
+    async def upload(self, token: str, n: int):
+        body, content_type = multipart(f"bench-{n}.pdf", self.pdf)
+        result = await call(self.app, "POST", "/kb/upload", token, body, content_type)
+        extra = {}
+        if result.status == 202:
+            job = result.json()
+            start = time.perf_counter() - result.latency_ms / 1000
+            while job["status"] not in ("completed", "failed"):
+                await asyncio.sleep(0.05)
+                job = (await call(self.app, "GET", f"/kb/jobs/{job['job_id']}", token)).json()
+            if job["status"] == "completed":
+                extra["ingest_ms"] = (time.perf_counter() - start) * 1000
+                self.kbs.setdefault(token, job["kb_id"])
+            else:
+                result.status = 500
+        return result, extra
+
+    async def query(self, token: str, n: int):
+        if token not in self.kbs:
+            await self.upload(token, n)
+        payload = {
+            "kb_id": self.kbs[token],
+            "query": f"what does line {n % 40} say about the fox?",
+            "top_k": 3,
+            "mode": self.args.kb_mode,
+        }
+        return await call(self.app, "POST", "/kb/query", token, json.dumps(payload).encode()), {}
+
+    async def chat(self, token: str, n: int):
+        payload = {"message": f"Question {n}: how do I get started?"}
+        return await call(self.app, "POST", "/chat/", token, json.dumps(payload).encode()), {}
+
+    async def stream(self, token: str, n: int):
+        payload = {"message": f"Question {n}: tell me a story."}
+        result = await call(
+            self.app, "POST", "/chat/stream", token, json.dumps(payload).encode(), first_marker=b'"token"'
+        )
+        return result, {}
+
+    async def sessions(self, token: str, n: int):
+        return await call(self.app, "GET", "/history/sessions?limit=100", token), {}
+
+
+async def run_scenario(run: Callable, tokens: List[str], requests: int, concurrency: int) -> dict:
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    extras: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    counter = iter(range(requests))
+
+    async def worker(w: int):
+        token = tokens[w % len(tokens)]
+        for n in counter:
+            try:
+                result, extra = await run(token, n)
+            except Exception as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                continue
+            if not 200 <= result.status < 300:
+                errors[str(result.status)] = errors.get(str(result.status), 0) + 1
+                continue
+            latencies.append(result.latency_ms)
+            if result.ttft_ms is not None:
+                ttfts.append(result.ttft_ms)
+            for key, value in extra.items():
+                extras.setdefault(key, []).append(value)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "requests": requests,
+        "ok": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": percentiles(latencies),
+    }
+    if ttfts:
+        report["ttft_ms"] = percentiles(ttfts)
+    for key, values in extras.items():
+        report[key] = percentiles(values)
+    return report
+
+
+# --------------------------------- Setup --------------------------------- #
+
+
+async def wait_for_port(host: str, port: int, timeout: float = 15.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _reader, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def http_get_json(host: str, port: int, path: str) -> dict:
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+    await writer.drain()
+    raw = await reader.read()
+    writer.close()
+    return json.loads(raw.partition(b"\r\n\r\n")[2] or b"{}")
+
+
+def start_fake_openai(args) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "benchmarks.loadtest.fake_openai",
+        "--port", str(args.openai_port),
+        "--ttft-ms", str(args.ttft_ms),
+        "--token-rate", str(args.token_rate),
+        "--reply-tokens", str(args.reply_tokens),
+        "--embed-latency-ms", str(args.embed_latency_ms),
+        "--error-rate", str(args.error_rate),
+    ]
+    return subprocess.Popen(command)
+
+
+def configure_environment(args, workdir: str) -> None:
+    """Settings are read at import time – set them before importing ``app``."""
+    os.environ["OPENAI_BASE_URL"] = args.openai_url or f"http://127.0.0.1:{args.openai_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-loadtest")
+    os.environ.setdefault("JWT_SECRET_KEY", "loadtest")
+    os.environ["KB_UPLOAD_DIR"] = os.path.join(workdir, "uploads")
+    os.environ["KB_INDEX_DIR"] = os.path.join(workdir, "kb_indexes")
+    if args.mongo_uri:
+        os.environ["MONGODB_URI"] = args.mongo_uri
+        os.environ["MONGODB_DB_NAME"] = f"loadtest_{uuid.uuid4().hex[:8]}"
+
+
+def install_fake_mongo(latency_ms: float) -> None:
+    from app.registry import registry
+
+    registry.override("mongo", FakeMongoClient(latency_ms / 1000))
+
+
+async def seed_users(count: int) -> List[str]:
+    from app.db import db
+    from app.services.auth_service import create_access_token
+    from datetime import timedelta
+
+    tokens = []
+    for i in range(count):
+        username = f"loadtest-{i}-{uuid.uuid4().hex[:6]}"
+        await db["users"].insert_one(
+            {"username": username, "email": f"{username}@example.com", "hashed_password": "x"}
+        )
+        tokens.append(create_access_token({"sub": username}, expires_delta=timedelta(hours=12)))
+    return tokens
+
+
+def service_stats() -> dict:
+    from app.routers.kb import kbs
+    from app.services.chat_service import history_service, upstream
+    from app.services.embedding_store import embedding_store
+    from app.services.response_cache import response_cache
+
+    return {
+        "upstream": upstream.stats,
+        "scheduler": {**upstream.scheduler.stats, "waited_ms": round(upstream.scheduler.stats["waited_ms"], 1)},
+        "query_embedder": kbs.query_embedder.stats,
+        "embedding_store": embedding_store.stats,
+        "session_cache": history_service.cache_stats(),
+        "response_cache": response_cache.stats,
+    }
+
+
+async def main(args) -> dict:
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    configure_environment(args, workdir)
+    server = None
+    if not args.openai_url:
+        server = start_fake_openai(args)
+    try:
+        if server is not None:
+            await wait_for_port("127.0.0.1", args.openai_port)
+        if not args.mongo_uri:
+            install_fake_mongo(args.mongo_latency_ms)
+
+        from app.main import app
+        from benchmarks.pdf_extract import generate_pdf
+
+        pdf_path = os.path.join(workdir, "bench.pdf")
+        generate_pdf(pdf_path, args.upload_pages)
+        with open(pdf_path, "rb") as f:
+            pdf = f.read()
+
+        report = {
+            "config": {
+                key: getattr(args, key)
+                for key in (
+                    "concurrency", "requests", "users", "ttft_ms", "token_rate", "reply_tokens",
+                    "embed_latency_ms", "error_rate", "mongo_latency_ms", "upload_pages",
+                )
+            },
+            "mongo": "real" if args.mongo_uri else "fake",
+            "results": {},
+        }
+        async with app.router.lifespan_context(app):
+            tokens = await seed_users(args.users or args.concurrency)
+            runner = Scenarios(app, args, pdf)
+            for name in scenarios:
+                requests = args.upload_requests if name == "upload" else args.requests
+                log(f"{name}: {requests} requests, concurrency {args.concurrency}")
+                result = await run_scenario(getattr(runner, name), tokens, requests, args.concurrency)
+                report["results"][name] = result
+                log(f"  p50 {result['latency_ms'] and result['latency_ms']['p50']} ms, "
+                    f"{result['throughput_rps']} req/s, errors {result['errors']}")
+            report["service"] = service_stats()
+        if server is not None:
+            report["fake_openai"] = await http_get_json("127.0.0.1", args.openai_port, "/stats")
+        return report
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma‑separated, run in this order")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--upload-requests", type=int, default=10)
+    parser.add_argument("--upload-pages", type=int, default=20)
+    parser.add_argument("--kb-mode", default="vector", choices=("vector", "lexical", "hybrid"), help="retrieval mode of the query scenario")
+    parser.add_argument("--users", type=int, default=0, help="distinct users (default: one per worker)")
+    parser.add_argument("--openai-url", help="use this OpenAI‑compatible server instead of starting one")
+    parser.add_argument("--openai-port", type=int, default=8900)
+    fake_openai.add_arguments(parser)
+    parser.add_argument("--mongo-uri", help="use this MongoDB (scratch database) instead of the stand‑in")
+    parser.add_argument("--mongo-latency-ms", type=float, default=0.5, help="stand‑in latency per operation")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
@@ -0,0 +1,487 @@
+"""In‑process stand‑in for the subset of Motor the API uses.
+
+Documents live in Python dicts. Equality lookups on the leading field of a
+created index (``user_id``, ``kb_id``, ``username``…) are served from a hash
+index so per‑user queries don't scan every document, unique indexes are
+enforced, and every operation can be delayed by *latency* seconds to mimic
+a network round trip. Good enough to load‑test the service; not a database.
+"""
+
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+_MISSING = object()
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+def _get(doc: dict, path: str):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _set(doc: dict, path: str, value) -> None:
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def _unset(doc: dict, path: str) -> None:
+    *parents, last = path.split(".")
+    for part in parents:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(last, None)
+
+
+def _compare(value, op: str, operand) -> bool:
+    if op == "$exists":
+        return (value is not _MISSING) == bool(operand)
+    if op == "$in":
+        return value in operand
+    if op == "$nin":
+        return value not in operand
+    if op == "$ne":
+        return value != operand
+    if op == "$eq":
+        return value == operand
+    if value is _MISSING or value is None:
+        return False
+    try:
+        if op == "$gt":
+            return value > operand
+        if op == "$gte":
+            return value >= operand
+        if op == "$lt":
+            return value < operand
+        if op == "$lte":
+            return value <= operand
+    except TypeError:
+        return False
+    raise NotImplementedError(f"query operator {op}")
+
+
+def matches(doc: dict, query: Optional[dict]) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        else:
+            value = _get(doc, key)
+            if condition is None and value is _MISSING:
+                continue  # {field: None} also matches a missing field
+            if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+                if not all(_compare(value, op, operand) for op, operand in condition.items()):
+                    return False
+            elif value != condition and not (isinstance(value, list) and condition in value):
+                return False
+    return True
+
+
+def _project(doc: dict, projection) -> dict:
+    if not projection:
+        return _copy(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if fields and all(fields.values()):
+        out = {k: _copy(doc[k]) for k in fields if k in doc}
+    else:
+        out = {k: _copy(v) for k, v in doc.items() if projection.get(k, 1)}
+    if include_id and "_id" in doc:
+        out["_id"] = doc["_id"]
+    elif not include_id:
+        out.pop("_id", None)
+    return out
+
+
+def _sort_key(value):
+    # missing/null sort first, like in MongoDB
+    return (0, 0) if value is _MISSING or value is None else (1, value)
+
+
+class FakeCursor:
+    def __init__(self, collection: "FakeCollection", query: Optional[dict], projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+        self._docs: Optional[List[dict]] = None
+
+    def sort(self, key_or_list, direction: Optional[int] = None) -> "FakeCursor":
+        if isinstance(key_or_list, str):
+            self._sort = [(key_or_list, direction or 1)]
+        else:
+            self._sort = list(key_or_list)
+        return self
+
+    def skip(self, n: int) -> "FakeCursor":
+        self._skip = n
+        return self
+
+    def limit(self, n: int) -> "FakeCursor":
+        self._limit = n
+        return self
+
+    def batch_size(self, n: int) -> "FakeCursor":
+        return self
+
+    async def _evaluate(self) -> List[dict]:
+        if self._docs is None:
+            await self._collection._delay()
+            docs = list(self._collection._find(self._query))
+            for field, direction in reversed(self._sort):
+                docs.sort(key=lambda d: _sort_key(_get(d, field)), reverse=direction < 0)
+            docs = docs[self._skip:]
+            if self._limit:
+                docs = docs[: self._limit]
+            self._docs = [_project(d, self._projection) for d in docs]
+        return self._docs
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        docs = await self._evaluate()
+        return docs[:length] if length else list(docs)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in await self._evaluate():
+            yield doc
+
+
+class FakeCollection:
+    def __init__(self, database: "FakeDatabase", name: str):
+        self.database = database
+        self.name = name
+        self._docs: Dict[Any, dict] = {}
+        self._seqs: Dict[Any, int] = {}  # insertion order by _id
+        self._unique: List[List[str]] = []
+        # leading index field -> value -> _ids
+        self._postings: Dict[str, Dict[Any, Set[Any]]] = {}
+
+    async def _delay(self) -> None:
+        if self.database.client.latency:
+            await asyncio.sleep(self.database.client.latency)
+        else:
+            await asyncio.sleep(0)
+
+    # ----------------------------- Indexing ----------------------------- #
+
+    async def create_index(self, keys, name: Optional[str] = None, unique: bool = False, **options) -> str:
+        keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        fields = [field for field, _direction in keys]
+        if unique and fields not in self._unique:
+            self._unique.append(fields)
+        leading = fields[0]
+        if leading != "_id" and leading not in self._postings:
+            postings: Dict[Any, Set[Any]] = {}
+            for _id, doc in self._docs.items():
+                postings.setdefault(self._hashable(_get(doc, leading)), set()).add(_id)
+            self._postings[leading] = postings
+        return name or "_".join(f"{f}_{d}" for f, d in keys)
+
+    @staticmethod
+    def _hashable(value):
+        try:
+            hash(value)
+            return value
+        except TypeError:
+            return repr(value)
+
+    def _index(self, doc: dict) -> None:
+        for field, postings in self._postings.items():
+            postings.setdefault(self._hashable(_get(doc, field)), set()).add(doc["_id"])
+
+    def _unindex(self, doc: dict) -> None:
+        for field, postings in self._postings.items():
+            ids = postings.get(self._hashable(_get(doc, field)))
+            if ids is not None:
+                ids.discard(doc["_id"])
+
+    def _check_unique(self, doc: dict, ignore_id=_MISSING) -> None:
+        if doc["_id"] in self._docs and doc["_id"] != ignore_id:
+            raise DuplicateKeyError(f"E11000 duplicate key {self.name} _id", 11000)
+        for fields in self._unique:
+            values = [_get(doc, f) for f in fields]
+            for other in self._find({f: v for f, v in zip(fields, values) if v is not _MISSING}):
+                if other["_id"] != doc["_id"] and [_get(other, f) for f in fields] == values:
+                    raise DuplicateKeyError(f"E11000 duplicate key {self.name} {fields}", 11000)
+
+    def _find(self, query: Optional[dict]) -> Iterable[dict]:
+        query = query or {}
+        if "_id" in query and not isinstance(query["_id"], dict):
+            doc = self._docs.get(query["_id"])
+            return [doc] if doc is not None and matches(doc, query) else []
+        candidates = None
+        for field, postings in self._postings.items():
+            condition = query.get(field, _MISSING)
+            if condition is not _MISSING and not isinstance(condition, dict):
+                ids = postings.get(self._hashable(condition), set())
+                candidates = ids if candidates is None or len(ids) < len(candidates) else candidates
+        if candidates is None:
+            source = list(self._docs.values())
+        else:
+            # keep insertion order, like a natural‑order scan
+            source = [self._docs[i] for i in sorted(candidates, key=self._seqs.__getitem__)]
+        return [doc for doc in source if matches(doc, query)]
+
+    # ------------------------------ Writes ------------------------------ #
+
+    def _store(self, doc: dict) -> None:
+        doc.setdefault("_id", ObjectId())
+        self._check_unique(doc)
+        self._seqs[doc["_id"]] = self.database.client.next_seq()
+        self._docs[doc["_id"]] = doc
+        self._index(doc)
+
+    async def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        await self._delay()
+        document.setdefault("_id", ObjectId())
+        self._store(_copy(document))
+        return InsertOneResult(document["_id"], True)
+
+    async def insert_many(self, documents: List[dict], ordered: bool = True, **kwargs) -> InsertManyResult:
+        await self._delay()
+        inserted, errors = [], []
+        for index, document in enumerate(documents):
+            document.setdefault("_id", ObjectId())
+            try:
+                self._store(_copy(document))
+                inserted.append(document["_id"])
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(inserted)})
+        return InsertManyResult(inserted, True)
+
+    @staticmethod
+    def _apply(doc: dict, update: dict, inserting: bool) -> None:
+        for op, fields in update.items():
+            if op == "$setOnInsert" and not inserting:
+                continue
+            for path, value in fields.items():
+                current = _get(doc, path)
+                if op in ("$set", "$setOnInsert"):
+                    _set(doc, path, _copy(value))
+                elif op == "$unset":
+                    _unset(doc, path)
+                elif op == "$inc":
+                    _set(doc, path, (0 if current is _MISSING else current) + value)
+                elif op == "$max":
+                    if current is _MISSING or value > current:
+                        _set(doc, path, value)
+                elif op == "$min":
+                    if current is _MISSING or value < current:
+                        _set(doc, path, value)
+                elif op == "$push":
+                    _set(doc, path, ([] if current is _MISSING else current) + [_copy(value)])
+                else:
+                    raise NotImplementedError(f"update operator {op}")
+
+    def _update(self, doc: dict, update: dict) -> dict:
+        updated = _copy(doc)
+        if any(k.startswith("$") for k in update):
+            self._apply(updated, update, inserting=False)
+        else:
+            updated = {**_copy(update), "_id": doc["_id"]}
+        self._check_unique(updated, ignore_id=doc["_id"])
+        self._unindex(doc)
+        self._docs[doc["_id"]] = updated
+        self._index(updated)
+        return updated
+
+    def _upsert(self, query: dict, update: dict) -> dict:
+        doc = {k: _copy(v) for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+        if any(k.startswith("$") for k in update):
+            self._apply(doc, update, inserting=True)
+        else:
+            doc.update(_copy(update))
+        self._store(doc)
+        return doc
+
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        await self._delay()
+        found = self._find(filter)
+        if found:
+            self._update(found[0], update)
+            return UpdateResult({"n": 1, "nModified": 1}, True)
+        if upsert:
+            doc = self._upsert(filter, update)
+            return UpdateResult({"n": 1, "nModified": 0, "upserted": doc["_id"]}, True)
+        return UpdateResult({"n": 0, "nModified": 0}, True)
+
+    async def update_many(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        await self._delay()
+        found = self._find(filter)
+        for doc in found:
+            self._update(doc, update)
+        if not found and upsert:
+            doc = self._upsert(filter, update)
+            return UpdateResult({"n": 1, "nModified": 0, "upserted": doc["_id"]}, True)
+        return UpdateResult({"n": len(found), "nModified": len(found)}, True)
+
+    async def bulk_write(self, requests: List[UpdateOne], ordered: bool = True, **kwargs) -> BulkWriteResult:
+        await self._delay()
+        matched = modified = 0
+        upserted, errors = [], []
+        for index, request in enumerate(requests):
+            if not isinstance(request, UpdateOne):
+                raise NotImplementedError(f"bulk operation {type(request).__name__}")
+            try:
+                found = self._find(request._filter)
+                if found:
+                    self._update(found[0], request._doc)
+                    matched += 1
+                    modified += 1
+                elif request._upsert:
+                    doc = self._upsert(request._filter, request._doc)
+                    upserted.append({"index": index, "_id": doc["_id"]})
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        result = {
+            "writeErrors": errors,
+            "nInserted": 0,
+            "nMatched": matched,
+            "nModified": modified,
+            "nUpserted": len(upserted),
+            "nRemoved": 0,
+            "upserted": upserted,
+        }
+        if errors:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    async def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return await self.update_one(filter, {k: v for k, v in replacement.items() if k != "_id"}, upsert)
+
+    async def find_one_and_update(
+        self,
+        filter: dict,
+        update: dict,
+        projection=None,
+        upsert: bool = False,
+        return_document=ReturnDocument.BEFORE,
+        **kwargs,
+    ) -> Optional[dict]:
+        await self._delay()
+        found = self._find(filter)
+        if found:
+            before = found[0]
+            after = self._update(before, update)
+        elif upsert:
+            before, after = None, self._upsert(filter, update)
+        else:
+            return None
+        doc = after if return_document == ReturnDocument.AFTER else before
+        return None if doc is None else _project(doc, projection)
+
+    async def delete_one(self, filter: dict, **kwargs) -> DeleteResult:
+        return await self._delete(filter, many=False)
+
+    async def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        return await self._delete(filter, many=True)
+
+    async def _delete(self, filter: dict, many: bool) -> DeleteResult:
+        await self._delay()
+        found = self._find(filter)
+        if not many:
+            found = found[:1]
+        for doc in found:
+            self._unindex(doc)
+            del self._docs[doc["_id"]]
+            del self._seqs[doc["_id"]]
+        return DeleteResult({"n": len(found)}, True)
+
+    # ------------------------------ Reads ------------------------------- #
+
+    def find(self, filter: Optional[dict] = None, projection=None, **kwargs) -> FakeCursor:
+        return FakeCursor(self, filter, projection)
+
+    async def find_one(self, filter: Optional[dict] = None, projection=None, **kwargs) -> Optional[dict]:
+        docs = await self.find(filter, projection).limit(1).to_list(1)
+        return docs[0] if docs else None
+
+    async def distinct(self, key: str, filter: Optional[dict] = None, **kwargs) -> List[Any]:
+        await self._delay()
+        values = []
+        for doc in self._find(filter):
+            value = _get(doc, key)
+            if value is not _MISSING and value not in values:
+                values.append(value)
+        return values
+
+    async def count_documents(self, filter: Optional[dict] = None, **kwargs) -> int:
+        await self._delay()
+        return len(self._find(filter))
+
+    async def estimated_document_count(self, **kwargs) -> int:
+        return len(self._docs)
+
+    async def drop(self) -> None:
+        self.database._collections.pop(self.name, None)
+
+
+class FakeDatabase:
+    def __init__(self, client: "FakeMongoClient", name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = FakeCollection(self, name)
+        return collection
+
+    def stats(self) -> Dict[str, int]:
+        return {name: len(c._docs) for name, c in self._collections.items()}
+
+
+class FakeMongoClient:
+    """Drop‑in for ``AsyncIOMotorClient``; *latency* seconds per operation."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._databases: Dict[str, FakeDatabase] = {}
+        self._seq = 0
+
+    def next_seq(self) -> int:
+        self._seq += 1
+        return self._seq
+
+    def __getitem__(self, name: str) -> FakeDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = FakeDatabase(self, name)
+        return database
+
+    def close(self) -> None:
+        pass
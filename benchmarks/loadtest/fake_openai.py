@@ -0,0 +1,193 @@
+"""Local OpenAI‑compatible server for offline load tests.
+
+Implements ``POST /v1/chat/completions`` (plain and ``stream: true`` SSE)
+and ``POST /v1/embeddings`` with deterministic unit vectors, plus
+``GET /stats``. Latency is shaped by:
+
+* ``ttft_ms`` – delay before the first token (or before anything, for plain
+  completions),
+* ``token_rate`` – tokens/sec after that (0 = all at once),
+* ``reply_tokens`` – length of every reply,
+* ``embed_latency_ms`` – delay of an embeddings call,
+* ``error_rate`` – fraction of requests answered with ``429`` and a
+  ``retry-after-ms`` header.
+
+Run standalone and point the API at it with ``OPENAI_BASE_URL``::
+
+    python -m benchmarks.loadtest.fake_openai --port 8900 --ttft-ms 300 --token-rate 60
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 uvicorn app.main:app
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import time
+import uuid
+
+import numpy as np
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+EMBEDDING_DIM = 1536
+WORDS = ("alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel")
+
+
+def embedding(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Unit vector determined by *text* – equal texts embed equally."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def build_app(
+    ttft_ms: float = 200,
+    token_rate: float = 50,
+    reply_tokens: int = 100,
+    embed_latency_ms: float = 50,
+    error_rate: float = 0.0,
+) -> Starlette:
+    stats = {"chat": 0, "chat_stream": 0, "embeddings": 0, "embedded_inputs": 0, "rate_limited": 0}
+    delay = 1 / token_rate if token_rate else 0
+
+    def throttled():
+        if error_rate and random.random() < error_rate:
+            stats["rate_limited"] += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"retry-after-ms": str(random.randint(50, 250))},
+            )
+        return None
+
+    def tokens():
+        return [" " + WORDS[i % len(WORDS)] for i in range(reply_tokens)]
+
+    async def chat(request: Request):
+        rejected = throttled()
+        if rejected is not None:
+            return rejected
+        body = await request.json()
+        model = body.get("model", "gpt-4.1")
+        prompt_tokens = sum(len(str(m.get("content") or "")) // 4 + 4 for m in body.get("messages", []))
+        created = int(time.time())
+        completion_id = "chatcmpl-" + uuid.uuid4().hex
+
+        if not body.get("stream"):
+            stats["chat"] += 1
+            await asyncio.sleep(ttft_ms / 1000 + reply_tokens * delay)
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens()).strip()},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": reply_tokens,
+                    "total_tokens": prompt_tokens + reply_tokens,
+                },
+            })
+
+        stats["chat_stream"] += 1
+
+        def chunk(delta: dict, finish_reason=None) -> bytes:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return b"data: " + json.dumps(payload).encode() + b"\n\n"
+
+        async def events():
+            await asyncio.sleep(ttft_ms / 1000)
+            yield chunk({"role": "assistant", "content": ""})
+            for i, token in enumerate(tokens()):
+                if i and delay:
+                    await asyncio.sleep(delay)
+                yield chunk({"content": token})
+            yield chunk({}, "stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": reply_tokens,
+                    "total_tokens": prompt_tokens + reply_tokens,
+                }
+                yield b"data: " + json.dumps({
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [],
+                    "usage": usage,
+                }).encode() + b"\n\n"
+            yield b"data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def embeddings(request: Request):
+        rejected = throttled()
+        if rejected is not None:
+            return rejected
+        body = await request.json()
+        inputs = body["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        stats["embeddings"] += 1
+        stats["embedded_inputs"] += len(inputs)
+        await asyncio.sleep(embed_latency_ms / 1000)
+        as_base64 = body.get("encoding_format") == "base64"
+        data = []
+        for i, text in enumerate(inputs):
+            vector = embedding(str(text))
+            value = base64.b64encode(vector.tobytes()).decode() if as_base64 else vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": value})
+        tokens_used = sum(len(str(text)) // 4 + 1 for text in inputs)
+        return JSONResponse({
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "text-embedding-ada-002"),
+            "usage": {"prompt_tokens": tokens_used, "total_tokens": tokens_used},
+        })
+
+    async def get_stats(request: Request):
+        return JSONResponse(stats)
+
+    return Starlette(routes=[
+        Route("/v1/chat/completions", chat, methods=["POST"]),
+        Route("/v1/embeddings", embeddings, methods=["POST"]),
+        Route("/stats", get_stats),
+    ])
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--ttft-ms", type=float, default=200, help="delay before the first token")
+    parser.add_argument("--token-rate", type=float, default=50, help="tokens/sec per reply, 0 = instant")
+    parser.add_argument("--reply-tokens", type=int, default=100)
+    parser.add_argument("--embed-latency-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+
+
+def app_from_args(args: argparse.Namespace) -> Starlette:
+    return build_app(args.ttft_ms, args.token_rate, args.reply_tokens, args.embed_latency_ms, args.error_rate)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(app_from_args(args), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,108 @@
+"""Pages/sec of process‑pool PDF extraction versus the single‑threaded path.
+
+Run from the repository root::
+
+    python -m benchmarks.pdf_extract --pdf manual.pdf
+    python -m benchmarks.pdf_extract --generate 400 --workers 1 2 4 8
+
+``--generate`` writes a synthetic text‑only PDF so the benchmark can run
+without a sample document.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import PyPDF2
+
+from app.config import settings
+from app.services import pdf_extract
+
+
+def generate_pdf(path: str, pages: int, lines_per_page: int = 45) -> None:
+    """Write a minimal PDF with *pages* pages of Helvetica text."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in below
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for p in range(pages):
+        lines = [f"Page {p + 1} line {i}: the quick brown fox jumps over the lazy dog {i * p}" for i in range(lines_per_page)]
+        ops = ["BT", "/F1 10 Tf", "12 TL", "40 800 Td"]
+        ops += [f"({line}) Tj T*" for line in lines]
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids),
+        pages,
+    )
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % num + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % off for off in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as fh:
+        fh.write(out)
+
+
+def single_threaded(path: str) -> int:
+    reader = PyPDF2.PdfReader(path)
+    return len([page.extract_text() or "" for page in reader.pages])
+
+
+async def pooled(path: str) -> int:
+    pages = 0
+    async for _text in pdf_extract.iter_pages(path, max_pages=0, max_text_bytes=0):
+        pages += 1
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdf", help="PDF to extract")
+    parser.add_argument("--generate", type=int, default=200, help="pages of synthetic PDF when --pdf is not given")
+    parser.add_argument("--workers", type=int, nargs="+", default=[os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    path = args.pdf
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "synthetic.pdf")
+        generate_pdf(path, args.generate)
+
+    t0 = time.perf_counter()
+    pages = single_threaded(path)
+    baseline = pages / (time.perf_counter() - t0)
+    report = {"pages": pages, "single_threaded_pages_per_s": round(baseline, 1), "pool": []}
+
+    for workers in args.workers:
+        settings.pdf_extract_workers = workers
+        pdf_extract.shutdown()
+        # Warm the pool so process start‑up isn't billed to extraction.
+        asyncio.run(pooled(path))
+        t0 = time.perf_counter()
+        asyncio.run(pooled(path))
+        rate = pages / (time.perf_counter() - t0)
+        report["pool"].append({"workers": workers, "pages_per_s": round(rate, 1), "speedup": round(rate / baseline, 2)})
+    pdf_extract.shutdown()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
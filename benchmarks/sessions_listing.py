@@ -0,0 +1,103 @@
+"""Sidebar query cost: aggregating ``messages`` vs reading ``sessions``.
+
+Needs a reachable MongoDB (``MONGODB_URI``). Seeds a scratch database with one
+user owning ``--messages`` messages spread over ``--sessions`` sessions, builds
+both representations and times each query::
+
+    python -m benchmarks.sessions_listing --messages 100000 --sessions 2000
+
+The scratch database is dropped afterwards unless ``--keep`` is given.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.config import settings
+
+
+def legacy_pipeline(user_id: str, limit: int):
+    return [
+        {"$match": {"user_id": user_id}},
+        {"$sort": {"timestamp": -1}},
+        {"$group": {"_id": "$session_id", "last_message": {"$first": "$content"}, "timestamp": {"$first": "$timestamp"}}},
+        {"$sort": {"timestamp": -1}},
+        {"$limit": limit},
+    ]
+
+
+async def timeit(fn, repeats: int):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "p50_ms": round(statistics.median(samples), 2),
+        "max_ms": round(max(samples), 2),
+    }
+
+
+async def main(args):
+    client = AsyncIOMotorClient(settings.mongodb_uri)
+    scratch = client[args.database]
+    messages, sessions = scratch["messages"], scratch["sessions"]
+    user_id = "bench-user"
+
+    await client.drop_database(args.database)
+    await messages.create_index([("user_id", 1), ("timestamp", 1)])
+    await sessions.create_index([("user_id", 1), ("timestamp", -1)])
+
+    base = datetime.utcnow() - timedelta(days=365)
+    batch, latest = [], {}
+    for i in range(args.messages):
+        session_id = f"s{i % args.sessions}"
+        ts = base + timedelta(seconds=i)
+        batch.append({"user_id": user_id, "session_id": session_id, "role": "user", "content": f"message {i}", "timestamp": ts})
+        latest[session_id] = (f"message {i}", ts, latest.get(session_id, (None, None, 0))[2] + 1)
+        if len(batch) == 10000:
+            await messages.insert_many(batch)
+            batch = []
+    if batch:
+        await messages.insert_many(batch)
+    await sessions.insert_many(
+        [
+            {"user_id": user_id, "session_id": sid, "last_message": msg, "timestamp": ts, "message_count": count, "title": msg}
+            for sid, (msg, ts, count) in latest.items()
+        ]
+    )
+
+    async def aggregate():
+        await messages.aggregate(legacy_pipeline(user_id, args.limit), allowDiskUse=True).to_list(length=args.limit)
+
+    async def materialised():
+        await sessions.find({"user_id": user_id}).sort("timestamp", -1).limit(args.limit).to_list(length=args.limit)
+
+    report = {
+        "messages": args.messages,
+        "sessions": args.sessions,
+        "limit": args.limit,
+        "aggregate": await timeit(aggregate, args.repeats),
+        "sessions_collection": await timeit(materialised, args.repeats),
+    }
+    report["speedup"] = round(report["aggregate"]["p50_ms"] / max(report["sessions_collection"]["p50_ms"], 1e-3), 1)
+    print(json.dumps(report, indent=2))
+
+    if not args.keep:
+        await client.drop_database(args.database)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--database", default="bench_sessions_listing")
+    parser.add_argument("--keep", action="store_true")
+    asyncio.run(main(parser.parse_args()))
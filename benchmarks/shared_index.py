@@ -0,0 +1,160 @@
+"""Host memory of a KB index as the number of workers grows.
+
+Run from the repository root::
+
+    python -m benchmarks.shared_index --rows 20000 --dim 1536 --workers 1,2,4,8
+
+A synthetic KB is published once with :mod:`app.services.shared_index`.
+Then for each worker count, that many fresh interpreters load it and run a
+few exact, lexical and hybrid queries, so every page is touched. The
+interpreters load it either ``private`` (a heap copy per worker, like
+loading from Mongo) or ``shared`` (mapped from the published file). With
+all of them still alive, the proportional set size (PSS) of each is read
+from ``/proc/<pid>/smaps_rollup``. Shared pages are split between the
+processes that map them, so the sum over workers is the host's real cost.
+The same number of interpreters that only import the app gives the
+baseline, which is subtracted. Linux only.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+USER_ID = "bench"
+KB_ID = "shared-index-bench"
+
+
+def pss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/smaps_rollup") as fh:
+        for line in fh:
+            if line.startswith("Pss:"):
+                return int(line.split()[1])
+    raise RuntimeError("no Pss in smaps_rollup")
+
+
+def worker(mode: str, queries: int) -> None:
+    import numpy as np
+
+    from app.services import shared_index
+    from app.services.lexical_index import LexicalIndex
+    from app.services.vector_index import KBIndex
+
+    t0 = time.perf_counter()
+    if mode != "baseline":
+        index = shared_index.open_index(USER_ID, KB_ID)
+        if mode == "private":
+            lexical = index.lexical
+            vocabulary = dict(zip(lexical.vocabulary.terms, lexical.vocabulary.ids.tolist()))
+            index = KBIndex(
+                np.array(index.matrix),
+                list(index.texts),
+                np.array(index.chunk_indices),
+                LexicalIndex(vocabulary, np.array(lexical.offsets), np.array(lexical.rows), np.array(lexical.weights), len(index)),
+                normalized=True,
+            )
+            del lexical  # drop the mapping the copy was made from
+        load_ms = (time.perf_counter() - t0) * 1000
+        rng = np.random.default_rng(os.getpid())
+        for i in range(queries):
+            vector = rng.standard_normal(index.matrix.shape[1])
+            text = f"w{i} part PN-{i:06d}"
+            index.search(vector, 3, exact=True)
+            index.search_lexical(text, 3)
+            index.search_hybrid(text, vector, 3, exact=True)
+    else:
+        load_ms = 0.0
+    print(json.dumps({"load_ms": load_ms}), flush=True)
+    sys.stdin.read()  # stay alive until the parent has measured everyone
+
+
+def measure(mode: str, workers: int, queries: int, env: dict) -> dict:
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.shared_index", "--worker", mode, "--queries", str(queries)],
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        for _ in range(workers)
+    ]
+    try:
+        loads = [json.loads(proc.stdout.readline())["load_ms"] for proc in procs]
+        pss = [pss_kb(proc.pid) for proc in procs]
+    finally:
+        for proc in procs:
+            proc.stdin.close()
+            proc.wait()
+    return {"pss_kb": pss, "load_ms": max(loads)}
+
+
+def publish(args) -> int:
+    import numpy as np
+
+    from app.services import shared_index
+    from app.services.vector_index import KBIndex
+
+    rng = np.random.default_rng(args.seed)
+    ranks = np.arange(1, args.vocabulary + 1)
+    p = 1 / ranks
+    p /= p.sum()
+    words = rng.choice(args.vocabulary, size=(args.rows, args.words), p=p)
+    texts = [" ".join(f"w{w}" for w in row) + f" part PN-{i:06d}" for i, row in enumerate(words)]
+    matrix = rng.standard_normal((args.rows, args.dim)).astype(np.float32)
+    shared_index.publish(USER_ID, KB_ID, KBIndex(matrix, texts, range(args.rows)))
+    return shared_index.manifest(USER_ID, KB_ID)["bytes"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--words", type=int, default=120, help="words per chunk")
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--queries", type=int, default=20, help="queries per worker")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--worker", choices=("baseline", "private", "shared"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.queries)
+        return
+
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "sk-shared-index")
+    env.setdefault("JWT_SECRET_KEY", "shared-index")
+    env["KB_INDEX_DIR"] = tempfile.mkdtemp(prefix="shared-index-")
+    os.environ.update(env)
+    index_bytes = publish(args)
+
+    counts = [int(n) for n in args.workers.split(",")]
+    baseline = {count: sum(measure("baseline", count, 0, env)["pss_kb"]) for count in counts}
+    report = {
+        "rows": args.rows,
+        "dim": args.dim,
+        "index_mb": round(index_bytes / 2**20, 1),
+        "baseline_worker_mb": round(baseline[counts[0]] / 1024 / counts[0], 1),
+        "modes": {},
+    }
+    for mode in ("private", "shared"):
+        rows = []
+        for count in counts:
+            result = measure(mode, count, args.queries, env)
+            extra = sum(result["pss_kb"]) - baseline[count]
+            rows.append({
+                "workers": count,
+                "host_mb": round(extra / 1024, 1),
+                "per_worker_mb": round(extra / 1024 / count, 1),
+                "slowest_load_ms": round(result["load_ms"], 1),
+            })
+        report["modes"][mode] = rows
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Tokens/sec per worker for /chat/stream framing under concurrent streams.
+
+Serves minimal streaming endpoints through the real ASGI stack (FastAPI +
+StreamingResponse, called in‑process as an ASGI app) and drives them with
+``--streams`` concurrent requests:
+
+* ``per_token`` – the old framing: one ``json.dumps`` + write (and a stdout
+  print) per delta;
+* ``coalesced`` – :func:`app.services.stream_framing.coalesce` + FrameEncoder,
+  in JSON‑lines and SSE flavours.
+
+Upstream deltas are generated locally at ``--token-rate`` tokens/sec per
+stream (0 = as fast as possible), so the numbers measure framing overhead
+only::
+
+    python -m benchmarks.stream_framing --streams 200 --tokens 500
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from app.services.stream_framing import JSONL, SSE, FrameEncoder, coalesce
+
+
+def build_app(tokens: int, token_rate: float) -> FastAPI:
+    app = FastAPI()
+    delay = 1 / token_rate if token_rate else 0
+
+    async def upstream():
+        for i in range(tokens):
+            if delay:
+                await asyncio.sleep(delay)
+            elif i % 16 == 0:
+                await asyncio.sleep(0)
+            yield "tok "
+
+    @app.post("/per_token")
+    async def per_token():
+        async def gen():
+            async for token in upstream():
+                print(token, end="", flush=True)
+                yield json.dumps({"token": token}) + "\n"
+            yield json.dumps({"done": True}) + "\n"
+
+        return StreamingResponse(gen(), media_type=JSONL)
+
+    def framed(media_type):
+        async def endpoint():
+            frames = FrameEncoder(media_type)
+
+            async def gen():
+                async for text in coalesce(upstream()):
+                    yield frames.encode({"token": text})
+                yield frames.encode({"done": True})
+
+            return StreamingResponse(gen(), media_type=frames.media_type)
+
+        return endpoint
+
+    app.post("/coalesced")(framed(JSONL))
+    app.post("/coalesced_sse")(framed(SSE))
+    return app
+
+
+async def request(app: FastAPI, path: str) -> int:
+    """Issue one POST straight at the ASGI app; returns body frames received."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    frames = 0
+    requested = False
+    complete = asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # like a well-behaved client: only "disconnect" once the body is done
+        await complete.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal frames
+        if message["type"] == "http.response.body":
+            if message.get("body"):
+                frames += 1
+            if not message.get("more_body", False):
+                complete.set()
+
+    await app(scope, receive, send)
+    return frames
+
+
+async def drive(app: FastAPI, path: str, streams: int):
+    start = time.perf_counter()
+    frames = await asyncio.gather(*(request(app, path) for _ in range(streams)))
+    return time.perf_counter() - start, sum(frames)
+
+
+async def main(args):
+    app = build_app(args.tokens, args.token_rate)
+    report = {"streams": args.streams, "tokens_per_stream": args.tokens, "token_rate": args.token_rate, "results": {}}
+    for path in ("/per_token", "/coalesced", "/coalesced_sse"):
+        # keep the per-token prints off the terminal but still pay for them
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed, frames = await drive(app, path, args.streams)
+        total = args.streams * args.tokens
+        report["results"][path.strip("/")] = {
+            "seconds": round(elapsed, 3),
+            "tokens_per_s": round(total / elapsed),
+            "frames": frames,
+            "tokens_per_frame": round(total / max(frames, 1), 1),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", type=int, default=100)
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--token-rate", type=float, default=0, help="tokens/sec per stream, 0 = unthrottled")
+    asyncio.run(main(parser.parse_args()))
@@ -47,11 +47,20 @@ function Chat() {
     try {
       const formData = new FormData();
       formData.append('file', file);
-      await api.post('/kb/upload', formData, {
+      const resp = await api.post('/kb/upload', formData, {
         headers: { 'Content-Type': 'multipart/form-data' },
       });
-      await loadKbs();
       e.target.value = '';
+      // ingestion runs in the background – poll the job until it settles
+      let job = resp.data;
+      while (job.status === 'queued' || job.status === 'running') {
+        await new Promise((r) => setTimeout(r, 1500));
+        job = (await api.get(`/kb/jobs/${job.job_id}`)).data;
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Ingestion failed');
+      }
+      await loadKbs();
     } catch (err) {
       console.error('Upload failed', err);
       alert('Failed to upload PDF');